@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Payload size and encode/decode time of the JSON and CBOR codecs for
+typical batch responses
+
+    % python benchmarks/codecs.py
+"""
+from __future__ import print_function
+
+import random
+import timeit
+
+from jsonrpc import jsonutil
+from jsonrpc.common import Response
+
+
+def payloads():
+    rnd = random.Random(0)
+    floats = [Response(id=n, result=[rnd.random() * 1000 for _ in range(1000)])
+              for n in range(10)]
+    ints = [Response(id=n, result=[rnd.randint(-10 ** 9, 10 ** 9)
+                                   for _ in range(1000)])
+            for n in range(10)]
+    records = [Response(id=n, result=[dict(name=u'item %d' % i, price=i * 0.25,
+                                           tags=[u'a', u'b'], stock=i)
+                                      for i in range(100)])
+               for n in range(10)]
+    return [('floats', floats), ('ints', ints), ('records', records)]
+
+
+def main(number=20):
+    codecs = [jsonutil.get_codec(), jsonutil.get_codec('cbor')]
+    print('%-8s %-10s %10s %12s %12s' % ('payload', 'codec', 'bytes',
+                                         'encode ms', 'decode ms'))
+    for name, obj in payloads():
+        for codec in codecs:
+            data = codec.to_bytes(obj)
+            encode = min(timeit.repeat(lambda: codec.to_bytes(obj),
+                                       repeat=3, number=number)) / number
+            decode = min(timeit.repeat(lambda: codec.decode(data),
+                                       repeat=3, number=number)) / number
+            print('%-8s %-10s %10d %12.2f %12.2f' % (name, codec.name, len(data),
+                                                     encode * 1e3, decode * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""Per-call cost of the request id generators in :py:mod:`jsonrpc.proxy`
+
+    % python benchmarks/idgen.py
+"""
+from __future__ import print_function
+
+import timeit
+
+from jsonrpc.proxy import IDGen, HashIDGen
+
+
+class Events(object):
+    IDGen = IDGen()
+    HashIDGen = HashIDGen()
+
+events = Events()
+
+
+def main(number=200000):
+    for name in ('IDGen', 'HashIDGen'):
+        timer = timeit.Timer('events.%s' % name, 'from __main__ import events')
+        best = min(timer.repeat(3, number))
+        print('%-10s %8.3f usec/id' % (name, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Latency and calls per second of a trivial method over the transports:
+HTTP over TCP loopback and over a unix socket, newline-delimited JSON over
+TCP and the shared memory rings.  The servers run in a separate process.
+
+    % python benchmarks/transports.py
+"""
+from __future__ import print_function
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+
+from jsonrpc.proxy import JSONRPCProxy
+from jsonrpc.server import JSON_RPC, ServerEvents
+from jsonrpc.shm import ShmJSON_RPC, ShmJSONRPCProxy, ShmJSONRPCServer
+from jsonrpc.tcpproxy import TCPJSONRPCProxy
+from jsonrpc.tcpserver import StreamJSON_RPC, TCPJSONRPCServer
+from jsonrpc.unixserver import UnixHTTPServer
+
+
+class Events(ServerEvents):
+    def findmethod(self, method, args=None, kwargs=None):
+        return dict(echo=lambda value: value).get(method)
+
+
+class HTTPHandler(JSON_RPC):
+    keepalive = True
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def run_servers(tmpdir, urls, stop):
+    '''Run in the server process'''
+    handler = HTTPHandler.customize(Events)
+    http = serve(ThreadedHTTPServer(('localhost', 0), handler))
+    serve(UnixHTTPServer(os.path.join(tmpdir, 'rpc.sock'), handler))
+    tcp = serve(TCPJSONRPCServer(('localhost', 0), StreamJSON_RPC.customize(Events)))
+    shm = serve(ShmJSONRPCServer(os.path.join(tmpdir, 'segment'),
+                                 ShmJSON_RPC.customize(Events)))
+    urls.put([
+        ('http', 'http://localhost:%d/jsonrpc' % http.server_address[1]),
+        ('http+unix', 'unix://' + os.path.join(tmpdir, 'rpc.sock')),
+        ('tcp', 'tcp://localhost:%d' % tcp.server_address[1]),
+        ('shm', 'shm://' + os.path.join(tmpdir, 'segment')),
+    ])
+    stop.wait()
+    shm.shutdown()
+    shm.server_close()
+
+
+proxies = {
+    'tcp': TCPJSONRPCProxy,
+    'shm': ShmJSONRPCProxy,
+}
+
+
+def rate(proxy, threads, calls):
+    def run():
+        for n in xrange(calls):
+            proxy.echo(n)
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * calls / (time.time() - start)
+
+
+def main(calls=4000):
+    tmpdir = tempfile.mkdtemp()
+    urls, stop = multiprocessing.Queue(), multiprocessing.Event()
+    server = multiprocessing.Process(target=run_servers, args=(tmpdir, urls, stop))
+    server.start()
+    print('%-10s %12s %14s' % ('transport', 'latency', '8 threads'))
+    try:
+        for name, url in urls.get():
+            proxy = proxies.get(name, JSONRPCProxy).from_url(url)
+            proxy.echo(0)
+            latency = 1 / rate(proxy, 1, calls)
+            print('%-10s %9.0f us %12.0f/s' % (name, latency * 1e6,
+                                               rate(proxy, 8, calls // 8)))
+    finally:
+        stop.set()
+        server.join()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+
+"""
+A JSON-RPC proxy which does not block on calls.
+
+Every call returns a :py:class:`jsonrpc.utilities.Future` right away, the
+requests are sent over a pool of non-blocking keep-alive connections driven
+by a single :py:mod:`asyncore` loop thread, so hundreds of calls can be in
+flight at once without one thread per call:
+
+    proxy = AsyncJSONRPCProxy.from_url('http://localhost:8007/jsonrpc')
+    futures = [proxy.add(n, 1) for n in range(100)]
+    results = [f.result() for f in futures]
+
+Callbacks added with :py:meth:`Future.add_done_callback` run in the loop
+thread and must not block.
+"""
+
+import asynchat
+import asyncore
+import collections
+import mimetools
+import socket
+import sys
+import threading
+import urlparse
+from cStringIO import StringIO
+
+import jsonrpc.jsonutil
+from jsonrpc import __version__
+from jsonrpc.asyncserver import Trigger
+from jsonrpc.common import Response
+from jsonrpc.proxy import JSONRPCProxy, _calls
+from jsonrpc.utilities import public, Future
+
+
+class AsyncHTTPConnection(asynchat.async_chat):
+    '''A non-blocking HTTP/1.1 connection which carries one request at a time'''
+
+    def __init__(self, client, address):
+        asynchat.async_chat.__init__(self, map=client.map)
+        self.client = client
+        self.address = address
+        #: the request in flight, see :py:meth:`AsyncHTTPClient.post`
+        self.request = None
+        #: True once the connection carried a request
+        self.reused = False
+        self._incoming = []
+        self._response = None
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect(address)
+        except socket.error:
+            self.close()
+            raise
+
+    def send_request(self, request):
+        address, host, path, body, future = request
+        self.request = request
+        self._incoming = []
+        self._response = None
+        self.set_terminator('\r\n\r\n')
+        self.push(''.join([
+            'POST %s HTTP/1.1\r\n' % path,
+            'Host: %s\r\n' % host,
+            'Content-Type: application/json\r\n',
+            'User-Agent: jsonrpc/%s\r\n' % __version__,
+            'Content-Length: %d\r\n' % len(body),
+            '\r\n',
+            body,
+        ]))
+
+    def collect_incoming_data(self, data):
+        self._incoming.append(data)
+
+    def found_terminator(self):
+        data = ''.join(self._incoming)
+        self._incoming = []
+        if self._response is not None:
+            return self._finish(data)
+
+        statusline, _, header = data.lstrip('\r\n').partition('\r\n')
+        version, status = statusline.split(None, 2)[:2]
+        headers = mimetools.Message(StringIO(header))
+        connection = (headers.getheader('connection') or '').lower()
+        if version == 'HTTP/1.0':
+            keepalive = connection == 'keep-alive'
+        else:
+            keepalive = connection != 'close'
+        length = headers.getheader('content-length')
+        self._response = (int(status), keepalive and length is not None)
+        if length is None:
+            # read until the server closes the connection
+            self.set_terminator(None)
+        elif int(length):
+            self.set_terminator(int(length))
+        else:
+            self._finish('')
+
+    def _finish(self, body):
+        status, keepalive = self._response
+        request, self.request = self.request, None
+        self._response = None
+        self.reused = True
+        self.set_terminator('\r\n\r\n')
+        if not keepalive:
+            self.close()
+        self.client._finished(self, request, status, body)
+
+    def handle_close(self):
+        if self._response is not None and self.get_terminator() is None:
+            return self._finish(''.join(self._incoming))
+        self.close()
+        request, self.request = self.request, None
+        if request is not None:
+            if self.reused and self._response is None and not self._incoming:
+                # the server closed an idle keep-alive connection before it
+                # saw our request, send it again on a fresh connection
+                self.client._retry(request)
+            else:
+                self.client._failed(request, IOError('connection closed'))
+
+    def handle_error(self):
+        exc = sys.exc_info()[1]
+        self.close()
+        request, self.request = self.request, None
+        if request is not None:
+            self.client._failed(request, exc)
+
+    def close(self):
+        if self.socket is not None:
+            asynchat.async_chat.close(self)
+            self.socket = None
+            self.client._discard(self)
+
+
+@public
+class AsyncHTTPClient(object):
+    '''Posts JSON-RPC requests over a pool of non-blocking connections,
+    the pool is shared by every proxy created from the same root proxy.
+    '''
+
+    #: Maximum number of open connections per host
+    max_connections = 32
+
+    def __init__(self, codec=None):
+        self.codec = jsonrpc.jsonutil.get_codec(codec)
+        self.map = {}
+        self.trigger = Trigger(self.map)
+        self._queue = collections.deque()
+        self._idle = collections.defaultdict(list)
+        self._open = collections.defaultdict(int)
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            asyncore.loop(30, True, self.map, 1)
+
+    def post(self, url, body):
+        '''Post `body` to `url`, can be called from any thread.
+
+        :returns: a :py:class:`Future` of the decoded response
+        '''
+        urlsp = urlparse.urlsplit(url)
+        if urlsp.scheme != 'http':
+            raise ValueError('unsupported url scheme: %r' % urlsp.scheme)
+        path = urlsp.path or '/'
+        if urlsp.query:
+            path = '{0}?{1}'.format(path, urlsp.query)
+        address = (urlsp.hostname, urlsp.port or 80)
+        future = Future()
+        self._queue.append((address, urlsp.netloc, path, body, future))
+        self.trigger.pull(self._dispatch)
+        return future
+
+    def close(self):
+        '''Close every connection and stop the loop thread'''
+        self._running = False
+        self.trigger.pull()
+        self._thread.join()
+        for dispatcher in self.map.values():
+            dispatcher.close()
+        while self._queue:
+            self._failed(self._queue.popleft(), IOError('client closed'))
+
+    # The following methods run in the loop thread
+    def _dispatch(self):
+        blocked = []
+        while self._queue:
+            request = self._queue.popleft()
+            try:
+                conn = self._connection(request[0])
+            except socket.error, exc:
+                self._failed(request, exc)
+                continue
+            if conn is None:
+                blocked.append(request)
+                continue
+            conn.send_request(request)
+        self._queue.extendleft(reversed(blocked))
+
+    def _connection(self, address):
+        idle = self._idle[address]
+        if idle:
+            return idle.pop()
+        if self._open[address] < self.max_connections:
+            self._open[address] += 1
+            return AsyncHTTPConnection(self, address)
+        return None
+
+    def _discard(self, conn):
+        self._open[conn.address] -= 1
+        if conn in self._idle[conn.address]:
+            self._idle[conn.address].remove(conn)
+        # a connection slot is free again
+        self.trigger.pull(self._dispatch)
+
+    def _retry(self, request):
+        self._queue.appendleft(request)
+        self._dispatch()
+
+    def _failed(self, request, exc):
+        request[4].set_exception(exc)
+
+    def _finished(self, conn, request, status, body):
+        if conn.socket is not None:
+            self._idle[conn.address].append(conn)
+        try:
+            data = self.codec.decode(body)
+        except ValueError:
+            self._failed(request, IOError('HTTP Error %d: %r' % (status, body)))
+        else:
+            # a connection carries one request at a time, the response is
+            # the one of its request whatever its id
+            request[4].set_result(data)
+        self._dispatch()
+
+
+@public
+class AsyncJSONRPCProxy(JSONRPCProxy):
+    '''A :py:class:`jsonrpc.proxy.JSONRPCProxy` whose calls return a
+    :py:class:`jsonrpc.utilities.Future` instead of the result.
+
+    The same :py:class:`jsonrpc.proxy.ProxyEvents` hooks are applied, use
+    ``proxy.close()`` on the root proxy to stop its connection pool.
+    Requests are always sent as JSON, a binary codec is not negotiated.
+    '''
+
+    def _build_opener(self):
+        return AsyncHTTPClient(self._json_codec)
+
+    def close(self):
+        JSONRPCProxy.close(self)
+        self._opener.close()
+
+    def _chain(self, future, convert):
+        result = Future()
+
+        def done(future):
+            try:
+                value = convert(future.result())
+            except BaseException, exc:
+                result.set_exception(exc)
+            else:
+                result.set_result(value)
+
+        future.add_done_callback(done)
+        return result
+
+    def __call__(self, *args, **kwargs):
+        request = self._get_request(args, kwargs)
+        postdata = self._json_codec.to_bytes(request)
+
+        def convert(data):
+            resp = Response.from_dict(data)
+            resp = self._eventhandler.proc_response(resp)
+            return resp.get_result()
+
+        future = self._opener.post(self._get_url(), postdata)
+        return self._chain(future, convert)
+
+    def batch_call(self, methods):
+        '''call several methods at once
+
+        :returns: a :py:class:`Future` of a list of pairs (result, error),
+                  see :py:meth:`jsonrpc.proxy.JSONRPCProxy.batch_call`
+        '''
+        requests = [getattr(self, k)._get_request(*v) for k, v in _calls(methods)]
+        postdata = self._json_codec.to_bytes(requests)
+
+        def convert(data):
+            resp = Response.from_json(data)
+            if isinstance(resp, Response):
+                # the whole batch was rejected, e.g. with a parse error
+                return [(None, resp.error)] * len(requests)
+            responses = dict((res.id, res.get_output()) for res in resp)
+            missing = (None, dict(code=0, message='no response to the request'))
+            return [responses.get(req.id, missing) for req in requests]
+
+        return self._chain(self._opener.post(self._get_url(), postdata), convert)
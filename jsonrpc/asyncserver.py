@@ -0,0 +1,392 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+
+"""
+An event driven HTTP server for :py:class:`jsonrpc.server.JSON_RPC_Base`.
+
+All connections are multiplexed by a single :py:mod:`asyncore` loop, so idle
+keep-alive connections cost a file descriptor but no thread.  Only requests
+which are actually being processed occupy one of the server's worker
+threads, the entries of batch calls are spread further over
+:py:attr:`JSON_RPC_Base.batch_workers`.
+
+    handler = AsyncJSON_RPC.customize(MyServerEvents)
+    httpd = AsyncHTTPServer(('', 8007), handler)
+    httpd.serve_forever()
+"""
+
+import asynchat
+import asyncore
+import collections
+import mimetools
+import os
+import socket
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+from jsonrpc import __version__
+from jsonrpc.compression import decompress
+from jsonrpc.server import JSON_RPC_Base
+from jsonrpc.utilities import public
+
+
+@public
+class AsyncJSON_RPC(JSON_RPC_Base):
+    '''A JSON_RPC_Base which processes a request parsed by
+    :py:class:`AsyncHTTPChannel`, one instance is created per request.
+    '''
+
+    def __init__(self, channel, command, path, request_version, headers, body):
+        self.channel = channel
+        self.client_address = channel.addr
+        self.command = command
+        self.path = path
+        self.request_version = request_version
+        self.headers = headers
+        self.body = body
+        #: (code, body) set by :py:meth:`write_data`
+        self.response = None
+
+    def get_request_string(self):
+        return "<{0} {1} {2}>".format(self.command, self.path, self.request_version)
+
+    def get_header(self, name):
+        return self.headers.getheader(name)
+
+    def read_data(self):
+        return decompress(self.body, self.headers.getheader('content-encoding') or '',
+                          self.max_decoded_size)
+
+    def write_data(self, code, result):
+        self.response = (code, result)
+
+
+class Trigger(asyncore.file_dispatcher):
+    '''Run callbacks posted from worker threads inside the asyncore loop'''
+
+    def __init__(self, map):
+        readfd, self._writefd = os.pipe()
+        asyncore.file_dispatcher.__init__(self, readfd, map)
+        os.close(readfd)
+        self._callbacks = collections.deque()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def pull(self, callback=None):
+        if callback is not None:
+            self._callbacks.append(callback)
+        try:
+            os.write(self._writefd, 'x')
+        except OSError:
+            # the pipe is full, the loop will wake up anyway
+            pass
+
+    def handle_read(self):
+        try:
+            self.recv(8192)
+        except (OSError, socket.error):
+            pass
+        while self._callbacks:
+            self._callbacks.popleft()()
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self._writefd)
+
+
+@public
+class AsyncHTTPChannel(asynchat.async_chat):
+    '''One HTTP connection, pipelined requests are answered in order.
+
+    Bodies are read by content-length or with chunked transfer-encoding,
+    their content-encoding is decoded by :py:class:`AsyncJSON_RPC`.
+    '''
+
+    #: Maximum number of parsed requests waiting on this connection before
+    #: it stops reading from the socket
+    max_pipeline = 16
+
+    def __init__(self, server, sock, addr):
+        asynchat.async_chat.__init__(self, sock, map=server.map)
+        self.server = server
+        self.addr = addr
+        self.last_activity = time.time()
+        self._incoming = []
+        self._request = None
+        self._chunks = []
+        # handles the data up to the terminator
+        self._reader = self._read_header
+        self._queue = collections.deque()
+        self._busy = False
+        # (code, message) of the error sent after the requests in the queue
+        self._rejected = None
+        self.set_terminator('\r\n\r\n')
+
+    def readable(self):
+        return self._rejected is None and len(self._queue) < self.max_pipeline
+
+    def handle_read(self):
+        self.last_activity = time.time()
+        asynchat.async_chat.handle_read(self)
+
+    @property
+    def idle(self):
+        return not (self._busy or self._queue or self._incoming)
+
+    def collect_incoming_data(self, data):
+        self._incoming.append(data)
+
+    def found_terminator(self):
+        data = ''.join(self._incoming)
+        self._incoming = []
+        self._reader(data)
+
+    def _expect(self, reader, terminator):
+        self._reader = reader
+        self.set_terminator(terminator)
+
+    def _read_header(self, data):
+        request = self._parse_header(data)
+        if request is None:
+            return
+        self._request = request
+        encoding = request[3].getheader('transfer-encoding') or ''
+        if encoding.lower() == 'chunked':
+            self._expect(self._read_chunk_size, '\r\n')
+            return
+        try:
+            length = int(request[3].getheader('content-length') or 0)
+        except ValueError:
+            self._reject(400, 'Bad content-length')
+            return
+        if length > 0:
+            self._expect(self._read_body, length)
+        else:
+            self._read_body('')
+
+    def _read_body(self, data):
+        request, self._request = self._request, None
+        self._expect(self._read_header, '\r\n\r\n')
+        self._queue.append(request + (data,))
+        self._next()
+
+    def _read_chunk_size(self, data):
+        try:
+            size = int(data.split(';', 1)[0], 16)
+        except ValueError:
+            self._reject(400, 'Bad chunk size (%r)' % data)
+            return
+        if size > 0:
+            self._expect(self._read_chunk, size)
+        else:
+            self._expect(self._read_trailer, '\r\n')
+
+    def _read_chunk(self, data):
+        self._chunks.append(data)
+        self._expect(self._read_chunk_end, '\r\n')
+
+    def _read_chunk_end(self, data):
+        # the line break which ends the chunk
+        self._expect(self._read_chunk_size, '\r\n')
+
+    def _read_trailer(self, data):
+        if data:
+            return
+        body, self._chunks = ''.join(self._chunks), []
+        self._read_body(body)
+
+    def _parse_header(self, data):
+        requestline, _, header = data.lstrip('\r\n').partition('\r\n')
+        words = requestline.split()
+        if len(words) != 3 or not words[2].startswith('HTTP/'):
+            self._reject(400, 'Bad request syntax (%r)' % requestline)
+            return None
+        command, path, version = words
+        return command, path, version, mimetools.Message(StringIO(header))
+
+    def _reject(self, code, message):
+        '''Stop reading, and answer with an error once the requests received
+        before have been answered'''
+        self._rejected = (code, message)
+        self.set_terminator(None)
+        self._next()
+
+    def _error(self, code, message):
+        self._queue.clear()
+        self.set_terminator(None)
+        self._send(code, message, 'text/plain', False)
+        self.close_when_done()
+
+    def _next(self):
+        if self._busy:
+            return
+        if not self._queue:
+            if self._rejected is not None:
+                self._error(*self._rejected)
+            return
+        command, path, version, headers, body = self._queue.popleft()
+        if command != 'POST':
+            self._error(501, 'Unsupported method (%r)' % command)
+            return
+        self._busy = True
+        handler = self.server.handler_class(self, command, path, version,
+                                            headers, body)
+        self.server.pool.apply_async(self._run, (handler,))
+
+    def _run(self, handler):
+        '''Called by a worker thread'''
+        try:
+            handler.handle_request()
+        finally:
+            self.server.trigger.pull(lambda: self._finish(handler))
+
+    def _finish(self, handler):
+        self._busy = False
+        self.last_activity = time.time()
+        if not self.connected:
+            return
+        if handler.response is None:
+            self._error(500, 'Internal server error')
+            return
+        code, body = handler.response
+        connection = (handler.headers.getheader('connection') or '').lower()
+        if handler.request_version == 'HTTP/1.0':
+            keepalive = connection == 'keep-alive'
+        else:
+            keepalive = connection != 'close'
+        self._send(code, body, handler.content_type, keepalive)
+        if keepalive:
+            self._next()
+        else:
+            self._queue.clear()
+            self.set_terminator(None)
+            self.close_when_done()
+
+    def _send(self, code, body, content_type, keepalive):
+        reason = BaseHTTPRequestHandler.responses.get(code, ('',))[0]
+        self.push(''.join([
+            'HTTP/1.1 %d %s\r\n' % (code, reason),
+            'Server: jsonrpc/%s\r\n' % __version__,
+            'Content-Type: %s\r\n' % content_type,
+            'Content-Length: %d\r\n' % len(body),
+            'Connection: %s\r\n' % ('keep-alive' if keepalive else 'close'),
+            '\r\n',
+            body,
+        ]))
+
+
+@public
+class AsyncHTTPServer(asyncore.dispatcher):
+    '''An HTTP server which serves a :py:class:`AsyncJSON_RPC` handler from
+    a single :py:mod:`asyncore` loop.
+
+    :param server_address: (host, port) to listen on
+    :param handler_class: a customized subclass of :py:class:`AsyncJSON_RPC`
+    '''
+
+    channel_class = AsyncHTTPChannel
+
+    #: Number of threads running method calls
+    workers = 16
+
+    #: Seconds after which an idle keep-alive connection is closed
+    idle_timeout = 300
+
+    #: Size of the listen() backlog
+    request_queue_size = 1024
+
+    def __init__(self, server_address, handler_class, map=None):
+        self.map = {} if map is None else map
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.handler_class = handler_class
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(server_address)
+        self.listen(self.request_queue_size)
+        self.server_address = self.socket.getsockname()
+        self.pool = ThreadPool(self.workers)
+        self.trigger = Trigger(self.map)
+        self._running = False
+        self._stopped = threading.Event()
+        self._stopped.set()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            self.channel_class(self, *pair)
+
+    def channels(self):
+        return [c for c in self.map.values() if isinstance(c, AsyncHTTPChannel)]
+
+    def close_idle(self):
+        '''Close the keep-alive connections idle for longer than
+        :py:attr:`idle_timeout`
+        '''
+        deadline = time.time() - self.idle_timeout
+        for channel in self.channels():
+            if channel.idle and channel.last_activity < deadline:
+                channel.close()
+
+    def serve_forever(self, poll_interval=0.5):
+        self._running = True
+        self._stopped.clear()
+        last_sweep = time.time()
+        try:
+            while self._running:
+                asyncore.loop(poll_interval, True, self.map, 1)
+                if time.time() - last_sweep >= poll_interval:
+                    self.close_idle()
+                    last_sweep = time.time()
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        '''Stop :py:meth:`serve_forever` and wait until it has returned,
+        must be called from another thread
+        '''
+        self._running = False
+        self.trigger.pull()
+        self._stopped.wait()
+
+    def server_close(self):
+        for dispatcher in self.map.values():
+            dispatcher.close()
+        self.pool.terminate()
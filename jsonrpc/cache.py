@@ -0,0 +1,258 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+
+"""
+Caching of method results on the server.
+
+A method opts in when it is registered::
+
+    @registry.method(cache=ResultCache(maxsize=10000, ttl=300))
+    def lookup(key):
+        ...
+
+Results are cached per method name and parameters, see :py:func:`cache_key`;
+the server binds the parameters to the method's signature first, so that
+``lookup('a')`` and ``lookup(key='a')`` share an entry.  Only successful calls
+are cached.  Every hit returns the same object, cached results must not be
+modified.  A cached result is also encoded only
+once per codec, later responses reuse the encoded form.
+
+With ``single_flight=True`` identical calls which run at the same time are
+coalesced, see :py:class:`SingleFlight`.  Combined with a cache, only one
+of the callers arriving when an entry expires runs the method.
+"""
+
+import collections
+import json
+import threading
+import time
+
+from jsonrpc.jsonutil import default_
+from jsonrpc.utilities import Future, public
+
+
+@public
+def cache_key(name, args, kwargs):
+    '''Return the key of a call, the method name and the canonical JSON
+    encoding of its parameters, so that equal parameters give equal keys
+    however they were sent'''
+    params = json.dumps([args, kwargs], sort_keys=True, separators=(',', ':'),
+                        default=default_)
+    return name, params
+
+
+class CacheEntry(object):
+    __slots__ = ('value', 'expires', 'encoded')
+
+    def __init__(self, value, expires):
+        self.value = value
+        self.expires = expires
+        #: the encoding of `value` by codec name, filled in by the server
+        self.encoded = {}
+
+
+@public
+class ResultCache(object):
+    '''A thread safe least recently used cache with a time to live
+
+    :param int maxsize: number of entries kept, the least recently used entry
+                        is evicted to make room for a new one
+    :param float ttl: seconds an entry stays valid, ``None`` for ever
+    '''
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        #: lookups answered from the cache
+        self.hits = 0
+        #: lookups which had to call the method
+        self.misses = 0
+        #: entries dropped to stay within `maxsize`
+        self.evictions = 0
+        #: entries dropped because their ttl passed
+        self.expirations = 0
+
+    def get(self, key):
+        '''Return the :py:class:`CacheEntry` for `key`, or None'''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if entry.expires is None or entry.expires > self.clock():
+                    # most recently used entries are kept at the end
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return entry
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        '''Store `value` under `key`, return its :py:class:`CacheEntry`'''
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        entry = CacheEntry(value, expires)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, name, *args, **kwargs):
+        '''Drop the cached result of the method `name` called with `args` and
+        `kwargs`, or all its results when no parameters are given'''
+        with self._lock:
+            if args or kwargs:
+                self._entries.pop(cache_key(name, args, kwargs), None)
+            else:
+                for key in [k for k in self._entries if k[0] == name]:
+                    del self._entries[key]
+
+    def clear(self):
+        '''Drop every entry'''
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        '''Return the counters and the number of entries in a dictionary'''
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        evictions=self.evictions, expirations=self.expirations,
+                        size=len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+@public
+class SingleFlight(object):
+    '''Coalesce identical calls which are in progress at the same time: the
+    first caller runs the call, the others wait for it and get the same
+    result, or the same exception.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        #: calls which actually ran
+        self.executions = 0
+        #: calls which waited for another one instead of running
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        '''Return ``func(*args, **kwargs)``, unless a call with the same `key`
+        is running, then wait for its outcome'''
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                self._calls[key] = running = Future()
+                self.executions += 1
+        if future is not None:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException, exc:
+            running.set_exception(exc)
+            raise
+        else:
+            running.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        '''Return the counters and the number of running calls'''
+        with self._lock:
+            return dict(executions=self.executions, coalesced=self.coalesced,
+                        running=len(self._calls))
+
+
+@public
+class MethodCaches(object):
+    '''The result caches of a :py:class:`jsonrpc.proxy.JSONRPCProxy` by method
+    name, shared by the proxies created from it
+
+    :param methods: a dictionary {method name: settings}, where the settings
+                    are a :py:class:`ResultCache` or a dictionary of its
+                    arguments, e.g. ``{'countries': dict(ttl=300)}``
+
+    Cached results are returned to every caller as the same object, they must
+    not be modified.
+    '''
+
+    def __init__(self, methods=None):
+        self._lock = threading.Lock()
+        self._caches = {}
+        for name, settings in (methods or {}).iteritems():
+            self.add(name, settings)
+
+    def add(self, name, settings=None):
+        '''Cache the results of the method `name`, see the constructor for
+        `settings`'''
+        if not isinstance(settings, ResultCache):
+            settings = ResultCache(**(settings or {}))
+        with self._lock:
+            self._caches[name] = settings
+        return settings
+
+    def remove(self, name):
+        with self._lock:
+            self._caches.pop(name, None)
+
+    def get(self, name):
+        '''Return the cache of the method `name`, or None'''
+        return self._caches.get(name)
+
+    def invalidate(self, name, *args, **kwargs):
+        '''Drop the cached result of `name` for the given parameters, or all
+        its cached results, see :py:meth:`ResultCache.invalidate`'''
+        cache = self._caches.get(name)
+        if cache is not None:
+            cache.invalidate(name, *args, **kwargs)
+
+    def clear(self):
+        for cache in self._caches.values():
+            cache.clear()
+
+    def stats(self):
+        '''Return the statistics of every cache by method name'''
+        return dict((name, cache.stats())
+                    for name, cache in self._caches.items())
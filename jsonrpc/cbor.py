@@ -0,0 +1,334 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+
+"""
+A compact binary encoding of the JSON data model, following CBOR (RFC 7049).
+
+Values are encoded the way the JSON backends of :py:mod:`jsonrpc.jsonutil`
+serialize them: tuples become arrays and dictionary keys become strings.
+Arrays holding only floats, or only integers, are sent as typed arrays
+(RFC 8746) which are packed and unpacked by :py:mod:`struct` in one go,
+instead of formatting and parsing every number as decimal text.
+"""
+
+import struct
+
+from jsonrpc.utilities import public
+
+
+#: Arrays shorter than this are encoded item by item
+TYPED_ARRAY_MIN = 8
+
+# RFC 8746 tags of big endian typed arrays
+TAG_INT64_ARRAY = 75
+TAG_FLOAT64_ARRAY = 82
+
+_FLOATS = set([float])
+_INTS = set([int])
+
+_pack_double = struct.Struct('>Bd').pack
+_unpack_half = struct.Struct('>H').unpack
+_unpack_single = struct.Struct('>f').unpack
+_unpack_double = struct.Struct('>d').unpack
+_unpack_uint = {1: struct.Struct('>B').unpack, 2: struct.Struct('>H').unpack,
+                4: struct.Struct('>I').unpack, 8: struct.Struct('>Q').unpack}
+
+_BREAK = object()
+
+
+def _head(major, n):
+    '''The initial bytes of an item of type `major` with argument `n`'''
+    major <<= 5
+    if n < 24:
+        return chr(major | n)
+    if n < 0x100:
+        return struct.pack('>BB', major | 24, n)
+    if n < 0x10000:
+        return struct.pack('>BH', major | 25, n)
+    if n < 0x100000000:
+        return struct.pack('>BI', major | 26, n)
+    return struct.pack('>BQ', major | 27, n)
+
+def _bignum(n):
+    data = '%x' % n
+    return ('0' * (len(data) % 2) + data).decode('hex')
+
+def _key(key):
+    '''Convert a dictionary key like the JSON encoders do'''
+    if isinstance(key, basestring):
+        return key
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, float):
+        return repr(key)
+    if isinstance(key, (int, long)):
+        return str(key)
+    raise TypeError('key %r is not a string' % (key,))
+
+
+class _Encoder(object):
+    def __init__(self, default):
+        self.default = default
+        self.parts = []
+        self.write = self.parts.append
+
+    def encode(self, obj):
+        cls = obj.__class__
+        write = self.write
+        if cls is unicode:
+            data = obj.encode('utf-8')
+            write(_head(3, len(data)))
+            write(data)
+        elif cls is str:
+            obj.decode('utf-8')
+            write(_head(3, len(obj)))
+            write(obj)
+        elif cls is int or cls is long:
+            if obj >= 0:
+                if obj < 0x10000000000000000:
+                    write(_head(0, obj))
+                else:
+                    data = _bignum(obj)
+                    write('\xc2' + _head(2, len(data)) + data)
+            else:
+                obj = -1 - obj
+                if obj < 0x10000000000000000:
+                    write(_head(1, obj))
+                else:
+                    data = _bignum(obj)
+                    write('\xc3' + _head(2, len(data)) + data)
+        elif cls is float:
+            write(_pack_double(0xfb, obj))
+        elif cls is bool:
+            write('\xf5' if obj else '\xf4')
+        elif obj is None:
+            write('\xf6')
+        elif isinstance(obj, (list, tuple)):
+            self.encode_array(obj)
+        elif isinstance(obj, dict):
+            write(_head(5, len(obj)))
+            for key, value in obj.iteritems():
+                self.encode(_key(key))
+                self.encode(value)
+        # subclasses of the plain types, adding the empty value of the base
+        # type gives a plain copy
+        elif isinstance(obj, unicode):
+            self.encode(obj + u'')
+        elif isinstance(obj, str):
+            self.encode(obj + '')
+        elif isinstance(obj, (int, long)):
+            self.encode(obj + 0)
+        elif isinstance(obj, float):
+            self.encode(float(obj))
+        elif self.default is not None:
+            self.encode(self.default(obj))
+        else:
+            raise TypeError('%r is not serializable' % (obj,))
+
+    def encode_array(self, obj):
+        write = self.write
+        count = len(obj)
+        if count >= TYPED_ARRAY_MIN:
+            types = set(map(type, obj))
+            if types == _FLOATS:
+                write('\xd8%c' % TAG_FLOAT64_ARRAY + _head(2, count * 8))
+                write(struct.pack('>%dd' % count, *obj))
+                return
+            if types == _INTS:
+                try:
+                    data = struct.pack('>%dq' % count, *obj)
+                except struct.error:
+                    # beyond 64 bits
+                    pass
+                else:
+                    write('\xd8%c' % TAG_INT64_ARRAY + _head(2, count * 8))
+                    write(data)
+                    return
+        write(_head(4, count))
+        for item in obj:
+            self.encode(item)
+
+
+class _Decoder(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, size):
+        pos = self.pos
+        end = self.pos = pos + size
+        if end > len(self.data):
+            raise ValueError('truncated data at %d' % pos)
+        return self.data[pos:end]
+
+    def argument(self, info):
+        if info < 24:
+            return info
+        if info < 28:
+            size = 1 << (info - 24)
+            return _unpack_uint[size](self.read(size))[0]
+        if info == 31:
+            return None
+        raise ValueError('invalid item at %d' % self.pos)
+
+    def decode(self):
+        pos = self.pos
+        if pos >= len(self.data):
+            raise ValueError('truncated data at %d' % pos)
+        initial = ord(self.data[pos])
+        self.pos = pos + 1
+        major, info = initial >> 5, initial & 31
+        if major == 7:
+            return self.simple(info)
+
+        n = info if info < 24 else self.argument(info)
+        if major == 0:
+            return n
+        if major == 1:
+            return -1 - n
+        if major == 2 or major == 3:
+            if n is None:
+                data = ''.join(self.chunks(major))
+            else:
+                data = self.read(n)
+            return data.decode('utf-8') if major == 3 else data
+        if major == 4:
+            if n is None:
+                return list(self.until_break())
+            return [self.item() for _ in xrange(n)]
+        if major == 5:
+            keys = self.until_break() if n is None else (self.item()
+                                                         for _ in xrange(n))
+            result = {}
+            for key in keys:
+                if isinstance(key, list):
+                    key = tuple(key)
+                result[key] = self.item()
+            return result
+        if n is None:
+            raise ValueError('invalid tag at %d' % self.pos)
+        return self.tagged(n, self.item())
+
+    def item(self):
+        obj = self.decode()
+        if obj is _BREAK:
+            raise ValueError('unexpected break at %d' % self.pos)
+        return obj
+
+    def until_break(self):
+        '''Yield the items of an indefinite length array or map'''
+        return iter(self.decode, _BREAK)
+
+    def chunks(self, major):
+        while True:
+            initial = ord(self.read(1))
+            if initial == 0xff:
+                return
+            if initial >> 5 != major or initial & 31 == 31:
+                raise ValueError('invalid chunk at %d' % self.pos)
+            yield self.read(self.argument(initial & 31))
+
+    def simple(self, info):
+        if info == 20:
+            return False
+        if info == 21:
+            return True
+        if info == 22 or info == 23:
+            return None
+        if info == 25:
+            return _half(_unpack_half(self.read(2))[0])
+        if info == 26:
+            return _unpack_single(self.read(4))[0]
+        if info == 27:
+            return _unpack_double(self.read(8))[0]
+        if info == 31:
+            return _BREAK
+        raise ValueError('unsupported simple value at %d' % self.pos)
+
+    def tagged(self, tag, value):
+        if not isinstance(value, str):
+            # tags carry no meaning in the JSON data model
+            return value
+        if tag == 2 or tag == 3:
+            n = int(value.encode('hex') or '0', 16)
+            return n if tag == 2 else -1 - n
+        if tag == TAG_FLOAT64_ARRAY:
+            return list(struct.unpack('>%dd' % (len(value) // 8), value))
+        if tag == TAG_INT64_ARRAY:
+            return list(struct.unpack('>%dq' % (len(value) // 8), value))
+        # tags carry no meaning in the JSON data model
+        return value
+
+
+def _half(bits):
+    exp = (bits >> 10) & 0x1f
+    mant = bits & 0x3ff
+    if exp == 0:
+        value = mant * 2.0 ** -24
+    elif exp == 0x1f:
+        value = float('inf') if mant == 0 else float('nan')
+    else:
+        value = (mant + 1024) * 2.0 ** (exp - 25)
+    return -value if bits & 0x8000 else value
+
+
+@public
+def dumps(obj, default=None):
+    '''Serialize `obj` to a CBOR byte string
+
+    :param default: called for objects which can't be serialized, it
+                    should return a serializable replacement
+    '''
+    encoder = _Encoder(default)
+    encoder.encode(obj)
+    return ''.join(encoder.parts)
+
+@public
+def loads(data):
+    '''Parse a CBOR byte string
+
+    :raises: :py:class:`ValueError` if `data` is not valid CBOR
+    '''
+    decoder = _Decoder(data)
+    try:
+        result = decoder.item()
+    except (UnicodeDecodeError, struct.error, TypeError), e:
+        raise ValueError(str(e))
+    if decoder.pos != len(data):
+        raise ValueError('extra data at %d' % decoder.pos)
+    return result
@@ -76,12 +76,27 @@ class MethodNotFound(RPCError):
     msg = "Procedure not found."
 
 
+@public
+class InvalidParams(RPCError):
+    '''Raise this when the parameters do not match the method's signature'''
+    code = -32602
+    msg = "Invalid params."
+
+
 @public
 class ParseError(RPCError):
     '''Raise this when the request contains invalid JSON'''
     code = -32700
     msg = "Parse error."
 
+
+@public
+class ServerBusy(RPCError):
+    '''The server turned the request away without running it because it had
+    too much work queued, the request may be retried later'''
+    code = -32000
+    msg = "Server busy."
+
 codemap = {0: RPCError}
 codemap.update((e.code, e) for e in RPCError.__subclasses__())
 
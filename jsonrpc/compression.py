@@ -0,0 +1,137 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+
+"""
+gzip and deflate content-encoding of request and response bodies.
+"""
+
+import zlib
+
+from jsonrpc.utilities import public
+
+
+#: The window bits which select the container of each content-encoding
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+#: The content-encodings offered by default, in order of preference
+ENCODINGS = ('gzip', 'deflate')
+
+
+@public
+def compressor(encoding, level=6):
+    '''Return a compression object producing `encoding`, e.g. to compress
+    a streamed body piece by piece'''
+    return zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+
+@public
+def compress(data, encoding, level=6):
+    '''Compress `data` with the content-encoding `encoding`'''
+    obj = compressor(encoding, level)
+    return obj.compress(data) + obj.flush()
+
+def _inflate(data, wbits, max_size):
+    if max_size is None:
+        return zlib.decompress(data, wbits)
+    # never hold more than max_size decoded bytes, whatever the ratio
+    obj = zlib.decompressobj(wbits)
+    result = obj.decompress(data, max_size + 1)
+    if len(result) > max_size:
+        raise ValueError('decoded data larger than %d bytes' % max_size)
+    return result + obj.flush()
+
+@public
+def decompress(data, encoding, max_size=None):
+    '''Decode `data` sent with the content-encoding `encoding`
+
+    :param int max_size: refuse data which decodes to more bytes than this,
+                         ``None`` for no limit
+    :raises: :py:class:`ValueError` when the encoding is unknown, the data
+             is corrupt or decodes to more than `max_size` bytes
+    '''
+    encoding = encoding.strip().lower()
+    if encoding in ('', 'identity'):
+        return data
+    if encoding not in WBITS:
+        raise ValueError('unsupported content-encoding: %s' % encoding)
+    try:
+        return _inflate(data, WBITS[encoding], max_size)
+    except zlib.error, e:
+        if encoding == 'deflate':
+            # some clients send deflate data without the zlib header
+            try:
+                return _inflate(data, -zlib.MAX_WBITS, max_size)
+            except zlib.error:
+                pass
+        raise ValueError(str(e))
+
+@public
+def decompressor(encoding):
+    '''Return a decompression object for `encoding`, or None when the data
+    is not encoded
+
+    :raises: :py:class:`ValueError` when the encoding is unknown
+    '''
+    encoding = encoding.strip().lower()
+    if encoding in ('', 'identity'):
+        return None
+    if encoding not in WBITS:
+        raise ValueError('unsupported content-encoding: %s' % encoding)
+    return zlib.decompressobj(WBITS[encoding])
+
+@public
+def choose_encoding(accept, offered=ENCODINGS):
+    '''Return the first encoding of `offered` allowed by the Accept-Encoding
+    header `accept`, or None'''
+    allowed = {}
+    for item in (accept or '').split(','):
+        params = item.split(';')
+        name = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            allowed[name] = quality
+    for encoding in offered:
+        if allowed.get(encoding, allowed.get('*', 0)) > 0:
+            return encoding
+    return None
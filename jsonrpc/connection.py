@@ -0,0 +1,416 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+
+"""
+Persistent HTTP/1.1 connections for :py:class:`jsonrpc.proxy.JSONRPCProxy`,
+over TCP or over unix sockets for ``unix://`` urls.
+
+:py:class:`HTTPConnectionPool` implements the part of the
+:py:class:`urllib2.OpenerDirector` interface used by the proxy, so either can
+be passed to :py:meth:`JSONRPCProxy._set_opener`.
+"""
+
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+from cStringIO import StringIO
+
+from jsonrpc import __version__
+from jsonrpc.compression import compress, decompress, decompressor
+from jsonrpc.utilities import public
+
+
+@public
+class UnixHTTPConnection(httplib.HTTPConnection):
+    '''An HTTP connection to a server listening on the unix socket `path`,
+    like :py:class:`jsonrpc.unixserver.UnixHTTPServer`'''
+
+    def __init__(self, path, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+#: messages of :py:class:`httplib.BadStatusLine` for an empty reply
+_EMPTY_STATUS = (repr(''), 'No status line received - '
+                           'the server has closed the connection')
+
+
+def _no_response(error):
+    '''Whether `error` means the connection was closed before any byte of
+    the response was received'''
+    return (isinstance(error, httplib.BadStatusLine) and
+            error.line in _EMPTY_STATUS)
+
+
+@public
+class HTTPConnectionPool(object):
+    '''A thread safe pool of keep-alive connections, grouped by host.
+
+    :param int maxsize: number of connections open to a host at a time,
+                        idle or in use.  A request for which there is no
+                        free connection waits until one is released, at
+                        most `timeout` seconds when it is set, after which
+                        :py:class:`urllib2.URLError` is raised
+    :param float idle_timeout: seconds after which an idle connection is
+                               dropped instead of reused
+    :param timeout: socket timeout of new connections
+    :param cookiejar: a :py:class:`cookielib.CookieJar` storing the cookies
+                      set by the servers and sending them back, like
+                      :py:class:`urllib2.HTTPCookieProcessor`.  ``None``
+                      ignores cookies.
+    :param compress_min_size: compress request bodies of at least this many
+                              bytes, ``None`` sends them uncompressed.  Only
+                              use it with servers which accept compressed
+                              requests.
+    :param int compress_level: zlib compression level of requests
+    :param str compress_encoding: content-encoding of compressed requests
+
+    Responses are compressed by servers which support it, see
+    :py:attr:`jsonrpc.server.JSON_RPC.compress_encodings`.
+    '''
+
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection,
+        'unix': UnixHTTPConnection,
+    }
+
+    headers = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'jsonrpc/' + __version__,
+        'Accept-Encoding': 'gzip, deflate',
+    }
+
+    def __init__(self, maxsize=10, idle_timeout=60,
+                 timeout=socket._GLOBAL_DEFAULT_TIMEOUT, compress_min_size=None,
+                 compress_level=6, compress_encoding='gzip', cookiejar=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+        self.compress_encoding = compress_encoding
+        self.cookiejar = cookiejar
+        self._lock = threading.Condition()
+        self._idle = {}
+        # number of connections to each host, idle or in use
+        self._open = {}
+
+    def _connect(self, scheme, netloc):
+        cls = self.connection_classes.get(scheme)
+        if cls is None:
+            raise urllib2.URLError('unknown url type: %s' % scheme)
+        return cls(netloc, timeout=self.timeout)
+
+    def _wait(self, key, give_up):
+        '''Wait for a connection to `key` to be released, with the lock held'''
+        if give_up is None:
+            self._lock.wait()
+            return
+        remaining = give_up - time.time()
+        if remaining <= 0:
+            raise urllib2.URLError('no free connection to %s after %s seconds'
+                                   % (key[1], self.timeout))
+        self._lock.wait(remaining)
+
+    def _get(self, key):
+        '''Return a pair (connection, reused)'''
+        expired = []
+        conn = None
+        give_up = None
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            give_up = time.time() + self.timeout
+        with self._lock:
+            while True:
+                deadline = time.time() - self.idle_timeout
+                idle = self._idle.get(key, [])
+                while idle:
+                    candidate, last_used = idle.pop()
+                    if last_used >= deadline:
+                        conn = candidate
+                        break
+                    expired.append(candidate)
+                    self._open[key] -= 1
+                if conn is not None:
+                    break
+                if self._open.get(key, 0) < self.maxsize:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                self._wait(key, give_up)
+        for candidate in expired:
+            candidate.close()
+        if conn is not None:
+            return conn, True
+        try:
+            return self._connect(*key), False
+        except:
+            self._discard(key, None)
+            raise
+
+    def _put(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append((conn, time.time()))
+            self._lock.notify_all()
+
+    def _discard(self, key, conn):
+        '''Close `conn`, which is no longer part of the pool'''
+        if conn is not None:
+            conn.close()
+        with self._lock:
+            self._open[key] -= 1
+            self._lock.notify_all()
+
+    def clear(self):
+        '''Close every idle connection'''
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            for key, conns in idle.items():
+                self._open[key] -= len(conns)
+            self._lock.notify_all()
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+    def _request(self, url, data, headers):
+        '''POST `data` to `url`, return a triple (key, connection, response)
+        with the body of the response still unread'''
+        urlsp = urlparse.urlsplit(url)
+        if urlsp.scheme == 'unix':
+            # the path of the url is the one of the socket
+            key = (urlsp.scheme, urlsp.netloc + urlsp.path)
+            path = '/'
+        else:
+            key = (urlsp.scheme, urlsp.netloc)
+            path = urlsp.path or '/'
+        if urlsp.query:
+            path = '{0}?{1}'.format(path, urlsp.query)
+        allheaders = dict(self.headers, **(headers or {}))
+        if self.cookiejar is not None:
+            request = urllib2.Request(url)
+            self.cookiejar.add_cookie_header(request)
+            allheaders.update(request.unredirected_hdrs)
+        if (self.compress_min_size is not None and
+                len(data) >= self.compress_min_size):
+            data = compress(data, self.compress_encoding, self.compress_level)
+            allheaders['Content-Encoding'] = self.compress_encoding
+
+        while True:
+            conn, reused = self._get(key)
+            try:
+                conn.request('POST', path, data, allheaders)
+            except socket.timeout:
+                self._discard(key, conn)
+                raise
+            except (httplib.HTTPException, socket.error):
+                self._discard(key, conn)
+                # the server closed the idle connection before the request
+                # was sent, it did not run it
+                if reused:
+                    continue
+                raise
+            try:
+                resp = conn.getresponse()
+            except Exception as error:
+                self._discard(key, conn)
+                # a server closing an idle connection drops the request it
+                # just received without answering, any other failure may
+                # come after the request was run: it is not sent again
+                if reused and _no_response(error):
+                    continue
+                raise
+            if self.cookiejar is not None:
+                self.cookiejar.extract_cookies(
+                    urllib.addinfourl(StringIO(), resp.msg, url), request)
+            return key, conn, resp
+
+    def _release(self, key, conn, resp):
+        if resp.will_close:
+            self._discard(key, conn)
+        else:
+            self._put(key, conn)
+
+    def open(self, url, data, headers=None):
+        '''POST `data` to `url`
+
+        :returns: a file-like object, like :py:meth:`urllib2.urlopen`
+        :raises: :py:class:`urllib2.HTTPError` on error status codes
+        '''
+        key, conn, resp = self._request(url, data, headers)
+        try:
+            body = resp.read()
+        except:
+            self._discard(key, conn)
+            raise
+        self._release(key, conn, resp)
+        body = decompress(body, resp.getheader('content-encoding') or '')
+
+        result = urllib.addinfourl(StringIO(body), resp.msg, url, resp.status)
+        if not 200 <= resp.status < 300:
+            raise urllib2.HTTPError(url, resp.status, resp.reason, resp.msg,
+                                    result)
+        return result
+
+    def open_stream(self, url, data, headers=None):
+        '''POST `data` to `url` without waiting for the body of the response
+
+        :returns: a :py:class:`StreamedResponse`, which hands its connection
+                  back to the pool once the body has been read
+        :raises: :py:class:`urllib2.HTTPError` on error status codes
+        '''
+        key, conn, resp = self._request(url, data, headers)
+        if not 200 <= resp.status < 300:
+            # reading the error body also releases the connection
+            result = StreamedResponse(self, key, conn, resp, url)
+            result = urllib.addinfourl(StringIO(result.read()), resp.msg, url,
+                                       resp.status)
+            raise urllib2.HTTPError(url, resp.status, resp.reason, resp.msg,
+                                    result)
+        return StreamedResponse(self, key, conn, resp, url)
+
+
+@public
+class StreamedResponse(object):
+    '''The response of :py:meth:`HTTPConnectionPool.open_stream`, whose body
+    is read as it arrives.  Iterating over it yields the lines of the body,
+    chunk by chunk when the server uses chunked transfer-encoding.
+    '''
+
+    def __init__(self, pool, key, conn, resp, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.url = url
+        self.code = resp.status
+        try:
+            self._decoder = decompressor(resp.getheader('content-encoding') or '')
+        except ValueError:
+            self.close()
+            raise
+
+    def info(self):
+        return self._resp.msg
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+    def _finish(self, complete):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        if complete:
+            self._resp.close()
+            self._pool._release(self._key, conn, self._resp)
+        else:
+            self._pool._discard(self._key, conn)
+
+    def close(self):
+        '''Drop the connection if the body has not been read completely'''
+        self._finish(False)
+
+    def read(self):
+        '''Read the rest of the body'''
+        return ''.join(self.iter_chunks())
+
+    def iter_chunks(self):
+        '''Yield pieces of the body as soon as they have been received'''
+        if self._decoder is None:
+            return self._iter_raw()
+        return self._iter_decoded()
+
+    def _iter_decoded(self):
+        for data in self._iter_raw():
+            data = self._decoder.decompress(data)
+            if data:
+                yield data
+        data = self._decoder.flush()
+        if data:
+            yield data
+
+    def _iter_raw(self):
+        resp = self._resp
+        complete = False
+        try:
+            if resp.chunked:
+                fp = resp.fp
+                while True:
+                    size = int(fp.readline().split(';', 1)[0], 16)
+                    if size == 0:
+                        break
+                    data = fp.read(size)
+                    if len(data) < size:
+                        raise httplib.IncompleteRead(data, size - len(data))
+                    fp.readline()
+                    yield data
+                # skip the trailer
+                while fp.readline() not in ('\r\n', '\n', ''):
+                    pass
+            elif resp.length is not None:
+                yield resp.read()
+            else:
+                # the body ends when the server closes the connection, read
+                # it line by line so that each line is seen on arrival
+                for line in iter(resp.fp.readline, ''):
+                    yield line
+            complete = True
+        finally:
+            self._finish(complete)
+
+    def __iter__(self):
+        pending = ''
+        for data in self.iter_chunks():
+            lines = (pending + data).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
@@ -35,10 +35,16 @@ from __future__ import print_function
 from SocketServer import ThreadingMixIn
 from BaseHTTPServer import HTTPServer
 
+from jsonrpc.registry import MethodRegistry
 from jsonrpc.server import ServerEvents, JSON_RPC
 
 
 class ExampleServer(ServerEvents):
+    def __init__(self, server):
+        ServerEvents.__init__(self, server)
+        self.methods = MethodRegistry()
+        self.methods.add_object(self, names=['add', 'subtract', 'echo'])
+
     # inherited hooks
     def log(self, responses, request, error):
         if isinstance(responses, list):
@@ -49,15 +55,7 @@ class ExampleServer(ServerEvents):
             msg = self._get_msg(responses)
             print(request, msg)
 
-    def findmethod(self, method, args=None, kwargs=None):
-        if method in self.methods:
-            return getattr(self, method)
-        else:
-            return None
-
     # helper methods
-    methods = set(['add', 'subtract', 'echo'])
-
     def _get_msg(self, response):
         print('response', repr(response))
         return ' '.join(str(x) for x in
@@ -45,45 +45,338 @@ it behave like demjson
 - if it is iterable, it will be made into a list
 
 - otherwise 'str' will be called on the object, and that result will be used
+
+The JSON backend is pluggable, see :py:class:`Codec`.  The first installed
+backend listed in :py:data:`preferred` becomes the default at import time,
+that is the standard library's json, :py:func:`set_default_codec` makes
+another one the default and servers and proxies can select one by name.  The ``cbor`` codec
+encodes the same data in the binary format of :py:mod:`jsonrpc.cbor`, it is
+negotiated by content-type instead of replacing the JSON backend.
 """
-__all__ = ['encode', 'decode']
+__all__ = ['encode', 'decode', 'Codec', 'register_codec', 'get_codec',
+           'set_default_codec', 'iterdecode', 'ArrayStream']
 
 import functools
+import re
+
+
+#: Types the JSON backends serialize themselves
+PLAIN_TYPES = (str, unicode, int, long, float, bool, type(None))
 
-try:
-    import json
-except ImportError:
-    import simplejson as json
 
+def _key(key):
+    return key if isinstance(key, PLAIN_TYPES) else encode_(key)
 
 def dict_encode(obj):
     items = getattr(obj, 'iteritems', obj.items)
-    return dict((encode_(k), encode_(v)) for k, v in items())
+    return dict((_key(k), encode_(v)) for k, v in items())
 
 def list_encode(obj):
-    return list(encode_(i) for i in obj)
+    return [encode_(i) for i in obj]
 
 def safe_encode(obj):
     '''Always return something, even if it is useless for serialization'''
-    try:
-        json.dumps(obj)
-    except TypeError:
-        obj = str(obj)
+    return obj if isinstance(obj, PLAIN_TYPES) else str(obj)
+
+def _plain(obj):
     return obj
 
+def _lookup(cls):
+    '''Return the conversion of the instances of `cls`, leaving aside
+    json_equivalent'''
+    if hasattr(cls, 'items'):
+        return dict_encode
+    if hasattr(cls, '__iter__'):
+        return list_encode
+    if issubclass(cls, PLAIN_TYPES):
+        return _plain
+    return str
+
+#: classes whose conversion is kept, the tables are emptied when they fill
+#: up with classes created on the fly
+MAX_CLASSES = 1024
+
+# the conversion for each class, looked up once per class
+_deep = {}
+_converters = {}
+
+def _remember(table, cls, func):
+    if len(table) >= MAX_CLASSES:
+        table.clear()
+    table[cls] = func
+    return func
+
+def _convert(obj):
+    # what the result of json_equivalent becomes, its own json_equivalent
+    # is not called
+    cls = obj.__class__
+    try:
+        func = _converters[cls]
+    except KeyError:
+        func = _remember(_converters, cls, _lookup(cls))
+    return func(obj)
+
+def _hook(obj):
+    return _convert(obj.json_equivalent())
+
+def _instance_hook(obj):
+    return (_hook if hasattr(obj, 'json_equivalent') else _convert)(obj)
+
+def _encoder(cls):
+    if hasattr(cls, 'json_equivalent'):
+        return _hook
+    if getattr(cls, '__dictoffset__', 1) or hasattr(cls, '__getattr__'):
+        # an instance may have a json_equivalent of its own
+        return _instance_hook
+    return _lookup(cls)
+
 def encode_(obj, **kw):
-    obj = getattr(obj, 'json_equivalent', lambda: obj)()
-    func = lambda x: x
-    if hasattr(obj, 'items'):
-        func = dict_encode
-    elif hasattr(obj, '__iter__'):
-        func = list_encode
-    else:
-        func = safe_encode
+    '''Convert `obj` and everything it contains to types the JSON backends
+    can serialize.
+
+    ``json_equivalent`` is called once and its result converted, mappings
+    are rebuilt as dictionaries, other iterables as lists, and objects the
+    backends can't serialize are replaced by their string.  How to convert
+    an object is looked up once per class, except that a
+    ``json_equivalent`` set on the instance itself is still honoured.
+    '''
+    cls = obj.__class__
+    try:
+        func = _deep[cls]
+    except KeyError:
+        func = _remember(_deep, cls, _encoder(cls))
     return func(obj)
 
+#: The ``default`` hook of the JSON backends, which only call it for the
+#: objects they can't serialize
+default_ = encode_
+
+
+class Codec(object):
+    '''A JSON backend with the encoding semantics of this module
+
+    :param str name: the name the codec is registered under
+    :param dumps: the backend's function serializing an object to a string
+    :param loads: the backend's function parsing a string
+    :param bool default_hook: True if `dumps` accepts a ``default`` function
+                              which is called for unknown objects, otherwise
+                              objects are converted by :py:func:`encode_`
+                              before they are handed to `dumps`
+    :param str content_type: the media type of the encoded data
+    :param bool binary: True if the encoding is not text, such codecs can't
+                        be used for newline delimited streams
+    '''
+
+    def __init__(self, name, dumps, loads, default_hook=True,
+                 content_type='application/json', binary=False):
+        self.name = name
+        self.content_type = content_type
+        self.binary = binary
+        if default_hook:
+            self.encode = functools.partial(dumps, default=default_)
+        else:
+            self.encode = lambda obj, **kw: dumps(encode_(obj), **kw)
+        self.decode = loads
+
+    def to_bytes(self, obj):
+        '''Encode `obj` to the byte string sent over the wire'''
+        data = self.encode(obj)
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        return data
+
+    def __repr__(self):
+        return '<Codec %s>' % self.name
+
+
+def _load_json():
+    import json
+    return Codec('json', json.dumps, json.loads)
+
+def _load_simplejson():
+    import simplejson
+    # encode namedtuples and decimals the way json does
+    dumps = functools.partial(simplejson.dumps, namedtuple_as_object=False,
+                              use_decimal=False)
+    return Codec('simplejson', dumps, simplejson.loads)
+
+def _load_ujson():
+    import ujson
+    return Codec('ujson', ujson.dumps, ujson.loads, default_hook=False)
+
+def _load_cbor():
+    from jsonrpc import cbor
+    return Codec('cbor', cbor.dumps, cbor.loads, content_type='application/cbor',
+                 binary=True)
+
+_loaders = dict(json=_load_json, simplejson=_load_simplejson, ujson=_load_ujson,
+                cbor=_load_cbor)
+_codecs = {}
+
+#: Backends tried in order to pick the default codec.  simplejson and ujson
+#: are opt-in, ujson because it rounds floats.
+preferred = ['json']
+
+
+def register_codec(codec):
+    '''Make a :py:class:`Codec` available under its name'''
+    _codecs[codec.name] = codec
+    return codec
+
+def get_codec(name=None):
+    '''Return the codec registered as `name`, or the default codec, a
+    :py:class:`Codec` instance is returned as is
+
+    :raises: :py:class:`KeyError` if the backend is not installed
+    '''
+    if name is None:
+        return default_codec
+    if isinstance(name, Codec):
+        return name
+    codec = _codecs.get(name)
+    if codec is None:
+        if name not in _loaders:
+            raise KeyError('unknown codec: %r' % name)
+        try:
+            codec = register_codec(_loaders[name]())
+        except ImportError:
+            raise KeyError('codec %r is not installed' % name)
+    return codec
+
+def set_default_codec(name):
+    '''Make the codec `name` the default used by :py:func:`encode` and
+    :py:func:`decode`
+    '''
+    global default_codec, encode, decode
+    default_codec = get_codec(name)
+    encode = default_codec.encode
+    decode = default_codec.decode
+
+
+for _name in preferred:
+    try:
+        set_default_codec(_name)
+        break
+    except KeyError:
+        pass
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+# the characters which tell where an element of an array ends
+_structural = re.compile(r'["\[\]{},]')
+_string_special = re.compile(r'["\\]')
+
+
+class ArrayStream(object):
+    '''Iterate over the elements of a JSON array which is read from a
+    file-like object.  The chunks read are scanned once to find where each
+    element ends, the element is then decoded on its own with `codec`, so
+    only one element is held in memory at a time.
+
+    Iteration raises :py:class:`ValueError` when the data is not valid JSON.
+    '''
+
+    def __init__(self, fileobj, data, chunk_size=65536, codec=None):
+        self._fileobj = fileobj
+        self._chunk = data
+        self._pos = 0
+        self._eof = False
+        self._first = True
+        self._done = False
+        self._chunk_size = chunk_size
+        self._decode = get_codec(codec).decode
+
+    def __iter__(self):
+        return self
+
+    def _more(self):
+        '''Read the next chunk, return False at the end of the data'''
+        if self._eof:
+            return False
+        data = self._fileobj.read(self._chunk_size)
+        if not data:
+            self._eof = True
+            return False
+        self._chunk = data
+        self._pos = 0
+        return True
+
+    def _skip(self):
+        '''Skip whitespace, return the next character'''
+        while True:
+            self._pos = _whitespace.match(self._chunk, self._pos).end()
+            if self._pos < len(self._chunk):
+                return self._chunk[self._pos]
+            if not self._more():
+                raise ValueError('unterminated array')
+
+    def _element(self):
+        '''Return the text of the element at the current position, which
+        is left on the , or ] following it'''
+        parts = []
+        start = scan = self._pos
+        depth = 0
+        in_string = False
+        while True:
+            chunk = self._chunk
+            pattern = _string_special if in_string else _structural
+            match = pattern.search(chunk, scan)
+            if match is None:
+                # the element goes on in the next chunk, an escaped character
+                # may be its first one
+                parts.append(chunk[start:])
+                overflow = max(scan - len(chunk), 0)
+                if not self._more():
+                    raise ValueError('unterminated array')
+                start, scan = 0, overflow
+                continue
+            char = match.group()
+            scan = match.end()
+            if in_string:
+                if char == '\\':
+                    scan += 1
+                else:
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+            elif depth:
+                if char in ']}':
+                    depth -= 1
+            elif char in ',]':
+                parts.append(chunk[start:match.start()])
+                self._pos = match.start()
+                return ''.join(parts)
+            else:
+                raise ValueError('unexpected %s' % char)
+
+    def next(self):
+        if self._done:
+            raise StopIteration
+        char = self._skip()
+        if char == ']':
+            self._done = True
+            raise StopIteration
+        if not self._first:
+            if char != ',':
+                raise ValueError('expected , or ]')
+            self._pos += 1
+            self._skip()
+        self._first = False
+        return self._decode(self._element())
+
+
+def iterdecode(fileobj, chunk_size=65536, codec=None):
+    '''Decode JSON read from `fileobj` with `codec`, the default codec if
+    not given.  If it is an array, return an :py:class:`ArrayStream` over its
+    elements instead of a list.
+    '''
+    data = fileobj.read(chunk_size)
+    start = _whitespace.match(data).end()
+    if data[start:start + 1] == '[':
+        return ArrayStream(fileobj, data[start + 1:], chunk_size, codec)
+    rest = fileobj.read()
+    return get_codec(codec).decode(data + rest)
 
-encode = functools.partial(json.dumps, default=encode_)
-decode = json.loads
 
 __version__ = "$Revision: 1.2 $".split(":")[1][:-1].strip()
@@ -0,0 +1,258 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+"""
+Serve :py:class:`jsonrpc.server.JSON_RPC` from a fixed number of threads.
+
+:py:class:`SocketServer.ThreadingMixIn` starts a thread for every connection,
+a burst of clients costs as many threads and their memory.  A
+:py:class:`PoolHTTPServer` hands the accepted connections to `workers`
+threads through a queue of at most `queue_size` connections.  The connections
+which find the queue full are answered at once with HTTP 503 and a
+:py:class:`jsonrpc.common.ServerBusy` error, so the load is shed instead of
+piling up:
+
+    handler = JSON_RPC.customize(MyServerEvents)
+    httpd = PoolHTTPServer(('', 8007), handler, workers=32, queue_size=256)
+    httpd.serve_forever()
+
+A keep-alive connection holds its worker until it is closed, the
+:py:attr:`jsonrpc.server.JSON_RPC.idle_timeout` of the handler bounds the
+time a client may keep it idle.
+
+:py:meth:`PoolHTTPServer.stats` reports the depth of the queue, how long the
+connections waited for a worker and how many were turned away.
+"""
+
+import Queue
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import jsonrpc.common
+import jsonrpc.jsonutil
+from jsonrpc.utilities import public
+
+
+class BusyHandler(BaseHTTPRequestHandler):
+    '''Answer a request with a :py:class:`jsonrpc.common.ServerBusy` error,
+    without running it'''
+
+    #: Seconds the client has to send its request
+    timeout = 1
+
+    #: Bodies larger than this number of bytes are not read, the client may
+    #: then see its connection reset instead of the response
+    max_discard = 1 << 20
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        if length <= self.max_discard:
+            # once the request is read, closing the connection does not
+            # reset it before the client gets the response
+            self.rfile.read(length)
+        response = jsonrpc.common.Response(error=jsonrpc.common.ServerBusy())
+        body = jsonrpc.jsonutil.get_codec().to_bytes(response)
+        self.send_response(self.server.busy_status)
+        self.send_header("content-type", 'application/json')
+        self.send_header("content-length", len(body))
+        self.send_header("retry-after", self.server.retry_after)
+        self.send_header("connection", 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        '''Turning requests away is counted, not logged'''
+
+
+@public
+class PoolHTTPServer(HTTPServer):
+    '''An HTTP server whose connections are served by `workers` threads
+    started with the server.  Accepted connections wait for a free worker in
+    a queue of `queue_size` connections, when it is full they are turned away
+    by :py:class:`BusyHandler`.
+
+    :param server_address: (host, port) to listen on
+    :param handler_class: a customized subclass of
+                          :py:class:`jsonrpc.server.JSON_RPC`
+    :param int workers: number of threads serving the connections
+    :param int queue_size: number of connections which may wait for a worker,
+                           at least 1
+    '''
+
+    allow_reuse_address = True
+
+    #: Size of the listen() backlog
+    request_queue_size = 1024
+
+    #: HTTP status of the responses to the connections turned away.  With
+    #: 200 a :py:class:`jsonrpc.proxy.JSONRPCProxy` raises
+    #: :py:class:`jsonrpc.common.ServerBusy` rather than
+    #: :py:class:`urllib2.HTTPError`
+    busy_status = 503
+
+    #: Seconds after which the clients turned away may try again, sent in the
+    #: Retry-After header
+    retry_after = 1
+
+    #: Number of connections waiting to be turned away, further connections
+    #: are closed without a response
+    reject_queue_size = 64
+
+    def __init__(self, server_address, handler_class, workers=16,
+                 queue_size=64, bind_and_activate=True):
+        if workers < 1 or queue_size < 1:
+            raise ValueError('workers and queue_size must be at least 1')
+        self.workers = workers
+        self.queue_size = queue_size
+        # bounded by process_request, the only producer, so that stopping
+        # the workers never blocks
+        self._queue = Queue.Queue()
+        self._rejects = Queue.Queue(self.reject_queue_size)
+        self._lock = threading.Lock()
+        #: connections handed to the workers
+        self.accepted = 0
+        #: connections turned away because the queue was full
+        self.rejected = 0
+        #: connections which workers finished serving
+        self.served = 0
+        #: workers serving a connection
+        self.busy = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        HTTPServer.__init__(self, server_address, handler_class,
+                            bind_and_activate)
+        self._threads = [self._start(self._work) for _ in range(workers)]
+        self._threads.append(self._start(self._reject))
+
+    def _start(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def process_request(self, request, client_address):
+        if self._queue.qsize() >= self.queue_size:
+            with self._lock:
+                self.rejected += 1
+            try:
+                self._rejects.put_nowait((request, client_address))
+            except Queue.Full:
+                self.shutdown_request(request)
+        else:
+            self._queue.put((request, client_address, time.time()))
+            with self._lock:
+                self.accepted += 1
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address, queued = item
+            waited = time.time() - queued
+            with self._lock:
+                self.busy += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._lock:
+                    self.busy -= 1
+                    self.served += 1
+
+    def _reject(self):
+        while True:
+            item = self._rejects.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                BusyHandler(request, client_address, self)
+            except Exception:
+                # the client went away or did not send its request in time
+                pass
+            finally:
+                self.shutdown_request(request)
+
+    def stats(self):
+        '''Return the state of the server in a dictionary:
+
+        * `queued`: connections waiting for a worker, out of `queue_size`
+        * `busy`: workers serving a connection, out of `workers`
+        * `accepted`, `rejected`, `served`: counts of connections
+        * `wait_mean`, `wait_max`: seconds the accepted connections waited
+          for a worker
+        '''
+        with self._lock:
+            started = self.served + self.busy
+            return dict(queued=self._queue.qsize(), queue_size=self.queue_size,
+                        busy=self.busy, workers=self.workers,
+                        accepted=self.accepted, rejected=self.rejected,
+                        served=self.served, wait_max=self._wait_max,
+                        wait_mean=self._wait_total / started if started else 0.0)
+
+    def server_close(self):
+        '''Close the listening socket and the connections still waiting, the
+        workers stop after the connections they serve.  This waits up to a
+        second for them.'''
+        HTTPServer.server_close(self)
+        for queue in (self._queue, self._rejects):
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if item is not None:
+                    self.shutdown_request(item[0])
+        for _ in range(self.workers):
+            self._queue.put(None)
+        while True:
+            try:
+                self._rejects.put_nowait(None)
+                break
+            except Queue.Full:
+                # connections turned away meanwhile, close one to make room
+                try:
+                    item = self._rejects.get_nowait()
+                except Queue.Empty:
+                    continue
+                if item is not None:
+                    self.shutdown_request(item[0])
+        deadline = time.time() + 1
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.time()))
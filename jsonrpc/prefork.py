@@ -0,0 +1,363 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+"""
+Serve a :py:class:`jsonrpc.server.JSON_RPC` handler from several processes,
+so that methods which need the CPU are not serialized by the GIL.
+
+The workers are forked from a supervisor process.  They accept connections
+from one listening socket created before the fork, or, with
+``reuse_port=True``, each from a socket of its own bound with
+``SO_REUSEPORT``, which lets the kernel spread the connections evenly.
+Workers which die are replaced.
+
+    handler = JSON_RPC.customize(MyServerEvents)
+    PreforkServer(('', 8007), handler, workers=8).serve_forever()
+
+or from the command line, with a module defining the customized handler:
+
+    % python -m jsonrpc.prefork --port 8007 --workers 8 myservice:handler
+
+The supervisor stops on SIGTERM or SIGINT: every worker stops accepting
+connections, finishes the requests in progress and exits.  On SIGHUP the
+workers are replaced the same way, one listening socket keeps accepting
+connections in the meantime.
+"""
+
+import argparse
+import errno
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+
+from jsonrpc.utilities import public
+
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+@public
+class WorkerHTTPServer(ThreadingMixIn, HTTPServer):
+    '''The server run by each worker of a :py:class:`PreforkServer`, with a
+    thread per connection.  It keeps track of the connections which are
+    busy, from their acceptance and while a request is in progress, so
+    that they can be drained.  Idle keep-alive connections are not waited
+    for.
+    '''
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    #: Size of the listen() backlog
+    request_queue_size = 1024
+
+    #: Set when the worker stops, keep-alive connections are then closed
+    #: after their current request
+    draining = False
+
+    def __init__(self, server_address, handler_class, bind_and_activate=True):
+        HTTPServer.__init__(self, server_address, handler_class,
+                            bind_and_activate)
+        self._busy = set()
+        self._busy_lock = threading.Lock()
+
+    @property
+    def active(self):
+        '''The number of busy connections'''
+        return len(self._busy)
+
+    def process_request(self, request, client_address):
+        # busy until its first request has been answered
+        self.request_began(request)
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        self.request_ended(request)
+        HTTPServer.shutdown_request(self, request)
+
+    def request_began(self, connection):
+        with self._busy_lock:
+            self._busy.add(connection)
+
+    def request_ended(self, connection):
+        with self._busy_lock:
+            self._busy.discard(connection)
+
+
+@public
+class PreforkServer(object):
+    '''Run `workers` processes serving `handler_class` on `server_address`.
+
+    :param server_address: (host, port) to listen on
+    :param handler_class: a customized subclass of
+                          :py:class:`jsonrpc.server.JSON_RPC`
+    :param int workers: the number of worker processes, one per CPU by
+                        default
+    :param bool reuse_port: give each worker a listening socket of its own,
+                            the port can't be 0 then
+    '''
+
+    #: The server class run by the workers, it is created with
+    #: ``(server_address, handler_class, bind_and_activate)``
+    server_class = WorkerHTTPServer
+
+    #: Seconds a stopping worker waits for its requests in progress
+    drain_timeout = 30
+
+    #: Workers exiting within this many seconds of their start are replaced
+    #: only after :py:attr:`restart_delay`, so that a worker failing on
+    #: startup does not make the supervisor fork all the time
+    min_lifetime = 1
+
+    #: Seconds to wait before replacing workers which failed on startup
+    restart_delay = 1
+
+    #: Seconds between two checks of the supervisor and of the workers
+    poll_interval = 0.2
+
+    def __init__(self, server_address, handler_class, workers=None,
+                 reuse_port=False):
+        self.handler_class = handler_class
+        if workers is None:
+            workers = _cpu_count()
+        self.workers = workers
+        self.reuse_port = reuse_port
+        if reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise ValueError('SO_REUSEPORT is not supported here')
+            if not server_address[1]:
+                raise ValueError('reuse_port needs a port number')
+            #: the server listening for all workers, None with reuse_port
+            self.server = None
+            self.server_address = server_address
+        else:
+            self.server = self.server_class(server_address, handler_class)
+            self.server_address = self.server.server_address
+        #: the start time of every worker by process id
+        self.pids = {}
+        #: the start time of the workers replaced by :py:meth:`reload`, which
+        #: finish their requests in progress, by process id
+        self.draining = {}
+        self._stopping = False
+        self._reload = False
+        self._resume = 0
+
+    def worker_started(self, server):
+        '''Called in each worker before it serves, override to open
+        resources which must not be shared between processes.  Starts the
+        process pools of the handler's
+        :py:class:`jsonrpc.registry.MethodRegistry`, see
+        :py:mod:`jsonrpc.procpool`.'''
+        methods = getattr(self.handler_class.eventhandler, 'methods', None)
+        start_pools = getattr(methods, 'start_pools', None)
+        if start_pools is not None:
+            start_pools()
+
+    def shutdown(self):
+        '''Make :py:meth:`serve_forever` stop the workers and return, can be
+        called from a signal handler or from another thread'''
+        self._stopping = True
+
+    def reload(self):
+        '''Replace the workers by new ones, like SIGHUP.  The new workers are
+        started right away, the old ones finish their requests in progress'''
+        self._reload = True
+
+    def serve_forever(self):
+        '''Start the workers and replace those which exit until
+        :py:meth:`shutdown` is called or SIGTERM or SIGINT is received
+        '''
+        handlers = dict((signum, signal.getsignal(signum))
+                        for signum in (signal.SIGTERM, signal.SIGINT,
+                                       signal.SIGHUP))
+        signal.signal(signal.SIGTERM, lambda *_: self.shutdown())
+        signal.signal(signal.SIGINT, lambda *_: self.shutdown())
+        signal.signal(signal.SIGHUP, lambda *_: self.reload())
+        try:
+            while not self._stopping:
+                if self._reload:
+                    self._reload = False
+                    # the new workers accept connections while the old
+                    # ones finish their requests
+                    self.draining.update(self.pids)
+                    self.pids.clear()
+                    self._signal(signal.SIGTERM, self.draining)
+                self._spawn()
+                time.sleep(self.poll_interval)
+                self._reap()
+        finally:
+            self._stop_workers()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            self._stopping = False
+
+    def server_close(self):
+        if self.server is not None:
+            self.server.server_close()
+
+    def _spawn(self):
+        if time.time() < self._resume:
+            return
+        while len(self.pids) < self.workers:
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    self._run_worker()
+                    status = 0
+                except:
+                    log.exception('worker %d failed', os.getpid())
+                finally:
+                    os._exit(status)
+            self.pids[pid] = time.time()
+
+    def _reap(self):
+        while self.pids or self.draining:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                if exc.errno == errno.ECHILD:
+                    self.pids.clear()
+                    self.draining.clear()
+                break
+            if not pid:
+                break
+            if self.draining.pop(pid, None) is not None:
+                continue
+            started = self.pids.pop(pid, None)
+            if started is None:
+                continue
+            if status and not self._stopping:
+                log.warning('worker %d exited with status %d', pid, status)
+            if time.time() - started < self.min_lifetime:
+                self._resume = time.time() + self.restart_delay
+
+    def _signal(self, signum, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def _stop_workers(self):
+        self._signal(signal.SIGTERM, self.pids)
+        # a little longer than the workers wait themselves
+        deadline = time.time() + self.drain_timeout + 5
+        while (self.pids or self.draining) and time.time() < deadline:
+            time.sleep(0.05)
+            self._reap()
+        self._signal(signal.SIGKILL, self.pids.keys() + self.draining.keys())
+        while self.pids or self.draining:
+            self._reap()
+
+    def _run_worker(self):
+        '''Called in the worker process'''
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        # the supervisor handles ^C of the terminal
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        server = self.server
+        if server is None:
+            server = self.server_class(self.server_address, self.handler_class,
+                                       False)
+            server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            server.server_bind()
+            server.server_activate()
+
+        def stop(*_):
+            # shutdown() waits for serve_forever() to return, which runs in
+            # this thread
+            threading.Thread(target=server.shutdown).start()
+        signal.signal(signal.SIGTERM, stop)
+
+        # before any thread is started, it may fork
+        self.worker_started(server)
+
+        def watch(supervisor):
+            # don't outlive a supervisor which was killed
+            while os.getppid() == supervisor:
+                time.sleep(self.poll_interval)
+            stop()
+        watcher = threading.Thread(target=watch, args=(os.getppid(),))
+        watcher.daemon = True
+        watcher.start()
+        server.serve_forever(self.poll_interval)
+
+        server.draining = True
+        deadline = time.time() + self.drain_timeout
+        while getattr(server, 'active', 0) and time.time() < deadline:
+            time.sleep(0.05)
+
+
+def _cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='serve a JSON-RPC handler from several processes')
+    parser.add_argument('handler', metavar='MODULE:HANDLER',
+                        help='the customized JSON_RPC subclass to serve')
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=8007)
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes, one per CPU by default')
+    parser.add_argument('--reuse-port', action='store_true',
+                        help='give each worker a listening socket of its own')
+    args = parser.parse_args(args)
+
+    module, _, name = args.handler.partition(':')
+    handler = getattr(importlib.import_module(module), name or 'handler')
+    logging.basicConfig()
+    server = PreforkServer((args.host, args.port), handler, args.workers,
+                           args.reuse_port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+"""
+Run CPU-bound methods in a pool of processes, so that they do not hold the
+GIL while the server handles other requests.  Register them with the
+`process` option of :py:meth:`jsonrpc.registry.MethodRegistry.register`:
+
+    registry = MethodRegistry()
+
+    @registry.method('report.render', process=True)
+    def render(document):
+        ...
+
+The arguments and the result of a call are pickled to and from a worker
+process, the method must therefore be a function defined at module level.
+Errors raised by the method are pickled back as well and rendered into the
+response like any other error.  Methods registered without `process` keep
+running in the thread of the request.
+
+``process=True`` uses the pool returned by :py:func:`default_pool`, a
+:py:class:`ProcessPool` can be passed instead to give a group of methods
+workers of their own or a timeout.
+
+A pool forks its processes when it is first used.  Start the pools before
+the server runs threads, with
+:py:meth:`jsonrpc.registry.MethodRegistry.start_pools` before
+``serve_forever()``; :py:class:`jsonrpc.prefork.PreforkServer` does it in
+each of its workers.
+"""
+
+import multiprocessing
+import os
+import threading
+
+from jsonrpc.utilities import public
+
+
+# AsyncResult.get() without a timeout can't be interrupted
+_FOREVER = 365 * 24 * 3600
+
+
+@public
+class ProcessPool(object):
+    '''A :py:class:`multiprocessing.Pool` started by the first call in each
+    process, so that a pool created before the server forks (see
+    :py:mod:`jsonrpc.prefork`) gives every worker processes of its own.
+
+    :param int processes: number of worker processes, one per CPU if None
+    :param float timeout: seconds to wait for the result of a call before
+                          raising :py:class:`multiprocessing.TimeoutError`,
+                          None to wait for ever.  A worker process which dies
+                          during a call never returns its result, the
+                          timeout frees the request waiting for it.
+    :param int maxtasksperchild: calls a worker process runs before it is
+                                 replaced, None for no limit
+    '''
+
+    def __init__(self, processes=None, timeout=60, maxtasksperchild=None):
+        self.processes = processes
+        self.timeout = timeout
+        self.maxtasksperchild = maxtasksperchild
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        '''The :py:class:`multiprocessing.Pool` of the current process'''
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = multiprocessing.Pool(
+                    self.processes, maxtasksperchild=self.maxtasksperchild)
+                self._pid = os.getpid()
+            return self._pool
+
+    def start(self):
+        '''Start the worker processes of the current process unless they are
+        running'''
+        self.pool
+
+    def apply(self, func, args=(), kwargs=None):
+        '''Return ``func(*args, **kwargs)`` computed by a worker process, or
+        raise the error it raised'''
+        result = self.pool.apply_async(func, args, kwargs or {})
+        return result.get(_FOREVER if self.timeout is None else self.timeout)
+
+    def close(self):
+        '''Stop the worker processes, the next call starts new ones'''
+        with self._lock:
+            pool, self._pool = self._pool, None
+            if pool is None or self._pid != os.getpid():
+                return
+        pool.terminate()
+        pool.join()
+
+
+_default = ProcessPool()
+
+@public
+def default_pool():
+    '''Return the :py:class:`ProcessPool` of the methods registered with
+    ``process=True``'''
+    return _default
@@ -32,19 +32,27 @@
 #
 
 import cookielib
+import itertools
+import Queue
 import urllib2
 import urlparse
 import random
+import threading
 import time
 import UserDict, collections
 collections.Mapping.register(UserDict.DictMixin)
 
 from hashlib import sha1
+from cStringIO import StringIO
 import jsonrpc.jsonutil
 from jsonrpc import __version__
-from jsonrpc.common import Response, Request
+from jsonrpc.common import Response, Request, ParseError, RPCError
+from jsonrpc.cache import MethodCaches, cache_key
+from jsonrpc.compression import decompress
+from jsonrpc.connection import HTTPConnectionPool
+from jsonrpc.utilities import Future
 
-__all__ = ['JSONRPCProxy', 'ProxyEvents']
+__all__ = ['JSONRPCProxy', 'ProxyEvents', 'AutoBatcher']
 
 
 class NewStyleBaseException(Exception):
@@ -58,16 +66,136 @@ class NewStyleBaseException(Exception):
 
 
 class IDGen(object):
+    '''Generate request ids from a counter, this is cheap and thread safe.
+
+    Ids only need to be unique among the requests in flight on a connection.
+    '''
+
+    def __init__(self):
+        self._next = itertools.count(1).next
+
+    def __get__(self, *_, **__):
+        return self._next()
+
+
+class HashIDGen(object):
+    '''Generate opaque request ids by hashing a counter, the time and a random
+    number, use this if ids should not be predictable.
+    '''
+
     def __init__(self):
         self._hasher = sha1()
         self._id = 0
+        self._lock = threading.Lock()
 
     def __get__(self, *_, **__):
-        self._id += 1
-        self._hasher.update(str(self._id))
-        self._hasher.update(time.ctime())
-        self._hasher.update(str(random.random))
-        return self._hasher.hexdigest()
+        with self._lock:
+            self._id += 1
+            self._hasher.update(str(self._id))
+            self._hasher.update(time.ctime())
+            self._hasher.update(str(random.random()))
+            return self._hasher.hexdigest()
+
+
+def _calls(methods):
+    '''Return the pairs (method, (args, kwargs)) of a batch, the items of
+    `methods` in their order when it is a dictionary'''
+    if hasattr(methods, 'items'):
+        return methods.items()
+    return methods
+
+
+class AutoBatcher(object):
+    '''Merge the calls submitted from any thread within `window` seconds of
+    each other, up to `max_size` of them, into batches.
+
+    A background thread collects the batches and hands each to a thread
+    calling ``send(items)``, with a list of pairs (request, future), which
+    has to complete every future.  At most `senders` batches are sent at the
+    same time, the next calls are collected meanwhile.
+    '''
+
+    def __init__(self, send, window=0.005, max_size=100, senders=4):
+        self.send = send
+        self.window = window
+        self.max_size = max_size
+        self.senders = senders
+        self._sending = threading.BoundedSemaphore(senders)
+        #: number of batches sent and of the calls they contained
+        self.batches = self.calls = 0
+        self._cond = threading.Condition()
+        self._pending = []
+        self._deadline = None
+        self._thread = None
+        self._closed = False
+
+    def submit(self, request):
+        '''Queue `request` for the next batch
+
+        :returns: a :py:class:`jsonrpc.utilities.Future` of its response
+        '''
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('the batcher is closed')
+            if not self._pending:
+                self._deadline = time.time() + self.window
+            self._pending.append((request, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='jsonrpc-autobatch')
+                self._thread.daemon = True
+                self._thread.start()
+            if len(self._pending) in (1, self.max_size):
+                self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                while len(self._pending) < self.max_size and not self._closed:
+                    remaining = self._deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_size]
+                del self._pending[:self.max_size]
+                # the rest has waited long enough already
+                self._deadline = time.time()
+                self.batches += 1
+                self.calls += len(batch)
+            self._sending.acquire()
+            sender = threading.Thread(target=self._deliver, args=(batch,),
+                                      name='jsonrpc-autobatch-send')
+            sender.daemon = True
+            sender.start()
+
+    def _deliver(self, batch):
+        try:
+            self.send(batch)
+        except BaseException, exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+        finally:
+            self._sending.release()
+
+    def close(self):
+        '''Send the pending calls, wait for their responses and stop the
+        background thread'''
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        for _ in range(self.senders):
+            self._sending.acquire()
+        for _ in range(self.senders):
+            self._sending.release()
 
 
 class ProxyEvents(object):
@@ -103,17 +231,52 @@ class JSONRPCProcessor(urllib2.BaseHandler):
         self.handler_order = 100
 
     def http_request(self, request):
-        request.add_header('content-type', 'application/json')
+        if not request.has_header('Content-type'):
+            request.add_header('content-type', 'application/json')
         request.add_header('user-agent', 'jsonrpc/'+__version__)
+        request.add_header('accept-encoding', 'gzip, deflate')
         return request
 
-	https_request = http_request
+    def http_response(self, request, response):
+        encoding = response.info().getheader('content-encoding')
+        if encoding:
+            data = decompress(response.read(), encoding)
+            result = urllib2.addinfourl(StringIO(data), response.info(),
+                                        response.geturl(), response.getcode())
+            result.msg = response.msg
+            return result
+        return response
+
+    https_request = http_request
+    https_response = http_response
 
 class JSONRPCProxy(object):
     '''A class implementing a JSON-RPC Proxy.
 
     :param str host: The HTTP server hosting the JSON-RPC server
     :param str path: The path where the JSON-RPC server can be found
+    :param codec: a :py:class:`jsonrpc.jsonutil.Codec` or the name of one,
+                  the default codec if not given.  With a binary codec like
+                  ``'cbor'`` the proxy falls back to the default codec for
+                  servers which answer that they can't parse the request.
+    :param compress_min_size: compress requests of at least this many bytes,
+                              by default requests are sent uncompressed.
+                              Compressed responses are always accepted.
+    :param int compress_level: zlib compression level of requests
+    :param cache: a :py:class:`jsonrpc.cache.MethodCaches`, or the dictionary
+                  to create one from, whose methods are answered from the
+                  cache while their results are valid
+    :param float batch_window: merge the calls made within this many seconds,
+                               from any thread, into one batch request, see
+                               :py:class:`AutoBatcher`.  Each caller still
+                               gets its own result.
+    :param int batch_size: the largest number of calls merged into a batch
+    :param int batch_senders: the number of batches sent at the same time
+    :param int chunk_size: :py:meth:`batch_call` splits larger batches into
+                           chunks of this many calls, sent concurrently.  By
+                           default a batch is sent as one request.
+    :param int chunk_workers: the number of chunks sent at the same time,
+                              each over its own connection
 
     There are two ways of instantiating this class:
     - JSONRPCProxy.from_url(url) -- give the absolute url to the JSON-RPC server
@@ -139,16 +302,24 @@ class JSONRPCProxy(object):
 
     ## Public interface
     @classmethod
-    def from_url(cls, url, ctxid=None, serviceName=None):
-        '''Create a JSONRPCProxy from a URL'''
+    def from_url(cls, url, ctxid=None, serviceName=None, **kwargs):
+        '''Create a JSONRPCProxy from a URL, keyword arguments are passed to
+        the constructor
+
+        A ``unix:///path/to/socket`` url selects a server listening on that
+        unix socket, see :py:class:`jsonrpc.unixserver.UnixHTTPServer`.
+        '''
         urlsp = urlparse.urlsplit(url)
+        if urlsp.scheme == 'unix':
+            # all of the url is needed to find the socket
+            return cls(url, '', serviceName, ctxid, **kwargs)
         url = '{0}://{1}'.format(urlsp.scheme, urlsp.netloc)
         path = urlsp.path
         if urlsp.query:
             path = '{0}?{1}'.format(path, urlsp.query)
         if urlsp.fragment:
             path = '{0}#{1}'.format(path, urlsp.fragment)
-        return cls(url, path, serviceName, ctxid)
+        return cls(url, path, serviceName, ctxid, **kwargs)
 
     def __init__(self, host, path='jsonrpc', serviceName=None, *args, **kwargs):
         self.serviceURL = host
@@ -156,10 +327,37 @@ class JSONRPCProxy(object):
         self._path = path
         self.serviceURL, self._path = self._transformURL(host, path)
         self.customize(self._eventhandler)
-
-        cj = cookielib.CookieJar()
-        self._opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cj))
-        self._opener.add_handler(JSONRPCProcessor())
+        self._codec = jsonrpc.jsonutil.get_codec(kwargs.get('codec'))
+        self._json_codec = (jsonrpc.jsonutil.get_codec() if self._codec.binary
+                            else self._codec)
+        # urls of the servers which do not understand self._codec
+        self._fallback = kwargs.get('fallback', set())
+        self._compress_min_size = kwargs.get('compress_min_size')
+        self._compress_level = kwargs.get('compress_level', 6)
+        cache = kwargs.get('cache')
+        if cache is not None and not isinstance(cache, MethodCaches):
+            cache = MethodCaches(cache)
+        self._cache = cache
+        self._batcher = kwargs.get('batcher')
+        if self._batcher is None and kwargs.get('batch_window') is not None:
+            self._batcher = AutoBatcher(self._send_batch, kwargs['batch_window'],
+                                        kwargs.get('batch_size', 100),
+                                        kwargs.get('batch_senders', 4))
+        self._chunk_size = kwargs.get('chunk_size')
+        self._chunk_workers = kwargs.get('chunk_workers', 4)
+        self._opener = kwargs.get('opener') or self._build_opener()
+
+    def _build_opener(self):
+        '''Return the object whose `open(url, data)` method posts requests,
+        it is shared by the proxies created from this one.  The default pool
+        of keep-alive connections keeps the cookies set by the server.
+
+        Override to return a :py:mod:`urllib2` opener, with a
+        :py:class:`JSONRPCProcessor`, for other handlers.
+        '''
+        return HTTPConnectionPool(compress_min_size=self._compress_min_size,
+                                  compress_level=self._compress_level,
+                                  cookiejar=cookielib.CookieJar())
 
     def _set_opener(self, opener):
         self._opener = opener
@@ -168,13 +366,25 @@ class JSONRPCProxy(object):
     def __getattr__(self, name):
         if self._serviceName != None:
             name = "{0}.{1}".format(self._serviceName, name)
-        return self.__class__(self.serviceURL, path=self._path, serviceName=name).customize(type(self._eventhandler))._set_opener(self._opener)
-
-    def _get_postdata(self, args=None, kwargs=None):
+        return self._derive(name)
+
+    def _derive(self, name):
+        '''Return a proxy for the method `name` sharing the connections and
+        the settings of this one'''
+        return self.__class__(self.serviceURL, path=self._path, serviceName=name,
+                              opener=self._opener, codec=self._codec,
+                              fallback=self._fallback, cache=self._cache,
+                              batcher=self._batcher, chunk_size=self._chunk_size,
+                              chunk_workers=self._chunk_workers
+                             ).customize(type(self._eventhandler))
+
+    def _get_request(self, args=None, kwargs=None):
         _args, _kwargs = self._eventhandler.get_params(args, kwargs)
         id = self._eventhandler.IDGen
-        result = Request(id, self._serviceName, _args, _kwargs)
-        return jsonrpc.jsonutil.encode(result)
+        return Request(id, self._serviceName, _args, _kwargs)
+
+    def _get_postdata(self, args=None, kwargs=None):
+        return self._codec.encode(self._get_request(args, kwargs))
 
     def _get_url(self):
         result = [self.serviceURL]
@@ -183,44 +393,323 @@ class JSONRPCProxy(object):
         #result.append('')
         return '/'.join(result)
 
-    def _post(self, url, data):
-        return self._opener.open(url, data)
+    def _post(self, url, data, headers=None):
+        if headers is None:
+            return self._opener.open(url, data)
+        if isinstance(self._opener, urllib2.OpenerDirector):
+            return self._opener.open(urllib2.Request(url, data, headers))
+        return self._opener.open(url, data, headers)
 
-    def __call__(self, *args, **kwargs):
+    def _send(self, obj):
+        '''Post the request, or list of requests, `obj` and return the
+        decoded response'''
         url = self._get_url()
-        postdata = self._get_postdata(args, kwargs)
-        #respdata = urllib2.urlopen(url, postdata).read()
-        respdata = self._post(url, postdata).read()
-        resp = Response.from_dict(jsonrpc.jsonutil.decode(respdata))
-        resp = self._eventhandler.proc_response(resp)
+        codec = self._codec
+        if not codec.binary:
+            return codec.decode(self._post(url, codec.to_bytes(obj)).read())
+
+        if url in self._fallback:
+            codec = self._json_codec
+        headers = {
+            'Content-Type': codec.content_type,
+            'Accept': '{0}, application/json'.format(self._codec.content_type),
+        }
+        resp = self._post(url, codec.to_bytes(obj), headers)
+        content_type = resp.info().getheader('content-type') or ''
+        if content_type.split(';', 1)[0].strip() == self._codec.content_type:
+            return self._codec.decode(resp.read())
+
+        data = self._json_codec.decode(resp.read())
+        if codec is self._codec and self._is_parse_error(data):
+            # the server does not know the binary codec, nothing was run
+            self._fallback.add(url)
+            return self._send(obj)
+        return data
+
+    def _is_parse_error(self, data):
+        error = data.get('error') if isinstance(data, dict) else None
+        return isinstance(error, dict) and error.get('code') == ParseError.code
+
+    def _post_stream(self, url, data):
+        '''Post `data` asking for a streamed response, return a response
+        whose lines can be iterated over as they arrive'''
+        open_stream = getattr(self._opener, 'open_stream', None)
+        if open_stream is None:
+            return self._post(url, data)
+        accept = 'application/x-ndjson, application/json'
+        return open_stream(url, data, {'Accept': accept})
+
+    def _cache_key(self, request):
+        '''Return the pair (cache, key) of a request, or (None, None) if its
+        method is not cached'''
+        cache = None if self._cache is None else self._cache.get(request.method)
+        if cache is None:
+            return None, None
+        return cache, cache_key(request.method, request.args, request.kwargs)
 
+    def __call__(self, *args, **kwargs):
+        request = self._get_request(args, kwargs)
+        cache, key = self._cache_key(request)
+        if cache is not None:
+            entry = cache.get(key)
+            if entry is not None:
+                return entry.value
+
+        if self._batcher is None:
+            result = self._call_request(request)
+        else:
+            result = self._batcher.submit(request).result()
+        if cache is not None:
+            cache.put(key, result)
+        return result
+
+    def _call_request(self, request):
+        resp = Response.from_dict(self._send(request))
+        resp = self._eventhandler.proc_response(resp)
         return resp.get_result()
 
+    def _send_batch(self, items):
+        '''Send the requests of `items`, pairs (request, future), as a batch
+        and complete every future with the outcome of its request'''
+        # calls may share an id, their responses are taken in order
+        futures = collections.defaultdict(collections.deque)
+        for request, future in items:
+            futures[request.id].append(future)
+        resp = Response.from_json(self._send([request for request, _ in items]))
+        if not isinstance(resp, list):
+            # an error concerning the whole batch
+            resp = [Response(id=request.id, error=resp.error)
+                    for request, _ in items]
+        for res in resp:
+            waiting = futures.get(res.id)
+            if not waiting:
+                continue
+            future = waiting.popleft()
+            try:
+                res = self._eventhandler.proc_response(res)
+                future.set_result(res.get_result())
+            except BaseException, exc:
+                future.set_exception(exc)
+        for waiting in futures.values():
+            for future in waiting:
+                future.set_exception(RPCError.from_dict(
+                    dict(code=0, message='no response to the request')))
+
+    def call_async(self, method, *args, **kwargs):
+        '''call a JSON-RPC method, without waiting for the result when
+        calls are batched automatically
+
+        :returns: a :py:class:`jsonrpc.utilities.Future` of the result
+        '''
+        proxy = self._derive(method)
+        request = proxy._get_request(args, kwargs)
+        cache, key = proxy._cache_key(request)
+        entry = None if cache is None else cache.get(key)
+        if entry is not None:
+            future = Future()
+            future.set_result(entry.value)
+            return future
+
+        if proxy._batcher is None:
+            future = Future()
+            try:
+                future.set_result(proxy._call_request(request))
+            except BaseException, exc:
+                future.set_exception(exc)
+        else:
+            future = proxy._batcher.submit(request)
+        if cache is None:
+            return future
+
+        # store the result before waiters see it, so that they find it in the
+        # cache when they call again
+        cached = Future()
+        def store(future):
+            exc = future.exception()
+            if exc is None:
+                cache.put(key, future.result())
+                cached.set_result(future.result())
+            else:
+                cached.set_exception(exc)
+        future.add_done_callback(store)
+        return cached
+
     def call(self, method, *args, **kwargs):
         '''call a JSON-RPC method
 
         It's better to use instance.<methodname>(\\*args, \\*\\*kwargs),
         but this version might be useful occasionally
         '''
-        p = self.__class__(self.serviceURL, path=self._path, serviceName=method)
-        return p(*args, **kwargs)
+        return self._derive(method)(*args, **kwargs)
+
+    def close(self):
+        '''Stop the background thread batching the calls, if any, once the
+        pending calls are answered, and close the idle connections.  Call it
+        on the root proxy, the proxies derived from it share both.  A remote
+        method named ``close`` is called with ``proxy.call('close')``.
+        '''
+        if self._batcher is not None:
+            self._batcher.close()
+        clear = getattr(self._opener, 'clear', None)
+        if clear is not None:
+            clear()
 
     def batch_call(self, methods):
-        '''call several methods at once, return a list of (result, error) pairs
+        '''call several methods at once
+
+        Calls of cached methods are answered from the cache when possible,
+        only the other ones are sent.  Batches of more than `chunk_size`
+        calls are split into chunks sent concurrently.  When a whole chunk
+        is rejected, or can't be sent while other chunks can, each of its
+        calls gets the error.
+
+        :param names: a list of pairs (method, (args, kwargs)), or a
+                      dictionary { method: (args, kwargs) } whose calls are
+                      made in the order of its items, use a
+                      :py:class:`collections.OrderedDict` to choose it
+        :returns: a list of pairs (result, error) where only one is not None,
+                  in the order of the calls
+        '''
+        requests = [getattr(self, k)._get_request(*v) for k, v in _calls(methods)]
+        result = [None] * len(requests)
+        missing = []
+        for n, request in enumerate(requests):
+            cache, key = self._cache_key(request)
+            entry = None if cache is None else cache.get(key)
+            if entry is None:
+                missing.append((n, cache, key))
+            else:
+                result[n] = (entry.value, None)
+        if not missing:
+            return result
+
+        size = self._chunk_size or len(missing)
+        chunks = [[requests[n] for n, _, _ in missing[i:i + size]]
+                  for i in xrange(0, len(missing), size)]
+        responses = {}
+        errors = {}
+        for chunk, resp in zip(chunks, self._send_chunks(chunks)):
+            if isinstance(resp, BaseException):
+                error = dict(code=0, message='the batch failed: %s' % (resp,))
+            elif isinstance(resp, Response):
+                # the whole chunk was rejected, e.g. with a parse error
+                error = resp.error
+            else:
+                responses.update((res.id, res) for res in resp)
+                continue
+            errors.update((request.id, error) for request in chunk)
+        for n, cache, key in missing:
+            res = responses.get(requests[n].id)
+            if res is None:
+                error = errors.get(requests[n].id) or dict(
+                    code=0, message='no response to the request')
+                result[n] = (None, error)
+                continue
+            result[n] = res.get_output()
+            if cache is not None and res.error is None:
+                cache.put(key, res.result)
+        return result
 
-        :param names: a dictionary { method: (args, kwargs) }
-        :returns: a list of pairs (result, error) where only one is not None
+    def _send_chunks(self, chunks):
+        '''Send each list of requests of `chunks` as a batch, up to
+        `chunk_workers` of them at the same time
+
+        :returns: the list of the decoded responses to the chunks, or of the
+                  exceptions raised while sending them
+        :raises: the exception of the first chunk when every chunk failed
         '''
-        result = None
-        if hasattr(methods, 'items'):
-            methods = methods.items()
-        data = [getattr(self, k)._get_postdata(*v) for k, v in methods]
-        postdata = '[{0}]'.format(','.join(data))
-        respdata = self._post(self._get_url(), postdata).read()
-        resp = Response.from_json(respdata)
-        try:
-            result = resp.get_result()
-        except AttributeError:
-            result = [res.get_output() for res in resp]
+        if len(chunks) == 1:
+            return [Response.from_json(self._send(chunks[0]))]
+        responses = [None] * len(chunks)
+        errors = []
+        todo = Queue.Queue()
+        for item in enumerate(chunks):
+            todo.put(item)
+
+        def work():
+            while True:
+                try:
+                    n, chunk = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    responses[n] = Response.from_json(self._send(chunk))
+                except BaseException, exc:
+                    responses[n] = exc
+                    errors.append(exc)
+
+        threads = [threading.Thread(target=work, name='jsonrpc-batch-chunk')
+                   for _ in xrange(min(self._chunk_workers, len(chunks)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(errors) == len(chunks):
+            raise responses[0]
+        return responses
+
+    def batch_call_iter(self, methods, ordered=True):
+        '''call several methods at once, yield the (result, error) pairs as
+        the responses arrive
+
+        The server sends each response as soon as its call completes when it
+        supports streamed responses, otherwise all of them arrive at once.
+
+        :param names: the calls, as for :py:meth:`batch_call`
+        :param bool ordered: yield the pairs in the order of the calls,
+                             holding back responses which arrive early.
+                             When False, pairs (n, (result, error)) are
+                             yielded in the order of arrival, `n` being the
+                             position of the call
+
+        Every call gets its pair, the error ``no response to the request``
+        when the server did not answer it.
+        '''
+        requests = [getattr(self, k)._get_request(*v) for k, v in _calls(methods)]
+        positions = dict((req.id, n) for n, req in enumerate(requests))
+        postdata = self._json_codec.to_bytes(requests)
 
-        return result
+        resp = self._post_stream(self._get_url(), postdata)
+        try:
+            ctype = resp.info().getheader('content-type') or ''
+            if ctype.startswith('application/x-ndjson'):
+                lines = iter(resp)
+            else:
+                lines = [resp.read()]
+
+            early = {}
+            wanted = 0
+            for line in lines:
+                if not line.strip():
+                    continue
+                data = self._json_codec.decode(line)
+                if not isinstance(data, list):
+                    data = [data]
+                for res in data:
+                    res = Response.from_dict(res)
+                    n = positions.pop(res.id, None)
+                    if n is None:
+                        # an error concerning the whole batch
+                        res.get_result()
+                        continue
+                    if not ordered:
+                        yield n, res.get_output()
+                        continue
+                    early[n] = res.get_output()
+                    while wanted in early:
+                        yield early.pop(wanted)
+                        wanted += 1
+            # some calls got no response at all
+            missing = lambda: (None, dict(code=0,
+                                          message='no response to the request'))
+            if not ordered:
+                for n in sorted(positions.values()):
+                    yield n, missing()
+                return
+            for n in xrange(wanted, len(requests)):
+                yield early.pop(n) if n in early else missing()
+        finally:
+            close = getattr(resp, 'close', None)
+            if close is not None:
+                close()
@@ -0,0 +1,340 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+
+"""
+A registry of JSON-RPC methods, assign it to :py:attr:`ServerEvents.methods`:
+
+    registry = MethodRegistry()
+
+    @registry.method('math.add')
+    def add(a, b):
+        return a + b
+
+    class MyServer(ServerEvents):
+        methods = registry
+
+A client calls it as ``proxy.math.add(1, 2)``.  Per-method options are
+resolved when the method is registered, so a call costs one dict lookup.
+"""
+
+import functools
+import inspect
+import weakref
+
+from jsonrpc.cache import ResultCache, SingleFlight
+from jsonrpc.common import InvalidParams
+from jsonrpc.procpool import default_pool
+from jsonrpc.utilities import public
+
+
+@public
+class BindingPlan(object):
+    '''What a method's signature accepts, built once per method so that
+    every request can be checked before the method runs.
+    '''
+
+    def __init__(self, names, required, varargs, varkw, defaults=()):
+        #: names of the positional parameters
+        self.names = tuple(names)
+        #: number of leading names without a default value
+        self.required = required
+        #: default values of the names after the required ones
+        self.defaults = tuple(defaults)
+        self.varargs = varargs
+        self.varkw = varkw
+        self._positions = dict((name, n) for n, name in enumerate(names))
+
+    @classmethod
+    def from_callable(cls, func):
+        '''Return the plan for `func`, or None if its signature can't be
+        introspected (builtins, ...).  The plan of a class is the one of its
+        ``__init__``, the plan of a callable object the one of the
+        ``__call__`` of its class.
+        '''
+        # whether the first parameter receives the instance
+        receiver = False
+        if inspect.isclass(func):
+            func = getattr(func, '__init__', None)
+            receiver = True
+        elif not (inspect.isfunction(func) or inspect.ismethod(func)):
+            # like a call, ignore a __call__ set on the object itself
+            func = getattr(func.__class__, '__call__', None)
+            receiver = True
+        if inspect.ismethod(func):
+            skip = 1 if receiver or func.im_self is not None else 0
+            func = func.im_func
+        elif inspect.isfunction(func):
+            skip = 0
+        else:
+            return None
+        args, varargs, varkw, defaults = inspect.getargspec(func)
+        if not all(isinstance(name, str) for name in args):
+            # tuple parameters
+            return None
+        defaults = defaults or ()
+        required = max(len(args) - len(defaults) - skip, 0)
+        optional = len(args) - skip - required
+        return cls(args[skip:], required, varargs is not None, varkw is not None,
+                   defaults[len(defaults) - optional:])
+
+    def check(self, args, kwargs):
+        '''Raise :py:class:`jsonrpc.common.InvalidParams` if the method can't
+        be called with `args` and `kwargs`
+        '''
+        nargs = len(args)
+        if nargs > len(self.names) and not self.varargs:
+            raise InvalidParams
+        for name in kwargs:
+            position = self._positions.get(name)
+            if position is None:
+                if not self.varkw:
+                    raise InvalidParams
+            elif position < nargs:
+                # given positionally and by keyword
+                raise InvalidParams
+        if nargs < self.required:
+            for name in self.names[nargs:self.required]:
+                if name not in kwargs:
+                    raise InvalidParams
+
+    def bind(self, args, kwargs):
+        '''Return the pair (args, kwargs) of a call accepted by :py:meth:`check`
+        with every positional parameter passed by position and the defaults
+        filled in, so that equivalent calls give equal pairs
+        '''
+        args = tuple(args)
+        if len(args) >= len(self.names):
+            return args, kwargs
+        kwargs = dict(kwargs)
+        bound = list(args)
+        for n in range(len(args), len(self.names)):
+            name = self.names[n]
+            if name in kwargs:
+                bound.append(kwargs.pop(name))
+            else:
+                bound.append(self.defaults[n - self.required])
+        return tuple(bound), kwargs
+
+
+_plans = weakref.WeakKeyDictionary()
+
+def binding_plan(func):
+    '''Return the cached :py:class:`BindingPlan` of any callable'''
+    if isinstance(func, RegisteredMethod):
+        return func.plan
+    key = getattr(func, 'im_func', func)
+    bound = getattr(func, 'im_self', None) is not None
+    try:
+        return _plans[key][bound]
+    except KeyError:
+        pass
+    except TypeError:
+        # not weak referenceable
+        return BindingPlan.from_callable(func)
+    plans = _plans.setdefault(key, {})
+    plan = plans[bound] = BindingPlan.from_callable(func)
+    return plan
+
+
+def _apply(pool, func, *args, **kwargs):
+    return pool.apply(func, args, kwargs)
+
+
+@public
+class RegisteredMethod(object):
+    '''A method in a :py:class:`MethodRegistry`, calling it runs the method
+    with all its options applied.
+    '''
+
+    def __init__(self, name, func, postprocess=None, **options):
+        if not callable(func):
+            raise TypeError('%r is not callable' % (func,))
+        #: the name used by clients, e.g. ``service.method``
+        self.name = name
+        self.func = func
+        self.postprocess = postprocess
+        self.options = options
+        #: the :py:class:`BindingPlan` requests are checked against
+        self.plan = BindingPlan.from_callable(func)
+        cache = options.get('cache')
+        if cache is True:
+            cache = ResultCache()
+        elif cache is False:
+            cache = None
+        #: the :py:class:`jsonrpc.cache.ResultCache` of the method, or None
+        self.cache = cache
+        flight = options.get('single_flight')
+        if flight is True:
+            flight = SingleFlight()
+        elif flight is False:
+            flight = None
+        #: the :py:class:`jsonrpc.cache.SingleFlight` of the method, or None
+        self.single_flight = flight
+        process = options.get('process')
+        if process is True:
+            process = default_pool()
+        elif process is False:
+            process = None
+        #: the :py:class:`jsonrpc.procpool.ProcessPool` running the method, or
+        #: None to run it in the thread of the request
+        self.process = process
+        self.call = self.build()
+
+    def build(self):
+        '''Return the callable which implements a call to this method'''
+        func, postprocess = self.func, self.postprocess
+        if self.process is not None:
+            func = functools.partial(_apply, self.process, func)
+        if postprocess is None:
+            return func
+
+        def call(*args, **kwargs):
+            return postprocess(func(*args, **kwargs), args, kwargs)
+        return call
+
+    def __call__(self, *args, **kwargs):
+        return self.call(*args, **kwargs)
+
+    def __repr__(self):
+        return '<RegisteredMethod %s>' % self.name
+
+
+@public
+class MethodRegistry(object):
+    '''A mapping of method names to :py:class:`RegisteredMethod`'''
+
+    method_class = RegisteredMethod
+
+    def __init__(self):
+        self._methods = {}
+
+    def register(self, name, func, **options):
+        '''Register `func` under `name`
+
+        :param postprocess: a callable ``postprocess(result, args, kwargs)``
+                            whose return value replaces the result
+        :param cache: a :py:class:`jsonrpc.cache.ResultCache`, or True for one
+                      with the default settings, to reuse the results of
+                      earlier calls with the same parameters.  Only use it
+                      for methods without side effects, whose results are
+                      not modified afterwards: every hit returns the same
+                      object.
+        :param single_flight: a :py:class:`jsonrpc.cache.SingleFlight`, or
+                              True for a new one, to run identical calls
+                              which overlap only once and share their result
+                              or error.  Only use it for methods without side
+                              effects.
+        :param process: a :py:class:`jsonrpc.procpool.ProcessPool`, or True
+                        for the default one, to run a CPU-bound method in
+                        another process.  `func` must be a function defined
+                        at module level, its parameters and result are
+                        pickled.
+        '''
+        method = self.method_class(name, func, **options)
+        self._methods[name] = method
+        return method
+
+    def method(self, name=None, **options):
+        '''Decorator registering a function, by default under its own name,
+        see :py:meth:`register` for the options
+        '''
+        def decorator(func):
+            self.register(name or func.__name__, func, **options)
+            return func
+        return decorator
+
+    def add_object(self, obj, namespace=None, names=None, **options):
+        '''Register the public methods of `obj`, or only those in `names`,
+        optionally under ``namespace.<name>``
+        '''
+        if names is None:
+            names = [n for n in dir(obj) if not n.startswith('_')
+                     and callable(getattr(obj, n))]
+        for name in names:
+            fullname = name if namespace is None else '.'.join([namespace, name])
+            self.register(fullname, getattr(obj, name), **options)
+
+    def unregister(self, name):
+        del self._methods[name]
+
+    def invalidate(self, name, *args, **kwargs):
+        '''Drop the cached result of `name` for the given parameters, or all
+        its cached results, see :py:meth:`jsonrpc.cache.ResultCache.invalidate`
+        '''
+        method = self._methods[name]
+        if method.cache is None:
+            return
+        if (args or kwargs) and method.plan is not None:
+            # the keys are built from the bound arguments, see
+            # jsonrpc.server.ServerEvents._callshared
+            method.plan.check(args, kwargs)
+            args, kwargs = method.plan.bind(args, kwargs)
+        method.cache.invalidate(name, *args, **kwargs)
+
+    def start_pools(self):
+        '''Start the :py:class:`jsonrpc.procpool.ProcessPool` of every method
+        registered with `process`, call it before the server starts threads
+        so that the pools don't fork a multithreaded process'''
+        for method in self._methods.itervalues():
+            if method.process is not None:
+                method.process.start()
+
+    def cache_stats(self):
+        '''Return the statistics of the cache of every method which has one,
+        by method name'''
+        return dict((name, method.cache.stats())
+                    for name, method in self._methods.iteritems()
+                    if method.cache is not None)
+
+    def flight_stats(self):
+        '''Return the statistics of every method with single flight enabled,
+        by method name, ``coalesced`` counts the calls which did not run'''
+        return dict((name, method.single_flight.stats())
+                    for name, method in self._methods.iteritems()
+                    if method.single_flight is not None)
+
+    def get(self, name, default=None):
+        return self._methods.get(name, default)
+
+    def __getitem__(self, name):
+        return self._methods[name]
+
+    def __contains__(self, name):
+        return name in self._methods
+
+    def __iter__(self):
+        return iter(self._methods)
+
+    def __len__(self):
+        return len(self._methods)
@@ -34,10 +34,20 @@
 import jsonrpc.jsonutil
 from jsonrpc.utilities import public
 import jsonrpc.common
+from jsonrpc.registry import binding_plan
+from jsonrpc.cache import cache_key
+from jsonrpc.compression import choose_encoding, compress, compressor, \
+                                decompress
 
 from BaseHTTPServer import BaseHTTPRequestHandler
+from multiprocessing.pool import ThreadPool
 
 import copy
+import Queue
+import socket
+import threading
+import zlib
+from cStringIO import StringIO
 import UserDict, collections
 collections.Mapping.register(UserDict.DictMixin)
 
@@ -50,7 +60,8 @@ class ServerEvents(object):
 
     DEBUG = False
 
-    #: an object defining a 'get' method which contains the methods
+    #: an object defining a 'get' method which contains the methods, usually
+    #: a :py:class:`jsonrpc.registry.MethodRegistry`
     methods = None
 
     def __init__(self, server):
@@ -67,7 +78,7 @@ class ServerEvents(object):
 
         method = self.findmethod(rpcrequest.method, rpcrequest.args, extra)
         postprocess_result = False
-        if hasattr('method', '__iter__'):
+        if isinstance(method, tuple):
             method, postprocess_result = method
 
         if self.DEBUG:
@@ -78,7 +89,17 @@ class ServerEvents(object):
         if not callable(method):
             raise jsonrpc.common.MethodNotFound
 
-        result = method(*rpcrequest.args, **extra)
+        plan = binding_plan(method)
+        if plan is not None:
+            plan.check(rpcrequest.args, extra)
+
+        cache = getattr(method, 'cache', None)
+        flight = getattr(method, 'single_flight', None)
+        if cache is None and flight is None:
+            result = method(*rpcrequest.args, **extra)
+        else:
+            result = self._callshared(method, rpcrequest, extra, cache, flight,
+                                      plan)
 
         #if the result needs to be adjusted/validated, do it
         if postprocess_result:
@@ -87,6 +108,29 @@ class ServerEvents(object):
 
         return result
 
+    def _callshared(self, method, rpcrequest, extra, cache, flight, plan):
+        '''Call `method` through its result cache and its single flight
+        group, either may be None'''
+        args, kwargs = rpcrequest.args, extra
+        if plan is not None:
+            # positional, keyword and default arguments give the same key
+            args, kwargs = plan.bind(args, kwargs)
+        key = cache_key(rpcrequest.method, args, kwargs)
+        entry = None if cache is None else cache.get(key)
+        if entry is None:
+            def run():
+                result = method(*rpcrequest.args, **extra)
+                return result if cache is None else cache.put(key, result)
+            if flight is None:
+                entry = run()
+            else:
+                entry = flight.do(key, run)
+            if cache is None:
+                return entry
+        # lets the server reuse the encoded result
+        rpcrequest.cache_entry = entry
+        return entry.value
+
     def findmethod(self, method_name, args=None, kwargs=None):
         '''Return the callable associated with the method name
 
@@ -125,6 +169,9 @@ class ServerEvents(object):
         NOTE: if an error code is returned, the client error messages will be
               much less helpful!
 
+        Not called for batches streamed with
+        :py:attr:`JSON_RPC_Base.stream_responses`, which are sent with 200.
+
         for example
 
             def getresponsecode(self, result):
@@ -142,6 +189,38 @@ class ServerEvents(object):
         return 200
 
 
+_threadpools = {}
+_threadpools_lock = threading.Lock()
+
+def get_threadpool(size):
+    '''Return the process wide thread pool with `size` workers, it is created
+    on first use and shared by every server class asking for the same size.
+    '''
+    with _threadpools_lock:
+        pool = _threadpools.get(size)
+        if pool is None:
+            pool = _threadpools[size] = ThreadPool(size)
+        return pool
+
+
+class LimitedReader(object):
+    '''A file-like object which reads at most `length` bytes from `fileobj`'''
+
+    def __init__(self, fileobj, length):
+        self.fileobj = fileobj
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size) if size else ''
+        self.remaining -= len(data)
+        if size and not data:
+            # the connection was closed early
+            self.remaining = 0
+        return data
+
+
 ## Base class providing a JSON-RPC 2.0 implementation with 2 customizable hooks
 @public
 class JSON_RPC_Base:
@@ -154,6 +233,49 @@ class JSON_RPC_Base:
     #: :py:meth:`customize`.
     eventhandler = ServerEvents
 
+    #: Number of worker threads used to run the entries of a batch call
+    #: concurrently.  ``None`` or ``1`` runs them one after another in the
+    #: request thread.
+    batch_workers = None
+
+    #: Maximum number of entries of a single batch call which are allowed to
+    #: run at the same time, ``None`` means up to :py:attr:`batch_workers`.
+    batch_parallelism = None
+
+    #: The :py:class:`jsonrpc.jsonutil.Codec`, or its name, used for requests
+    #: and responses, ``None`` selects the default codec.
+    codec = None
+
+    #: Names of further codecs, like ``'cbor'``, which clients may select
+    #: instead of :py:attr:`codec`, see :py:meth:`select_codecs`
+    codecs = ('cbor',)
+
+    #: The content-type of the response, set for every request
+    content_type = 'application/json'
+
+    #: Compressed requests which decode to more bytes than this are answered
+    #: with a parse error, ``None`` for no limit
+    max_decoded_size = 64 * 1024 * 1024
+
+    #: Parse batch calls one entry at a time from :py:meth:`read_stream` and
+    #: dispatch each request as soon as it is parsed, instead of decoding
+    #: the whole body first.  :py:meth:`ServerEvents.processcontent` is then
+    #: called with a list holding a single entry.  When the body turns out
+    #: to be malformed after some entries ran, their responses are sent
+    #: followed by a parse error.  Only the requests are streamed: the
+    #: responses are collected into one array, unless they are sent one by
+    #: one with :py:attr:`stream_responses`.
+    stream_batches = False
+
+    #: Allow clients which accept ``application/x-ndjson`` to receive the
+    #: responses of a batch call one per line, each sent as soon as its call
+    #: completes, see :py:meth:`accepts_stream`.  The responses then arrive
+    #: in the order the calls complete, not in the order of the requests.
+    #: A streamed response always has the status 200, since it is sent
+    #: before the calls run: :py:meth:`ServerEvents.getresponsecode` is not
+    #: called for it.
+    stream_responses = False
+
     @classmethod
     def customize(cls, eventhandler):
         '''customize the behavior of the server'''
@@ -164,79 +286,269 @@ class JSON_RPC_Base:
     def handle_request(self, *args, **kwargs):
         self.request_started(*args, **kwargs)
         self.request = self.get_request_string()
+        codec, outcodec = self.select_codecs()
+        self.content_type = outcodec.content_type
         result = []
         errors = False
         contents = None
+        stream = seen = None
+        streaming = False
         try:
             try:
-                contents = jsonrpc.jsonutil.decode(self.read_data())
+                if self.stream_batches and not codec.binary:
+                    stream = self.read_stream()
+                    contents = jsonrpc.jsonutil.iterdecode(stream, codec=codec)
+                else:
+                    contents = codec.decode(self.read_data())
             except ValueError:
                 raise jsonrpc.common.ParseError
 
-            islist = (True if isinstance(contents, list) else False)
-            if not islist:
-                contents = [contents]
+            if isinstance(contents, jsonrpc.jsonutil.ArrayStream):
+                islist = True
+                seen = []
+                contents = self.stream_requests(contents, seen)
+            else:
+                islist = (True if isinstance(contents, list) else False)
+                if not islist:
+                    contents = [contents]
+
+                if contents == []:
+                    raise jsonrpc.common.InvalidRequest
+
+                contents = self.eventhandler.processcontent(contents)
+                contents = jsonrpc.common.Request.from_json(contents)
+                for n, item in enumerate(contents):
+                    try:
+                        item.check()
+                    except BaseException, exc:
+                        # Save error and process other items when doing a batchcall
+                        if islist:
+                            contents[n] = self.render_error(exc, item.id)
+                            continue
+                        # Let the top handler catch this on a single call
+                        raise
+
+            if (islist and self.stream_responses and not outcodec.binary and
+                    self.accepts_stream()):
+                # the batch is run while its responses are written
+                streaming = True
+            else:
+                for res, failed in self.dispatch(contents):
+                    errors = errors or failed
+                    if res is not None:
+                        result.append(res)
+
+                if seen == []:
+                    raise jsonrpc.common.InvalidRequest
+
+                if result != []:
+                    if not islist:
+                        result = result[0]
+                else:
+                    result = None
+        except (BaseException, jsonrpc.common.RPCError), exc:
+            errid = None
+            if isinstance(contents, list) and contents != []:
+                errid = getattr(contents[0], 'id', None)
+
+            result = self.render_error(exc, errid)
+            errors = True
+
+        if streaming:
+            self.write_responses(outcodec, contents, seen)
+
+        if stream is not None:
+            # leave the connection at the start of the next request
+            while stream.read(65536):
+                pass
 
-            if contents == []:
-                raise jsonrpc.common.InvalidRequest
+        if not streaming:
+            self.eventhandler.log(result, self.request, error=errors)
+            code = self.eventhandler.getresponsecode(result)
+            self.write_data(code, self.encode_response(outcodec, result))
 
-            contents = self.eventhandler.processcontent(contents)
-            contents = jsonrpc.common.Request.from_json(contents)
-            for item in contents:
+        self.request_finished()
+
+    def select_codecs(self):
+        '''Return the pair of codecs (request, response) for the request.
+
+        A request whose content-type is the one of a codec in :py:attr:`codecs`
+        is decoded and answered with that codec, any other request is decoded
+        with :py:attr:`codec`.  Its response uses the first of :py:attr:`codecs`
+        named in the Accept header, or :py:attr:`codec` as well.
+        '''
+        default = jsonrpc.jsonutil.get_codec(self.codec)
+        offered = [jsonrpc.jsonutil.get_codec(name) for name in self.codecs]
+        content_type = self.get_header('content-type') or ''
+        content_type = content_type.split(';', 1)[0].strip().lower()
+        for codec in offered:
+            if codec.content_type == content_type:
+                return codec, codec
+        # media types are negotiated like content-encodings
+        accepted = choose_encoding(self.get_header('accept'),
+                                   [codec.content_type for codec in offered])
+        for codec in offered:
+            if codec.content_type == accepted:
+                return default, codec
+        return default, default
+
+    def write_responses(self, codec, contents, seen=None):
+        '''Run the requests of a batch call and send each response on a line
+        of its own as soon as it is available.  Errors raised while the batch
+        is read are sent as a last response with a null id.  The responses
+        are logged together once the batch is complete.
+        '''
+        def responses():
+            try:
+                for item in self.dispatch_unordered(contents):
+                    yield item
+                if seen == []:
+                    raise jsonrpc.common.InvalidRequest
+            except (BaseException, jsonrpc.common.RPCError), exc:
+                yield self.render_error(exc, None), True
+
+        self.write_stream_start(200)
+        sent = []
+        errors = False
+        for res, failed in responses():
+            if res is not None:
+                sent.append(res)
+                errors = errors or failed
+                self.write_stream(self.encode_response(codec, res) + '\n')
+        self.write_stream_end()
+        self.eventhandler.log(sent or None, self.request, error=errors)
+
+    def stream_requests(self, elements, seen):
+        '''Turn the elements of a streamed batch into requests as they are
+        parsed, invalid ones into error responses.  `seen` gets an entry
+        for every element.  Malformed data ends the batch with a parse
+        error, which is raised if no request was parsed yet.
+        '''
+        while True:
+            try:
+                element = next(elements)
+            except StopIteration:
+                return
+            except ValueError:
+                if not seen:
+                    raise jsonrpc.common.ParseError
+                # the requests already parsed may have run
+                yield self.render_error(jsonrpc.common.ParseError(), None)
+                return
+            seen.append(True)
+            for content in self.eventhandler.processcontent([element]):
+                item = None
                 try:
+                    if not isinstance(content, dict):
+                        raise jsonrpc.common.InvalidRequest
+                    item = jsonrpc.common.Request.from_dict(content)
                     item.check()
                 except BaseException, exc:
-                    # Save error and process other items when doing a batchcall
-                    if islist:
-                        exc = self.render_error(exc, item.id)
-                        result.append(exc)
-                        errors = True
-                        continue
-                    # Let the top handler catch this on a single call
-                    raise
-
-            def callmethod(rpcrequest, add, **kwargs):
-                add.update(kwargs)
-                result = self.eventhandler.callmethod(rpcrequest, **add)
-                return result
+                    item = self.render_error(exc, getattr(item, 'id', None))
+                yield item
 
-            for rpcrequest in contents:
-                try:
-                    add = copy.deepcopy(rpcrequest.extra)
-                    methodresult = callmethod(rpcrequest, add)
-                    res = jsonrpc.common.Response(id=rpcrequest.id,
-                                                  result=methodresult)
-                    res = self.eventhandler.processrequest(res)
-                    if res.id is not None:
-                        result.append(res)
-                except BaseException, exc:
-                    err = self.render_error(exc, rpcrequest.id)
-                    result.append(err)
-                    errors = True
-                    continue
+    def dispatch(self, contents):
+        '''Call the method of every request in `contents`
 
-            if result != []:
-                if not islist:
-                    result = result[0]
-            else:
-                result = None
-        except (BaseException, jsonrpc.common.RPCError), exc:
-            if contents is None or contents == []:
-                errid = None
-            elif hasattr(contents, 'id'):
-                errid = contents.id
-            elif hasattr(contents[0], 'id'):
-                errid = contents[0].id
+        :returns: a list of pairs (response, failed) in the order of the
+                  requests, response is None for notifications
+        '''
+        workers = self.batch_workers or 1
+        if workers <= 1 or (isinstance(contents, list) and len(contents) < 2):
+            return [self.callrequest(rpcrequest) for rpcrequest in contents]
 
-            result = self.render_error(exc, errid)
-            errors = True
+        pool = get_threadpool(workers)
+        limit = threading.BoundedSemaphore(self.batch_parallelism or workers)
 
-        self.eventhandler.log(result, self.request, error=errors)
-        code = self.eventhandler.getresponsecode(result)
-        resp = jsonrpc.jsonutil.encode(result).encode('utf-8')
-        self.write_data(code, resp)
+        def call(rpcrequest):
+            try:
+                return self.callrequest(rpcrequest)
+            finally:
+                limit.release()
+
+        pending = []
+        for rpcrequest in contents:
+            limit.acquire()
+            pending.append(pool.apply_async(call, (rpcrequest,)))
+        return [item.get() for item in pending]
+
+    def dispatch_unordered(self, contents):
+        '''Like :py:meth:`dispatch`, but yield each pair (response, failed)
+        as soon as its call completes
+        '''
+        workers = self.batch_workers or 1
+        if workers <= 1:
+            for rpcrequest in contents:
+                yield self.callrequest(rpcrequest)
+            return
 
-        self.request_finished()
+        pool = get_threadpool(workers)
+        limit = threading.BoundedSemaphore(self.batch_parallelism or workers)
+        done = Queue.Queue()
+
+        def call(rpcrequest):
+            try:
+                res = self.callrequest(rpcrequest)
+            finally:
+                limit.release()
+            done.put(res)
+
+        pending = 0
+        for rpcrequest in contents:
+            # hand out finished responses while waiting for a free slot
+            while not limit.acquire(False):
+                pending -= 1
+                yield done.get()
+            pool.apply_async(call, (rpcrequest,))
+            pending += 1
+        while pending:
+            pending -= 1
+            yield done.get()
+
+    def callrequest(self, rpcrequest):
+        '''Call the method for a single request, errors are rendered into the
+        response instead of being raised.
+
+        :returns: a pair (response, failed)
+        '''
+        if isinstance(rpcrequest, jsonrpc.common.Response):
+            # an invalid request which has been rendered as error already
+            return rpcrequest, True
+        try:
+            add = copy.deepcopy(rpcrequest.extra)
+            methodresult = self.eventhandler.callmethod(rpcrequest, **add)
+            res = jsonrpc.common.Response(id=rpcrequest.id,
+                                          result=methodresult)
+            res = self.eventhandler.processrequest(res)
+            if res.id is None:
+                res = None
+            else:
+                entry = getattr(rpcrequest, 'cache_entry', None)
+                if entry is not None and res.result is entry.value:
+                    res.cache_entry = entry
+            return res, False
+        except BaseException, exc:
+            return self.render_error(exc, rpcrequest.id), True
+
+    def encode_response(self, codec, result):
+        '''Encode a response, or a list of responses, with `codec`.  Cached
+        results are encoded once per codec, when it is a text codec.
+        '''
+        if codec.binary:
+            return codec.to_bytes(result)
+        if isinstance(result, list):
+            if not any(hasattr(res, 'cache_entry') for res in result):
+                return codec.to_bytes(result)
+            return '[{0}]'.format(', '.join(self.encode_response(codec, res)
+                                            for res in result))
+        entry = getattr(result, 'cache_entry', None)
+        if entry is None or result.error is not None:
+            return codec.to_bytes(result)
+        data = entry.encoded.get(codec.name)
+        if data is None:
+            data = entry.encoded[codec.name] = codec.to_bytes(entry.value)
+        return '{{"jsonrpc": {0}, "result": {1}, "id": {2}}}'.format(
+            codec.to_bytes(result.version), data, codec.to_bytes(result.id))
 
     def render_error(self, e, id):
         err = (e if isinstance(e, jsonrpc.common.RPCError) else
@@ -264,6 +576,16 @@ class JSON_RPC_Base:
         """ Read the incoming data """
         raise NotImplementedError
 
+    def get_header(self, name):
+        """ Return the value of the request header `name`, or None """
+        return None
+
+    def read_stream(self):
+        """ Return a file-like object to read the incoming data from, used
+            when :py:attr:`stream_batches` is set
+        """
+        return StringIO(self.read_data())
+
     def write_data(self, code, result):
         """ Send back a response. This should include the following steps:
                 - Send the repsonse code
@@ -272,26 +594,201 @@ class JSON_RPC_Base:
         """
         raise NotImplementedError
 
+    # The following methods must be overridden to support stream_responses
+    def accepts_stream(self):
+        """ Return True when the client asked for a streamed response """
+        return False
+
+    def write_stream_start(self, code):
+        """ Send the response code and the headers of a streamed response,
+            with content-type application/x-ndjson
+        """
+        raise NotImplementedError
+
+    def write_stream(self, data):
+        """ Send a part of a streamed response right away """
+        raise NotImplementedError
+
+    def write_stream_end(self):
+        """ Finish a streamed response """
+        raise NotImplementedError
+
 
 class JSON_RPC(JSON_RPC_Base, BaseHTTPRequestHandler):
-    """ A ready to use JSON_RPC server using default Python libraries. """
+    """ A ready to use JSON_RPC server using default Python libraries.
+
+    Set :py:attr:`keepalive` to serve many requests, pipelined or not, on one
+    HTTP/1.1 connection. """
+
+    #: Keep the connection open for further requests
+    keepalive = False
+
+    #: Seconds a keep-alive connection may wait for its next request
+    idle_timeout = 30
+
+    #: Number of requests served on a keep-alive connection before the
+    #: server closes it
+    max_requests = 1000
+
+    #: Content-encodings used for the responses to clients which accept
+    #: them, in order of preference, empty to never compress
+    compress_encodings = ('gzip', 'deflate')
+
+    #: Responses smaller than this number of bytes are sent uncompressed
+    compress_min_size = 1024
 
-    do_POST = JSON_RPC_Base.handle_request
+    #: zlib compression level, from 1 (fastest) to 9 (smallest)
+    compress_level = 6
+
+    # Buffer the response so that it is sent with a single write
+    wbufsize = -1
+
+    def do_POST(self):
+        # servers which drain their requests before stopping count them,
+        # see jsonrpc.prefork.WorkerHTTPServer
+        began = getattr(self.server, 'request_began', None)
+        if began is None:
+            return self.handle_request()
+        began(self.connection)
+        try:
+            self.handle_request()
+        finally:
+            self.server.request_ended(self.connection)
+
+    def setup(self):
+        if self.keepalive:
+            self.protocol_version = 'HTTP/1.1'
+            self.timeout = self.idle_timeout
+            # unix sockets have no Nagle algorithm to disable
+            self.disable_nagle_algorithm = (
+                getattr(socket, 'AF_UNIX', None) != self.request.family)
+        self.requests_served = 0
+        BaseHTTPRequestHandler.setup(self)
 
     def log_request(self, code, size=None):
         '''Overriden method from BaseHTTPRequestHandler to reduce logmessages'''
 
+    def address_string(self):
+        if not isinstance(self.client_address, tuple):
+            # the client of a unix socket
+            return self.client_address or 'unix'
+        return BaseHTTPRequestHandler.address_string(self)
+
+    def log_error(self, format, *args):
+        # an idle keep-alive connection which expires is not an error
+        if not (self.requests_served and format.startswith('Request timed out')):
+            BaseHTTPRequestHandler.log_error(self, format, *args)
+
     def get_request_string(self):
         return "<{0} {1} {2}>".format(self.command, self.path, self.request_version)
 
+    def get_header(self, name):
+        return self.headers.getheader(name)
+
     def read_data(self):
-        length = int(self.headers.getheader('content-length'))
-        return self.rfile.read(length)
+        encoding = self.headers.getheader('transfer-encoding') or ''
+        if encoding.lower() == 'chunked':
+            data = self.read_chunked()
+        else:
+            length = int(self.headers.getheader('content-length') or 0)
+            data = self.rfile.read(length)
+        return decompress(data, self.headers.getheader('content-encoding') or '',
+                          self.max_decoded_size)
+
+    def read_stream(self):
+        encoding = self.headers.getheader('transfer-encoding') or ''
+        if self.headers.getheader('content-encoding'):
+            return StringIO(self.read_data())
+        if encoding.lower() == 'chunked':
+            return StringIO(self.read_chunked())
+        length = int(self.headers.getheader('content-length') or 0)
+        return LimitedReader(self.rfile, length)
+
+    def read_chunked(self):
+        """ Read a body sent with chunked transfer-encoding """
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(';', 1)[0], 16)
+            if size == 0:
+                break
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+        # skip the trailer
+        while self.rfile.readline() not in ('\r\n', '\n', ''):
+            pass
+        return ''.join(chunks)
+
+    def send_connection_header(self):
+        if self.keepalive and not self.close_connection:
+            if (self.requests_served >= self.max_requests or
+                    getattr(self.server, 'draining', False)):
+                self.send_header("connection", 'close')
+            elif self.request_version == 'HTTP/1.0':
+                self.send_header("connection", 'keep-alive')
+
+    def response_encoding(self):
+        """ Return the content-encoding to use for the response, if any """
+        return choose_encoding(self.headers.getheader('accept-encoding'),
+                               self.compress_encodings)
 
     def write_data(self, code, result):
+        self.requests_served += 1
+        encoding = None
+        if len(result) >= self.compress_min_size:
+            encoding = self.response_encoding()
+        if encoding:
+            result = compress(result, encoding, self.compress_level)
         self.send_response(code)
-        self.send_header("content-type", 'application/json')
+        self.send_header("content-type", self.content_type)
         self.send_header("content-length", len(result))
+        if encoding:
+            self.send_header("content-encoding", encoding)
+        self.send_header("vary", 'Accept, Accept-Encoding')
+        self.send_connection_header()
         self.end_headers()
         self.wfile.write(result)
 
+    def accepts_stream(self):
+        accept = self.headers.getheader('accept') or ''
+        return 'application/x-ndjson' in accept.lower()
+
+    def write_stream_start(self, code):
+        self.requests_served += 1
+        # chunks need HTTP/1.1 on both sides, otherwise closing the
+        # connection ends the response
+        self.chunked = (self.protocol_version != 'HTTP/1.0' and
+                        self.request_version != 'HTTP/1.0')
+        encoding = self.response_encoding()
+        self.compressor = None
+        self.send_response(code)
+        self.send_header("content-type", 'application/x-ndjson')
+        if encoding:
+            # every line is flushed, the size of the whole is unknown
+            self.compressor = compressor(encoding, self.compress_level)
+            self.send_header("content-encoding", encoding)
+        if self.chunked:
+            self.send_header("transfer-encoding", 'chunked')
+            self.send_connection_header()
+        else:
+            self.send_header("connection", 'close')
+            self.close_connection = 1
+        self.end_headers()
+        self.wfile.flush()
+
+    def write_stream(self, data):
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.send_chunk(data)
+        self.wfile.flush()
+
+    def write_stream_end(self):
+        if self.compressor is not None:
+            self.send_chunk(self.compressor.flush())
+        if self.chunked:
+            self.wfile.write('0\r\n\r\n')
+
+    def send_chunk(self, data):
+        if self.chunked:
+            data = '{0:x}\r\n{1}\r\n'.format(len(data), data)
+        self.wfile.write(data)
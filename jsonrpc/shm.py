@@ -0,0 +1,461 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+"""
+A JSON-RPC transport through shared memory, for a client and a server
+running on the same host which call each other at very high rates.
+
+The server creates a segment, a file which both processes map into memory,
+holding two ring buffers: one carries the encoded requests of the client,
+the other the responses.  Frames are copied in and out of the rings without
+a system call.  A process waiting for a frame spins for a little while,
+then parks on a named pipe, the doorbell, which the other process only
+rings when it sees the waiter parked.
+
+    handler = ShmJSON_RPC.customize(MyServerEvents)
+    server = ShmJSONRPCServer('/dev/shm/myservice', handler)
+    server.serve_forever()
+
+    proxy = ShmJSONRPCProxy.from_url('shm:///dev/shm/myservice')
+    proxy.add(1, 2)
+
+A segment connects one client process with the server, which handles its
+requests one at a time, in order.  The threads of the client take turns.
+Put the segment on a memory backed file system such as ``/dev/shm``.
+"""
+
+import errno
+import mimetools
+import mmap
+import multiprocessing
+import os
+import select
+import struct
+import threading
+import time
+import urllib
+import urlparse
+from cStringIO import StringIO
+
+import jsonrpc.jsonutil
+from jsonrpc.proxy import JSONRPCProxy
+from jsonrpc.server import JSON_RPC_Base
+from jsonrpc.utilities import public, TimeoutError
+
+
+_MAGIC = 'JSONRPC\x01'
+_HEADER = struct.Struct('<8sQ')
+_COUNTER = struct.Struct('<Q')
+_LENGTH = struct.Struct('<I')
+# the counters of a ring get a cache line of their own
+_CONTROL_SIZE = 64
+_HEAD, _TAIL, _WAITING = 0, 8, 16
+
+
+def _cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _doorbell(path):
+    '''Open the named pipe `path`, without blocking on the other end'''
+    return os.open(path, os.O_RDWR | os.O_NONBLOCK)
+
+
+@public
+class RingBuffer(object):
+    '''A single producer, single consumer queue of frames in the memory map
+    `mm`, which may be shared with another process.
+
+    The producer only moves the head and the consumer only moves the tail,
+    both counters grow without wrapping around.
+
+    :param mm: the :py:class:`mmap.mmap` holding the ring
+    :param int offset: where the ring starts in `mm`
+    :param int capacity: the number of bytes of frames the ring holds
+    :param int doorbell: the file descriptor of the named pipe used to wake
+                         up the consumer
+    '''
+
+    #: Number of times the consumer looks for a frame before it parks,
+    #: spinning only pays off when the producer runs on another CPU
+    spin = 200 if _cpu_count() > 1 else 0
+
+    #: Longest time in seconds the consumer parks before it looks again,
+    #: in case a wake up was missed
+    park_interval = 0.05
+
+    def __init__(self, mm, offset, capacity, doorbell):
+        self._mm = mm
+        self._control = offset
+        self._data = offset + _CONTROL_SIZE
+        self.capacity = capacity
+        self._doorbell = doorbell
+
+    @classmethod
+    def size(cls, capacity):
+        '''The number of bytes taken by a ring of `capacity` bytes'''
+        return _CONTROL_SIZE + capacity
+
+    def _load(self, field):
+        return _COUNTER.unpack_from(self._mm, self._control + field)[0]
+
+    def _store(self, field, value):
+        _COUNTER.pack_into(self._mm, self._control + field, value)
+
+    def _copy_in(self, position, data):
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        self._mm[self._data + start:self._data + start + first] = data[:first]
+        if first < len(data):
+            self._mm[self._data:self._data + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, length):
+        start = position % self.capacity
+        first = min(length, self.capacity - start)
+        data = self._mm[self._data + start:self._data + start + first]
+        if first < length:
+            data += self._mm[self._data:self._data + length - first]
+        return data
+
+    def put(self, data):
+        '''Append the frame `data`, wait while the ring is too full
+
+        :raises: :py:class:`ValueError` if the frame can never fit
+        '''
+        size = _LENGTH.size + len(data)
+        if size > self.capacity:
+            raise ValueError('a frame of {0} bytes does not fit in the ring'
+                             .format(len(data)))
+        head = self._load(_HEAD)
+        delay = 0
+        while self.capacity - (head - self._load(_TAIL)) < size:
+            # the consumer is behind, it never waits for the producer
+            time.sleep(delay)
+            delay = min(delay * 2 or 0.0001, 0.01)
+        self._copy_in(head, _LENGTH.pack(len(data)) + data)
+        self._store(_HEAD, head + size)
+        if self._load(_WAITING):
+            try:
+                os.write(self._doorbell, 'x')
+            except OSError, exc:
+                # a full pipe rings already
+                if exc.errno != errno.EAGAIN:
+                    raise
+
+    def get(self, timeout=None):
+        '''Remove the oldest frame and return it, wait for one if the ring is
+        empty
+
+        :raises: :py:class:`jsonrpc.utilities.TimeoutError` when no frame
+                 arrived within `timeout` seconds
+        '''
+        tail = self._load(_TAIL)
+        if not self._wait(tail, timeout):
+            raise TimeoutError
+        length = _LENGTH.unpack(self._copy_out(tail, _LENGTH.size))[0]
+        data = self._copy_out(tail + _LENGTH.size, length)
+        self._store(_TAIL, tail + _LENGTH.size + length)
+        return data
+
+    def clear(self):
+        '''Drop every frame in the ring, only the consumer may call it'''
+        self._store(_TAIL, self._load(_HEAD))
+
+    def _wait(self, tail, timeout):
+        '''Wait until the head has moved past `tail`, return False when
+        `timeout` expires first'''
+        for _ in xrange(self.spin):
+            if self._load(_HEAD) != tail:
+                return True
+        deadline = None if timeout is None else time.time() + timeout
+        self._store(_WAITING, 1)
+        try:
+            while self._load(_HEAD) == tail:
+                interval = self.park_interval
+                if deadline is not None:
+                    interval = min(interval, deadline - time.time())
+                    if interval <= 0:
+                        return False
+                if select.select([self._doorbell], [], [], interval)[0]:
+                    try:
+                        os.read(self._doorbell, 4096)
+                    except OSError, exc:
+                        if exc.errno != errno.EAGAIN:
+                            raise
+            return True
+        finally:
+            self._store(_WAITING, 0)
+
+
+@public
+class SharedChannel(object):
+    '''The segment shared by a client and a server: its memory map and the
+    rings carrying the `requests` and the `responses`.
+
+    Use :py:meth:`create` in the server and :py:meth:`attach` in the client.
+    '''
+
+    def __init__(self, path, fileno, capacity):
+        self.path = path
+        size = _HEADER.size + 2 * RingBuffer.size(capacity)
+        self._mm = mmap.mmap(fileno, size)
+        self._bells = [_doorbell(path + '.requests'),
+                       _doorbell(path + '.responses')]
+        offset = _HEADER.size
+        #: the :py:class:`RingBuffer` of the requests, read by the server
+        self.requests = RingBuffer(self._mm, offset, capacity, self._bells[0])
+        offset += RingBuffer.size(capacity)
+        #: the :py:class:`RingBuffer` of the responses, read by the client
+        self.responses = RingBuffer(self._mm, offset, capacity, self._bells[1])
+
+    @classmethod
+    def create(cls, path, capacity=1 << 20):
+        '''Create the segment `path`, whose rings hold `capacity` bytes each,
+        and its doorbells.  An existing segment is replaced.
+        '''
+        for name in (path + '.requests', path + '.responses'):
+            if os.path.exists(name):
+                os.unlink(name)
+            os.mkfifo(name, 0600)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0600)
+        try:
+            os.ftruncate(fd, _HEADER.size + 2 * RingBuffer.size(capacity))
+            channel = cls(path, fd, capacity)
+        finally:
+            os.close(fd)
+        # written last, a client attaching earlier sees no valid segment
+        _HEADER.pack_into(channel._mm, 0, _MAGIC, capacity)
+        return channel
+
+    @classmethod
+    def attach(cls, path):
+        '''Open the segment `path` created by a server
+
+        :raises: :py:class:`IOError` if it is not a valid segment
+        '''
+        fd = os.open(path, os.O_RDWR)
+        try:
+            header = os.read(fd, _HEADER.size)
+            if len(header) < _HEADER.size:
+                raise IOError('not a JSON-RPC segment: {0}'.format(path))
+            magic, capacity = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                raise IOError('not a JSON-RPC segment: {0}'.format(path))
+            channel = cls(path, fd, capacity)
+        finally:
+            os.close(fd)
+        # responses left behind by an earlier client are not ours
+        channel.responses.clear()
+        return channel
+
+    def close(self):
+        self._mm.close()
+        for fd in self._bells:
+            os.close(fd)
+
+    def unlink(self):
+        '''Remove the files of the segment'''
+        for name in (self.path, self.path + '.requests', self.path + '.responses'):
+            try:
+                os.unlink(name)
+            except OSError:
+                pass
+
+
+@public
+class ShmJSON_RPC(JSON_RPC_Base):
+    '''A JSON_RPC_Base which processes one request frame read by a
+    :py:class:`ShmJSONRPCServer`, one instance is created per frame.
+    '''
+
+    #: Frames are always encoded with :py:attr:`codec`, there are no
+    #: headers to negotiate another one with
+    codecs = ()
+
+    def __init__(self, server, data):
+        self.server = server
+        self.data = data
+
+    def get_request_string(self):
+        return '<SHM {0}>'.format(self.server.channel.path)
+
+    def read_data(self):
+        return self.data
+
+    def write_data(self, code, result):
+        try:
+            self.server.channel.responses.put(result)
+        except ValueError, exc:
+            # the client waits for a response all the same
+            codec = jsonrpc.jsonutil.get_codec(self.codec)
+            self.server.channel.responses.put(
+                codec.to_bytes(self.render_error(exc, None)))
+
+
+@public
+class ShmJSONRPCServer(object):
+    '''Serve a :py:class:`ShmJSON_RPC` handler to the client of the segment
+    `path`, the requests are handled one at a time by the thread running
+    :py:meth:`serve_forever`.
+
+    :param str path: the file of the segment, it is created
+    :param handler_class: a customized subclass of :py:class:`ShmJSON_RPC`
+    :param int capacity: the size of each ring in bytes, it limits the size
+                         of requests and responses
+    '''
+
+    def __init__(self, path, handler_class, capacity=1 << 20):
+        self.handler_class = handler_class
+        self.channel = SharedChannel.create(path, capacity)
+        self._shutdown_request = False
+        self._stopped = threading.Event()
+        self._stopped.set()
+
+    def serve_forever(self, poll_interval=0.5):
+        self._stopped.clear()
+        try:
+            while not self._shutdown_request:
+                try:
+                    data = self.channel.requests.get(poll_interval)
+                except TimeoutError:
+                    continue
+                self.handler_class(self, data).handle_request()
+        finally:
+            self._shutdown_request = False
+            self._stopped.set()
+
+    def shutdown(self):
+        '''Stop :py:meth:`serve_forever` and wait until it has returned,
+        must be called from another thread.  A call to
+        :py:meth:`serve_forever` which has not started yet returns at once.
+        '''
+        self._shutdown_request = True
+        self._stopped.wait()
+
+    def server_close(self):
+        self.channel.close()
+        self.channel.unlink()
+
+
+@public
+class ShmClient(object):
+    '''Posts requests through the segment `path`, it is shared by every proxy
+    created from the same root proxy.  One request is in flight at a time.
+
+    :param str path: the file of the segment created by the server
+    :param float timeout: seconds to wait for a response, ``None`` waits
+                          forever
+    '''
+
+    _headers = mimetools.Message(StringIO('Content-Type: application/json\r\n'))
+
+    def __init__(self, path, timeout=None):
+        self.channel = SharedChannel.attach(path)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._codec = jsonrpc.jsonutil.get_codec()
+
+    def _ids(self, data):
+        '''Return the ids of the requests, or of the responses, in `data`,
+        there are none in the ``null`` answering only notifications'''
+        if not data:
+            return frozenset()
+        content = self._codec.decode(data)
+        if not isinstance(content, list):
+            content = [content]
+        return frozenset(item.get('id') for item in content
+                         if isinstance(item, dict) and item.get('id') is not None)
+
+    def open(self, url, data, headers=None):
+        '''Send the request `data` and wait for its response.  Responses
+        to other requests, like those which timed out, are skipped.
+
+        :returns: a file-like object, like :py:meth:`urllib2.urlopen`
+        :raises: :py:class:`jsonrpc.utilities.TimeoutError`
+        '''
+        expected = self._ids(data)
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        with self._lock:
+            self.channel.requests.put(data)
+            while True:
+                timeout = None
+                if deadline is not None:
+                    timeout = max(deadline - time.time(), 0)
+                body = self.channel.responses.get(timeout)
+                ids = self._ids(body)
+                # errors about requests which could not be read have no id
+                if ids == expected or (body and not ids):
+                    break
+        return urllib.addinfourl(StringIO(body), self._headers, url, 200)
+
+    def close(self):
+        self.channel.close()
+
+
+@public
+class ShmJSONRPCProxy(JSONRPCProxy):
+    '''A :py:class:`jsonrpc.proxy.JSONRPCProxy` talking to a
+    :py:class:`ShmJSONRPCServer` at a ``shm:///path/to/segment`` url.
+
+    The same :py:class:`jsonrpc.proxy.ProxyEvents` hooks are applied.  Use
+    ``proxy.close()`` on the root proxy to unmap the segment.  Messages are
+    always encoded with the default codec, a binary codec is not used.
+
+    :param float timeout: seconds to wait for a response before
+                          :py:class:`jsonrpc.utilities.TimeoutError` is
+                          raised, by default there is no limit
+    '''
+
+    @classmethod
+    def from_url(cls, url, ctxid=None, serviceName=None, **kwargs):
+        return cls(url, '', serviceName, ctxid, **kwargs)
+
+    def __init__(self, host, path='', serviceName=None, *args, **kwargs):
+        self._timeout = kwargs.get('timeout')
+        JSONRPCProxy.__init__(self, host, path, serviceName, *args, **kwargs)
+        # there are no headers to negotiate another codec with
+        self._codec = self._json_codec
+
+    def _build_opener(self):
+        urlsp = urlparse.urlsplit(self.serviceURL)
+        if urlsp.scheme != 'shm':
+            raise ValueError('expected a shm:///path url: {0!r}'.format(
+                             self.serviceURL))
+        return ShmClient(urlsp.netloc + urlsp.path, self._timeout)
+
+    def close(self):
+        JSONRPCProxy.close(self)
+        self._opener.close()
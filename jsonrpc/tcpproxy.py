@@ -0,0 +1,271 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+"""
+A JSON-RPC proxy for :py:class:`jsonrpc.tcpserver.TCPJSONRPCServer`.
+
+The calls of every thread share one long-lived connection: each request is
+written as a line as soon as it is made and the responses are matched to
+their requests by id when they arrive, in whatever order the server
+completes them.
+
+    proxy = TCPJSONRPCProxy.from_url('tcp://localhost:8008')
+    proxy.add(1, 2)
+"""
+
+import collections
+import Queue
+import socket
+import threading
+import urlparse
+
+import jsonrpc.jsonutil
+from jsonrpc.common import Response
+from jsonrpc.proxy import JSONRPCProxy, _calls
+from jsonrpc.utilities import public, Future, TimeoutError
+
+
+@public
+class TCPClient(object):
+    '''Sends JSON-RPC messages over a single connection to `address`, it is
+    shared by every proxy created from the same root proxy.
+
+    The connection is opened on the first request, and opened again by the
+    next request after it has been lost.  A thread reads the responses.
+
+    :param address: the (host, port) of the server
+    :param codec: the :py:class:`jsonrpc.jsonutil.Codec` of the messages,
+                  it must not be a binary codec
+    :param float timeout: seconds to wait for a response, ``None`` waits
+                          forever
+    '''
+
+    #: Seconds to wait for the connection to be established
+    connect_timeout = 10
+
+    def __init__(self, address, codec=None, timeout=None):
+        self.address = address
+        self.codec = jsonrpc.jsonutil.get_codec(codec)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._sock = None
+        # futures of the requests in flight by id, oldest first
+        self._pending = collections.OrderedDict()
+
+    def send(self, obj):
+        '''Send the request, or list of requests, `obj`, can be called from
+        any thread.
+
+        :returns: a :py:class:`jsonrpc.utilities.Future` of the decoded
+                  response, of None if `obj` only holds notifications
+        '''
+        requests = obj if isinstance(obj, list) else [obj]
+        ids = [request.id for request in requests if request.id is not None]
+        data = self.codec.to_bytes(obj) + '\n'
+        future = Future()
+        with self._lock:
+            sock = self._connect()
+            if ids:
+                if ids[0] in self._pending:
+                    raise ValueError('a request with id {0!r} is in flight '
+                                     'already'.format(ids[0]))
+                self._pending[ids[0]] = future
+        if not ids:
+            future.set_result(None)
+        try:
+            with self._write_lock:
+                sock.sendall(data)
+        except socket.error, exc:
+            self._disconnect(sock, exc)
+        return future
+
+    def forget(self, future):
+        '''Stop waiting for the response of `future`, e.g. after a timeout'''
+        with self._lock:
+            for id, pending in self._pending.items():
+                if pending is future:
+                    del self._pending[id]
+
+    def close(self):
+        '''Close the connection, the requests in flight fail'''
+        with self._lock:
+            sock = self._sock
+        if sock is not None:
+            self._disconnect(sock, IOError('client closed'))
+
+    def _connect(self):
+        '''Return the connection, open it if needed, holding the lock'''
+        if self._sock is None:
+            sock = socket.create_connection(self.address, self.connect_timeout)
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            reader = threading.Thread(target=self._read, args=(sock,),
+                                      name='jsonrpc-tcp-reader')
+            reader.daemon = True
+            reader.start()
+            self._sock = sock
+        return self._sock
+
+    def _disconnect(self, sock, exc):
+        '''Close `sock` and fail the requests sent over it with `exc`'''
+        with self._lock:
+            if self._sock is not sock:
+                return
+            self._sock = None
+            pending, self._pending = self._pending, collections.OrderedDict()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        sock.close()
+        for future in pending.values():
+            future.set_exception(exc)
+
+    def _read(self, sock):
+        '''Called by the reader thread of `sock`'''
+        rfile = sock.makefile('rb', -1)
+        try:
+            for line in iter(rfile.readline, ''):
+                if line.strip():
+                    self._received(sock, line)
+            exc = IOError('connection closed')
+        except socket.error, exc:
+            pass
+        finally:
+            rfile.close()
+        self._disconnect(sock, exc)
+
+    def _received(self, sock, line):
+        try:
+            data = self.codec.decode(line)
+        except ValueError:
+            return
+        items = data if isinstance(data, list) else [data]
+        ids = [item.get('id') for item in items if isinstance(item, dict)]
+        ids = [id for id in ids if id is not None]
+        future = None
+        with self._lock:
+            for id in ids:
+                future = self._pending.pop(id, None)
+                if future is not None:
+                    break
+            unmatched = not ids and len(self._pending) > 1
+            if not ids and len(self._pending) == 1:
+                # an error without id, e.g. a parse error, can only be the
+                # answer to the one request in flight
+                future = self._pending.popitem()[1]
+        if unmatched:
+            # the server answers calls as they complete, there is no telling
+            # which request failed
+            self._disconnect(sock, IOError('response without id: {0}'.format(
+                                           line.strip())))
+        elif future is not None:
+            future.set_result(data)
+
+
+@public
+class TCPJSONRPCProxy(JSONRPCProxy):
+    '''A :py:class:`jsonrpc.proxy.JSONRPCProxy` talking to a
+    :py:class:`jsonrpc.tcpserver.TCPJSONRPCServer` at a ``tcp://host:port``
+    url, the path is ignored.
+
+    The same :py:class:`jsonrpc.proxy.ProxyEvents` hooks are applied and
+    calls can be made from many threads at once, they are all sent over the
+    same connection.  Use ``proxy.close()`` on the root proxy to close it.
+    Messages are always JSON, a binary codec is not used.
+
+    :param float timeout: seconds to wait for a response before
+                          :py:class:`jsonrpc.utilities.TimeoutError` is
+                          raised, by default there is no limit
+    '''
+
+    def __init__(self, host, path='', serviceName=None, *args, **kwargs):
+        self._timeout = kwargs.get('timeout')
+        JSONRPCProxy.__init__(self, host, path, serviceName, *args, **kwargs)
+
+    def _build_opener(self):
+        urlsp = urlparse.urlsplit(self.serviceURL)
+        if urlsp.scheme != 'tcp' or urlsp.port is None:
+            raise ValueError('expected a tcp://host:port url: {0!r}'.format(
+                             self.serviceURL))
+        return TCPClient((urlsp.hostname, urlsp.port), self._json_codec,
+                         self._timeout)
+
+    def close(self):
+        JSONRPCProxy.close(self)
+        self._opener.close()
+
+    def _send(self, obj):
+        return self._wait(self._opener.send(obj))
+
+    def _wait(self, future):
+        try:
+            return future.result(self._opener.timeout)
+        except TimeoutError:
+            self._opener.forget(future)
+            raise
+
+    def batch_call_iter(self, methods, ordered=True):
+        '''call several methods at once, yield the (result, error) pairs as
+        the responses arrive, see
+        :py:meth:`jsonrpc.proxy.JSONRPCProxy.batch_call_iter`
+
+        Every call is sent as a message of its own, so they run
+        concurrently on the server and each response arrives on its own.
+        '''
+        requests = [getattr(self, k)._get_request(*v) for k, v in _calls(methods)]
+        done = Queue.Queue()
+        futures = []
+        for n, request in enumerate(requests):
+            future = self._opener.send(request)
+            future.add_done_callback(lambda _, n=n: done.put(n))
+            futures.append(future)
+
+        def output(future):
+            try:
+                return Response.from_dict(self._wait(future)).get_output()
+            except IOError:
+                # the connection was lost before the response arrived
+                return None, dict(code=0, message='no response to the request')
+
+        if ordered:
+            for future in futures:
+                yield output(future)
+            return
+        for _ in futures:
+            try:
+                n = done.get(True, self._opener.timeout)
+            except Queue.Empty:
+                raise TimeoutError
+            yield n, output(futures[n])
@@ -0,0 +1,169 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+"""
+A JSON-RPC server speaking newline-delimited JSON over plain TCP sockets.
+
+Without HTTP there are no headers to send or parse, every request and every
+response is a JSON text on a line of its own.  Clients keep their
+connection open and may send many requests without waiting for the
+responses, which are written as soon as their call completes and so can
+arrive in any order, clients match them to their requests by id.
+
+    handler = StreamJSON_RPC.customize(MyServerEvents)
+    server = TCPJSONRPCServer(('', 8008), handler)
+    server.serve_forever()
+
+The same :py:class:`jsonrpc.server.ServerEvents` are used as with the HTTP
+servers, see :py:mod:`jsonrpc.tcpproxy` for the client.
+"""
+
+import socket
+import threading
+import SocketServer
+from multiprocessing.pool import ThreadPool
+
+from jsonrpc.server import JSON_RPC_Base
+from jsonrpc.utilities import public
+
+
+@public
+class StreamJSON_RPC(JSON_RPC_Base):
+    '''A JSON_RPC_Base which processes one message received by a
+    :py:class:`NDJSONRequestHandler`, one instance is created per message.
+    '''
+
+    #: Messages are always encoded with :py:attr:`codec`, there are no
+    #: headers to negotiate another one with
+    codecs = ()
+
+    def __init__(self, connection, data):
+        self.connection = connection
+        self.client_address = connection.client_address
+        self.data = data
+
+    def get_request_string(self):
+        return '<NDJSON {0}>'.format(self.client_address)
+
+    def read_data(self):
+        return self.data
+
+    def encode_response(self, codec, result):
+        if result is None:
+            # only notifications, nothing is sent back
+            return ''
+        return JSON_RPC_Base.encode_response(self, codec, result)
+
+    def write_data(self, code, result):
+        if result:
+            self.connection.send_message(result)
+
+
+@public
+class NDJSONRequestHandler(SocketServer.BaseRequestHandler):
+    '''Read the messages of a connection line by line and run each of them
+    on the server's thread pool, responses are written in the order in
+    which the calls complete.
+    '''
+
+    def setup(self):
+        self.connection = self.request
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._write_lock = threading.Lock()
+        self._slots = threading.Semaphore(self.server.max_inflight)
+
+    def handle(self):
+        rfile = self.connection.makefile('rb', -1)
+        try:
+            for line in iter(rfile.readline, ''):
+                if not line.strip():
+                    continue
+                # stop reading while too many calls of this connection run
+                self._slots.acquire()
+                self.server.pool.apply_async(self._run, (line,))
+        except socket.error:
+            pass
+        finally:
+            rfile.close()
+            # let the calls in flight finish before the socket is closed
+            for _ in xrange(self.server.max_inflight):
+                self._slots.acquire()
+
+    def _run(self, data):
+        '''Called by a worker thread'''
+        try:
+            self.server.handler_class(self, data).handle_request()
+        finally:
+            self._slots.release()
+
+    def send_message(self, data):
+        '''Write `data` as a line of its own, can be called from any thread'''
+        with self._write_lock:
+            try:
+                self.connection.sendall(data + '\n')
+            except socket.error:
+                # the client is gone, its responses are dropped
+                pass
+
+
+@public
+class TCPJSONRPCServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    '''Serve a :py:class:`StreamJSON_RPC` handler over TCP, a thread reads
+    each connection and the calls run on a shared pool of threads.
+
+    :param server_address: (host, port) to listen on
+    :param handler_class: a customized subclass of :py:class:`StreamJSON_RPC`
+    '''
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    #: Size of the listen() backlog
+    request_queue_size = 1024
+
+    #: Number of threads running method calls
+    workers = 16
+
+    #: Maximum number of calls of one connection running at the same time,
+    #: further messages are left unread until one of them completes
+    max_inflight = 64
+
+    def __init__(self, server_address, handler_class, bind_and_activate=True):
+        self.handler_class = handler_class
+        self.pool = ThreadPool(self.workers)
+        SocketServer.TCPServer.__init__(self, server_address,
+                                        NDJSONRequestHandler, bind_and_activate)
+
+    def server_close(self):
+        SocketServer.TCPServer.server_close(self)
+        self.pool.terminate()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+
+import collections
+import threading
+import time
+import unittest
+
+import jsonrpc.common
+from jsonrpc.asyncproxy import AsyncJSONRPCProxy
+from jsonrpc.asyncserver import AsyncHTTPServer, AsyncJSON_RPC
+from jsonrpc.proxy import ProxyEvents
+from jsonrpc.server import JSON_RPC
+from jsonrpc.tests.test_server import SleepServer, start_server
+
+
+class CountingEvents(ProxyEvents):
+    responses = []
+
+    def proc_response(self, data):
+        self.responses.append(data.id)
+        return data
+
+
+class TestAsyncJSONRPCProxy(unittest.TestCase):
+    '''Against the threaded server, which closes every connection'''
+
+    @classmethod
+    def setUpClass(cls):
+        class Handler(JSON_RPC):
+            pass
+        cls.httpd, cls.url = start_server(Handler.customize(SleepServer))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def setUp(self):
+        self.proxy = AsyncJSONRPCProxy.from_url(self.url)
+
+    def tearDown(self):
+        self.proxy.close()
+
+    def test_call(self):
+        self.assertEqual(self.proxy.sleep(0, 'value').result(5), 'value')
+
+    def test_error(self):
+        self.assertRaises(jsonrpc.common.RPCError, self.proxy.fail().result, 5)
+        self.assertRaises(jsonrpc.common.MethodNotFound,
+                          self.proxy.missing().result, 5)
+
+    def test_many_in_flight(self):
+        start = time.time()
+        futures = [self.proxy.sleep(0.2, n) for n in range(64)]
+        self.assertEqual([f.result(5) for f in futures], range(64))
+        self.assertLess(time.time() - start, 1.5)
+
+    def test_batch(self):
+        future = self.proxy.batch_call([('sleep', [(0, 1), {}]),
+                                        ('fail', [(), {}])])
+        result = future.result(5)
+        self.assertEqual(result[0], (1, None))
+        self.assertEqual(result[1][1]['message'], 'failed')
+
+    def test_batch_dict(self):
+        calls = collections.OrderedDict([('fail', [(), {}]),
+                                         ('sleep', [(0, 1), {}])])
+        result = self.proxy.batch_call(calls).result(5)
+        self.assertEqual(result[0][1]['message'], 'failed')
+        self.assertEqual(result[1], (1, None))
+
+    def test_same_id(self):
+        # each response is the one of the request sent on its connection
+        url = self.proxy._get_url()
+        body = '{{"jsonrpc": "2.0", "id": 1, "method": "sleep", "params": [{0}, "{1}"]}}'
+        fast = self.proxy._opener.post(url, body.format(0.1, 'fast'))
+        slow = self.proxy._opener.post(url, body.format(0.3, 'slow'))
+        self.assertEqual(fast.result(5)['result'], 'fast')
+        self.assertEqual(slow.result(5)['result'], 'slow')
+
+    def test_events(self):
+        proxy = AsyncJSONRPCProxy.from_url(self.url).customize(CountingEvents)
+        try:
+            CountingEvents.responses[:] = []
+            proxy.sleep(0, 1).result(5)
+            self.assertEqual(len(CountingEvents.responses), 1)
+        finally:
+            proxy.close()
+
+    def test_refused(self):
+        proxy = AsyncJSONRPCProxy('http://localhost:1', path='jsonrpc')
+        try:
+            self.assertRaises(IOError, proxy.sleep(0, 1).result, 5)
+        finally:
+            proxy.close()
+
+
+class TestAsyncJSONRPCProxyKeepAlive(unittest.TestCase):
+    '''Against the event driven server, which keeps connections open'''
+
+    @classmethod
+    def setUpClass(cls):
+        class Handler(AsyncJSON_RPC):
+            pass
+        cls.httpd = AsyncHTTPServer(('localhost', 0), Handler.customize(SleepServer))
+        thread = threading.Thread(target=cls.httpd.serve_forever, args=(0.1,))
+        thread.daemon = True
+        thread.start()
+        cls.url = 'http://localhost:%d/jsonrpc' % cls.httpd.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def test_reuse(self):
+        proxy = AsyncJSONRPCProxy.from_url(self.url)
+        try:
+            for n in range(5):
+                self.assertEqual(proxy.sleep(0, n).result(5), n)
+            self.assertEqual(len(self.httpd.channels()), 1)
+        finally:
+            proxy.close()
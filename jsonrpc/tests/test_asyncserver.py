@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+
+import httplib
+import socket
+import threading
+import time
+import unittest
+
+import jsonrpc.jsonutil
+from jsonrpc.asyncserver import AsyncHTTPServer, AsyncJSON_RPC
+from jsonrpc.compression import compress
+from jsonrpc.tests.test_server import SleepServer, batch, send_json
+
+
+def request(method, params, id=1):
+    return jsonrpc.jsonutil.encode(
+        dict(jsonrpc='2.0', id=id, method=method, params=params))
+
+
+class TestAsyncHTTPServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Handler(AsyncJSON_RPC):
+            batch_workers = 4
+
+        class Server(AsyncHTTPServer):
+            idle_timeout = 0.5
+
+        cls.httpd = Server(('localhost', 0), Handler.customize(SleepServer))
+        cls.port = cls.httpd.server_address[1]
+        cls.url = 'http://localhost:%d/jsonrpc' % cls.port
+        thread = threading.Thread(target=cls.httpd.serve_forever,
+                                  args=(0.1,))
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def test_call(self):
+        result = send_json(self.url, request('sleep', [0, 'value']))
+        self.assertEqual(result['result'], 'value')
+
+    def test_error(self):
+        result = send_json(self.url, request('fail', []))
+        self.assertEqual(result['error']['message'], 'failed')
+
+    def test_keepalive(self):
+        conn = httplib.HTTPConnection('localhost', self.port)
+        for n in range(3):
+            conn.request('POST', '/jsonrpc', request('sleep', [0, n]))
+            if n == 0:
+                sock = conn.sock
+            resp = conn.getresponse()
+            self.assertEqual(jsonrpc.jsonutil.decode(resp.read())['result'], n)
+            self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_pipelining(self):
+        sock = socket.create_connection(('localhost', self.port))
+        data = ''
+        for n, delay in enumerate([0.2, 0]):
+            body = request('sleep', [delay, n], id=n)
+            data += ('POST /jsonrpc HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s'
+                     % (len(body), body))
+        sock.sendall(data)
+        fp = sock.makefile('rb')
+        for n in range(2):
+            self.assertTrue(fp.readline().startswith('HTTP/1.1 200'))
+            headers = httplib.HTTPMessage(fp)
+            body = fp.read(int(headers['content-length']))
+            self.assertEqual(jsonrpc.jsonutil.decode(body)['id'], n)
+        fp.close()
+        sock.close()
+
+    def test_concurrent_connections(self):
+        threads = [threading.Thread(target=send_json,
+                                    args=(self.url, request('sleep', [0.3, n])))
+                   for n in range(4)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(time.time() - start, 0.9)
+
+    def test_batch(self):
+        data = batch(*[('sleep', [0.2, n]) for n in range(4)])
+        start = time.time()
+        result = send_json(self.url, data)
+        self.assertLess(time.time() - start, 0.6)
+        self.assertEqual([x['result'] for x in result], range(4))
+
+    def test_idle_timeout(self):
+        sock = socket.create_connection(('localhost', self.port))
+        sock.settimeout(5)
+        self.assertEqual(sock.recv(1), '')
+        sock.close()
+
+    def test_unsupported_method(self):
+        conn = httplib.HTTPConnection('localhost', self.port)
+        conn.request('GET', '/jsonrpc')
+        self.assertEqual(conn.getresponse().status, 501)
+        conn.close()
+
+    def post_raw(self, data, count):
+        '''Send `data` on a new connection, return the (status, body) of
+        `count` responses'''
+        sock = socket.create_connection(('localhost', self.port))
+        sock.sendall(data)
+        fp = sock.makefile('rb')
+        responses = []
+        for n in range(count):
+            status = int(fp.readline().split()[1])
+            headers = httplib.HTTPMessage(fp)
+            responses.append((status, fp.read(int(headers['content-length']))))
+        fp.close()
+        sock.close()
+        return responses
+
+    def test_chunked(self):
+        body = request('sleep', [0, 'chunked'])
+        chunks = ''.join('%x;ext=1\r\n%s\r\n' % (len(body[i:i + 5]), body[i:i + 5])
+                         for i in range(0, len(body), 5))
+        data = ('POST /jsonrpc HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                '%s0\r\nX-Trailer: 1\r\n\r\n' % chunks)
+        # the connection is still usable after the trailer
+        [(status, first), (_, second)] = self.post_raw(data + data, 2)
+        self.assertEqual(status, 200)
+        self.assertEqual(jsonrpc.jsonutil.decode(first)['result'], 'chunked')
+        self.assertEqual(first, second)
+
+    def test_compressed(self):
+        for encoding in ('gzip', 'deflate'):
+            data = compress(request('sleep', [0, encoding]), encoding)
+            conn = httplib.HTTPConnection('localhost', self.port)
+            conn.request('POST', '/jsonrpc', data, {'Content-Encoding': encoding})
+            body = conn.getresponse().read()
+            conn.close()
+            self.assertEqual(jsonrpc.jsonutil.decode(body)['result'], encoding)
+
+        conn = httplib.HTTPConnection('localhost', self.port)
+        conn.request('POST', '/jsonrpc', 'not gzip', {'Content-Encoding': 'gzip'})
+        body = conn.getresponse().read()
+        conn.close()
+        self.assertEqual(jsonrpc.jsonutil.decode(body)['error']['code'], -32700)
+
+    def test_error_after_pipelined(self):
+        body = request('sleep', [0.2, 'first'])
+        data = ('POST /jsonrpc HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s'
+                'garbage\r\n\r\n' % (len(body), body))
+        [(status, first), (error, _)] = self.post_raw(data, 2)
+        self.assertEqual(status, 200)
+        self.assertEqual(jsonrpc.jsonutil.decode(first)['result'], 'first')
+        self.assertEqual(error, 400)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+
+import threading
+import time
+import unittest
+
+import jsonrpc.common
+import jsonrpc.jsonutil
+import jsonrpc.proxy
+from jsonrpc.cache import ResultCache, SingleFlight, cache_key
+from jsonrpc.registry import MethodRegistry
+from jsonrpc.server import ServerEvents
+from jsonrpc.tests.test_server import (ServerTestCase, batch, run_threads,
+                                       send_json)
+
+
+class Clock(object):
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = ResultCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_key(self):
+        self.assertEqual(cache_key('m', (1, 2), {'b': 1, 'a': [2]}),
+                         cache_key('m', [1, 2], {u'a': (2,), u'b': 1}))
+        self.assertNotEqual(cache_key('m', (1,), {}), cache_key('n', (1,), {}))
+        self.assertNotEqual(cache_key('m', (1,), {}), cache_key('m', (), {'a': 1}))
+
+    def test_hit_miss(self):
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.put('a', 1)
+        self.assertEqual(self.cache.get('a').value, 1)
+        self.assertEqual(self.cache.stats(), dict(hits=1, misses=1, evictions=0,
+                                                  expirations=0, size=1))
+
+    def test_lru(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertEqual(self.cache.get('a').value, 1)
+        self.assertEqual(self.cache.get('c').value, 3)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_ttl(self):
+        self.cache.put('a', 1)
+        self.clock.now += 9
+        self.assertEqual(self.cache.get('a').value, 1)
+        self.clock.now += 1
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertEqual(self.cache.expirations, 1)
+        self.assertEqual(len(self.cache), 0)
+
+        cache = ResultCache(ttl=None, clock=self.clock)
+        cache.put('a', 1)
+        self.clock.now += 10 ** 9
+        self.assertEqual(cache.get('a').value, 1)
+
+    def test_invalidate(self):
+        self.cache.put(cache_key('m', (1,), {}), 1)
+        self.cache.put(cache_key('m', (2,), {}), 2)
+        self.cache.invalidate('m', 1)
+        self.assertEqual(len(self.cache), 1)
+        self.cache.invalidate('n')
+        self.assertEqual(len(self.cache), 1)
+        self.cache.invalidate('m')
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def run_concurrently(self, count, func):
+        return run_threads(count, lambda n: func(), ValueError)
+
+    def test_coalesce(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def slow(value):
+            calls.append(value)
+            release.wait()
+            return [value]
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        results = self.run_concurrently(5, lambda: flight.do('k', slow, 1))
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [[1]] * 5)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(flight.stats(), dict(executions=1, coalesced=4, running=0))
+
+        # the next call runs again
+        self.assertEqual(flight.do('k', slow, 2), [2])
+        self.assertEqual(flight.executions, 2)
+
+    def test_error(self):
+        flight = SingleFlight()
+
+        def fail():
+            time.sleep(0.2)
+            raise ValueError('failed')
+
+        results = self.run_concurrently(3, lambda: flight.do('k', fail))
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(flight.stats(), dict(executions=1, coalesced=2, running=0))
+
+    def test_keys(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('a', lambda: 1), 1)
+        self.assertEqual(flight.do('b', lambda: 2), 2)
+        self.assertEqual(flight.coalesced, 0)
+
+
+registry = MethodRegistry()
+calls = []
+
+@registry.method(cache=True)
+def lookup(key, upper=False):
+    calls.append(key)
+    return dict(key=key.upper() if upper else key, values=[1.5, 2])
+
+@registry.method(cache=ResultCache(maxsize=1))
+def fail(key):
+    calls.append(key)
+    raise ValueError(key)
+
+@registry.method(single_flight=True)
+def slow(key, delay=0.2):
+    calls.append(key)
+    time.sleep(delay)
+    return key
+
+@registry.method(single_flight=True, cache=True)
+def slow_cached(key):
+    calls.append(key)
+    time.sleep(0.2)
+    return key
+
+@registry.method()
+def plain(key):
+    calls.append(key)
+    return key
+
+
+class CacheServer(ServerEvents):
+    methods = registry
+
+
+class TestCachedMethods(ServerTestCase):
+    events = CacheServer
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        calls[:] = []
+        for name in registry:
+            registry.invalidate(name)
+
+    def test_cached(self):
+        for n in range(3):
+            self.assertEqual(self.proxy.lookup('a'), dict(key='a', values=[1.5, 2]))
+        self.assertEqual(self.proxy.lookup('a', upper=True)['key'], 'A')
+        self.assertEqual(self.proxy.lookup(key='a', upper=True)['key'], 'A')
+        self.assertEqual(calls, ['a', 'a'])
+        entry = registry['lookup'].cache.get(cache_key('lookup', (u'a', False), {}))
+        self.assertEqual(entry.encoded.keys(), [jsonrpc.jsonutil.get_codec().name])
+
+    def test_not_cached(self):
+        self.proxy.plain('a')
+        self.proxy.plain('a')
+        self.assertRaises(jsonrpc.common.RPCError, self.proxy.fail, 'a')
+        self.assertRaises(jsonrpc.common.RPCError, self.proxy.fail, 'a')
+        self.assertEqual(calls, ['a'] * 4)
+        self.assertEqual(registry.cache_stats()['fail']['size'], 0)
+
+    def test_bound(self):
+        # positional, keyword and default arguments share an entry
+        self.proxy.lookup('a')
+        self.proxy.lookup(key='a')
+        self.proxy.lookup('a', False)
+        self.proxy.lookup('a', upper=False)
+        self.assertEqual(calls, ['a'])
+        registry.invalidate('lookup', key='a', upper=False)
+        self.proxy.lookup('a')
+        self.assertEqual(calls, ['a', 'a'])
+
+    def test_invalidate(self):
+        self.proxy.lookup('a')
+        self.proxy.lookup('b')
+        registry.invalidate('lookup', 'a')
+        self.proxy.lookup('a')
+        self.proxy.lookup('b')
+        self.assertEqual(calls, ['a', 'b', 'a'])
+
+    def test_batch(self):
+        data = batch(('lookup', ['a']), ('plain', ['b']), ('lookup', ['a']),
+                     ('lookup', {'key': 'a'}))
+        for n in range(2):
+            result = send_json(self.url, data)
+            self.assertEqual([x['id'] for x in result], [0, 1, 2, 3])
+            self.assertEqual(result[0]['result'], dict(key='a', values=[1.5, 2]))
+            self.assertEqual(result[0], dict(result[2], id=0))
+        self.assertEqual(calls, ['a', 'b', 'b'])
+
+    def test_stats(self):
+        self.proxy.lookup('c')
+        self.proxy.lookup('c')
+        stats = registry.cache_stats()
+        self.assertEqual(sorted(stats), ['fail', 'lookup', 'slow_cached'])
+        self.assertEqual(stats['lookup']['size'], 1)
+        self.assertTrue(stats['lookup']['hits'] >= 1)
+
+    def call_concurrently(self, count, method, *args):
+        return run_threads(count, lambda n: getattr(self.proxy, method)(*args))
+
+    def test_single_flight(self):
+        before = registry.flight_stats()['slow']
+        self.assertEqual(self.call_concurrently(5, 'slow', 'x'), ['x'] * 5)
+        self.assertEqual(calls, ['x'])
+        after = registry.flight_stats()['slow']
+        self.assertEqual(after['coalesced'] - before['coalesced'], 4)
+        self.assertEqual(after['executions'] - before['executions'], 1)
+
+        # other parameters are not coalesced
+        self.assertEqual(self.proxy.slow('y', 0), 'y')
+        self.assertEqual(calls, ['x', 'y'])
+
+    def test_single_flight_cached(self):
+        self.assertEqual(self.call_concurrently(5, 'slow_cached', 'x'), ['x'] * 5)
+        self.assertEqual(self.proxy.slow_cached('x'), 'x')
+        self.assertEqual(calls, ['x'])
+        self.assertEqual(registry.cache_stats()['slow_cached']['size'], 1)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+
+import sys
+import unittest
+
+from jsonrpc import cbor, jsonutil
+from jsonrpc.common import Request, Response
+
+
+class TestCBOR(unittest.TestCase):
+    def roundtrip(self, obj):
+        return cbor.loads(cbor.dumps(obj))
+
+    def test_values(self):
+        values = [0, 23, 24, 255, 256, 65536, 2 ** 32, 2 ** 64 - 1, 2 ** 64,
+                  2 ** 100, -1, -25, -2 ** 64, -2 ** 64 - 1, -2 ** 100,
+                  1.5, -0.0, 1e300, float('inf'), True, False, None,
+                  u'', u'h\xe9llo €', [], [1, [2, u'3']], {},
+                  {u'a': [1, {u'b': None}]}]
+        for value in values:
+            self.assertEqual(self.roundtrip(value), value)
+            self.assertEqual(type(self.roundtrip(value)), type(value))
+
+    def test_rfc_examples(self):
+        examples = [
+            ('00', 0), ('17', 23), ('1818', 24), ('1903e8', 1000),
+            ('1bffffffffffffffff', 18446744073709551615),
+            ('c249010000000000000000', 18446744073709551616),
+            ('3863', -100), ('f93c00', 1.0), ('f97bff', 65504.0),
+            ('fa47c35000', 100000.0), ('fb3ff199999999999a', 1.1),
+            ('f4', False), ('f5', True), ('f6', None),
+            ('6449455446', u'IETF'), ('4401020304', '\x01\x02\x03\x04'),
+            ('83010203', [1, 2, 3]),
+            ('a201020304', {1: 2, 3: 4}),
+            ('9f018202039f0405ffff', [1, [2, 3], [4, 5]]),
+            ('bf61610161629f0203ffff', {u'a': 1, u'b': [2, 3]}),
+            ('7f657374726561646d696e67ff', u'streaming'),
+            ('c074323031332d30332d32315432303a30343a30305a',
+             u'2013-03-21T20:04:00Z'),
+        ]
+        for data, value in examples:
+            self.assertEqual(cbor.loads(data.decode('hex')), value)
+
+    def test_encoding(self):
+        self.assertEqual(cbor.dumps(1000), '1903e8'.decode('hex'))
+        self.assertEqual(cbor.dumps(-100), '3863'.decode('hex'))
+        self.assertEqual(cbor.dumps(u'IETF'), '6449455446'.decode('hex'))
+        self.assertEqual(cbor.dumps([1, 2, 3]), '83010203'.decode('hex'))
+
+    def test_json_semantics(self):
+        self.assertEqual(self.roundtrip((1, 2)), [1, 2])
+        self.assertEqual(self.roundtrip('abc'), u'abc')
+        self.assertEqual(self.roundtrip({1: 1, None: 2, 1.5: 3, True: 4}),
+                         {u'1': 4, u'null': 2, u'1.5': 3})
+        self.assertRaises(UnicodeDecodeError, cbor.dumps, '\xff')
+        self.assertRaises(TypeError, cbor.dumps, object())
+        self.assertRaises(TypeError, cbor.dumps, {(1, 2): 3})
+
+    def test_typed_arrays(self):
+        floats = [n / 3.0 for n in range(100)]
+        data = cbor.dumps(floats)
+        self.assertEqual(len(data), 3 + 2 + 800)
+        self.assertEqual(cbor.loads(data), floats)
+
+        ints = range(-50, 50) + [sys.maxint, -sys.maxint - 1]
+        data = cbor.dumps(ints)
+        self.assertEqual(data[:2], '\xd8\x4b')
+        self.assertEqual(cbor.loads(data), ints)
+
+        for mixed in ([1.0] * 10 + [1], [1] * 10 + [2 ** 63], [1] * 10 + [True]):
+            self.assertEqual(self.roundtrip(mixed), mixed)
+            self.assertEqual(cbor.dumps(mixed)[0], chr(0x80 | len(mixed)))
+
+    def test_default(self):
+        data = cbor.dumps([Request(1, u'add', [1, 2])], default=jsonutil.default_)
+        self.assertEqual(cbor.loads(data), [
+            {u'jsonrpc': u'2.0', u'id': 1, u'method': u'add', u'params': [1, 2]}])
+
+    def test_errors(self):
+        for data in ['', '18', '81', '81ff', 'ff', '0000', 'c2', 'a1', 'a101',
+                     '5f01ff', '7f4100ff', '61ff', 'c25801']:
+            self.assertRaises(ValueError, cbor.loads, data.decode('hex'))
+
+    def test_codec(self):
+        codec = jsonutil.get_codec('cbor')
+        self.assertTrue(codec.binary)
+        self.assertEqual(codec.content_type, 'application/cbor')
+        resp = Response(id=1, result=[1.5, 2.5])
+        self.assertEqual(codec.decode(codec.to_bytes(resp)),
+                         {u'jsonrpc': u'2.0', u'id': 1, u'result': [1.5, 2.5]})
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+
+import gzip
+import unittest
+import zlib
+from cStringIO import StringIO
+
+from jsonrpc import compression
+
+
+DATA = '[' + ','.join(['{"jsonrpc": "2.0", "result": 1, "id": 1}'] * 100) + ']'
+
+
+class TestCompression(unittest.TestCase):
+    def test_roundtrip(self):
+        for encoding in ('gzip', 'deflate'):
+            data = compression.compress(DATA, encoding)
+            self.assertLess(len(data), len(DATA) / 10)
+            self.assertEqual(compression.decompress(data, encoding), DATA)
+
+    def test_gzip_module(self):
+        data = compression.compress(DATA, 'gzip', 9)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(data)).read(), DATA)
+
+    def test_raw_deflate(self):
+        obj = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = obj.compress(DATA) + obj.flush()
+        self.assertEqual(compression.decompress(data, 'deflate'), DATA)
+
+    def test_identity(self):
+        self.assertEqual(compression.decompress(DATA, ''), DATA)
+        self.assertEqual(compression.decompress(DATA, 'identity'), DATA)
+        self.assertEqual(compression.decompressor('identity'), None)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, compression.decompress, DATA, 'br')
+        self.assertRaises(ValueError, compression.decompress, DATA, 'gzip')
+        self.assertRaises(ValueError, compression.decompressor, 'br')
+
+    def test_max_size(self):
+        for encoding in ('gzip', 'deflate'):
+            data = compression.compress(DATA, encoding)
+            self.assertEqual(compression.decompress(data, encoding, len(DATA)),
+                             DATA)
+            self.assertRaises(ValueError, compression.decompress, data,
+                              encoding, len(DATA) - 1)
+        obj = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = obj.compress(DATA) + obj.flush()
+        self.assertRaises(ValueError, compression.decompress, data,
+                          'deflate', 100)
+        # only encoded data is limited
+        self.assertEqual(compression.decompress(DATA, '', 100), DATA)
+
+    def test_decompressor(self):
+        data = compression.compress(DATA, 'gzip')
+        obj = compression.decompressor('GZIP')
+        parts = [obj.decompress(data[n:n + 10]) for n in range(0, len(data), 10)]
+        self.assertEqual(''.join(parts) + obj.flush(), DATA)
+
+    def test_choose_encoding(self):
+        choose = compression.choose_encoding
+        self.assertEqual(choose('gzip, deflate'), 'gzip')
+        self.assertEqual(choose('deflate'), 'deflate')
+        self.assertEqual(choose('gzip;q=0, deflate;q=0.5'), 'deflate')
+        self.assertEqual(choose('*'), 'gzip')
+        self.assertEqual(choose('*, gzip;q=0'), 'deflate')
+        self.assertEqual(choose('identity'), None)
+        self.assertEqual(choose(None), None)
+        self.assertEqual(choose('gzip', ()), None)
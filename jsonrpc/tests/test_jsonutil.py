@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 
 
+import UserDict
+import collections
+import decimal
 import json
 import unittest
+from cStringIO import StringIO
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
 
 from jsonrpc import jsonutil
+from jsonrpc.common import Request, Response, RPCError, MethodNotFound
 
 
 class testobj(object):
@@ -66,3 +76,234 @@ class TestJSONUTIL(unittest.TestCase):
 
         self.assertEqual(jsonutil.decode(jsonutil.encode(self.obj3)), self.obj3_roundtrip)
 
+
+class TestCodecs(unittest.TestCase):
+    def setUp(self):
+        # a backend which does not support the default hook
+        self.nohook = jsonutil.Codec('nohook', lambda obj: json.dumps(obj),
+                                     json.loads, default_hook=False)
+        self.objects = [
+            dict(a=[1,2,3],b={2:2,3:3,4:4},c=(3,4,5)),
+            dict(a=set([1]),b=frozenset([2]),c=[1,2,3]),
+            testobj(),
+            Request('id', 'method', (1, set([2])), None),
+            Request(1, 'method', (), dict(a=testobj())),
+            Response(1, result=[testobj()]),
+            Response(None, error=MethodNotFound()),
+            MethodNotFound(),
+        ]
+
+    def test_default(self):
+        self.assertEqual(jsonutil.preferred[0], 'json')
+        self.assertEqual(jsonutil.get_codec().name, 'json')
+        self.assertEqual(jsonutil.encode, jsonutil.get_codec().encode)
+
+    def test_get_codec(self):
+        self.assertEqual(jsonutil.get_codec('json').name, 'json')
+        self.assertIs(jsonutil.get_codec(self.nohook), self.nohook)
+        self.assertRaises(KeyError, jsonutil.get_codec, 'missing')
+
+    def test_register(self):
+        jsonutil.register_codec(self.nohook)
+        self.assertIs(jsonutil.get_codec('nohook'), self.nohook)
+
+    def test_equivalent(self):
+        for codec in [jsonutil.get_codec('json'), self.nohook]:
+            for obj in self.objects:
+                self.assertEqual(codec.decode(codec.encode(obj)),
+                                 json.loads(jsonutil.encode(obj)))
+
+
+class counted(object):
+    calls = 0
+    def json_equivalent(self):
+        counted.calls += 1
+        return dict(nested=set([testobj()]))
+
+
+class classic:
+    def json_equivalent(self):
+        return 'classic'
+
+
+class unknown(object):
+    def __str__(self):
+        return 'unknown'
+
+
+class nested(object):
+    def json_equivalent(self):
+        return [testobj(), {'a': testobj()}]
+
+
+class hooked(object):
+    inner = testobj()
+    def json_equivalent(self):
+        return self.inner
+
+
+# the conversion before it was looked up per class
+def baseline_dict(obj):
+    items = getattr(obj, 'iteritems', obj.items)
+    return dict((baseline_encode(k), baseline_encode(v)) for k, v in items())
+
+def baseline_list(obj):
+    return list(baseline_encode(i) for i in obj)
+
+def baseline_safe(obj):
+    try:
+        json.dumps(obj)
+    except TypeError:
+        obj = str(obj)
+    return obj
+
+def baseline_encode(obj, **kw):
+    obj = getattr(obj, 'json_equivalent', lambda: obj)()
+    if hasattr(obj, 'items'):
+        func = baseline_dict
+    elif hasattr(obj, '__iter__'):
+        func = baseline_list
+    else:
+        func = baseline_safe
+    return func(obj)
+
+
+class TestSinglePass(unittest.TestCase):
+    def setUp(self):
+        self.objects = [
+            counted(),
+            classic(),
+            unknown(),
+            UserDict.UserDict(a=testobj(), b=[unknown()]),
+            (x for x in [1, testobj()]),
+            {2: classic()},
+            [1.5, u'\xe9', 2L, True, None],
+        ]
+        self.expected = [
+            {'nested': ['This is the json value']},
+            'classic',
+            'unknown',
+            {'a': 'This is the json value', 'b': ['unknown']},
+            [1, 'This is the json value'],
+            {'2': 'classic'},
+            [1.5, u'\xe9', 2, True, None],
+        ]
+
+    def test_encode(self):
+        for obj, expected in zip(self.objects, self.expected):
+            self.assertEqual(json.loads(jsonutil.encode(obj)), expected)
+
+    def test_encode_deep(self):
+        for obj, expected in zip(self.objects, self.expected):
+            if hasattr(obj, 'next'):
+                continue
+            self.assertEqual(json.loads(json.dumps(jsonutil.encode_(obj))),
+                             expected)
+
+    def test_called_once(self):
+        counted.calls = 0
+        jsonutil.encode([counted()])
+        self.assertEqual(counted.calls, 1)
+
+    def test_instance_hook(self):
+        plain, hooked = unknown(), unknown()
+        hooked.json_equivalent = lambda: 'instance'
+
+        class Proxy(object):
+            __slots__ = ()
+
+            def __getattr__(self, name):
+                return lambda: name
+        deep = lambda obj: json.dumps(jsonutil.encode_(obj))
+        for encode in (jsonutil.encode, deep):
+            self.assertEqual(json.loads(encode([plain, hooked])),
+                             ['unknown', 'instance'])
+            self.assertEqual(json.loads(encode(Proxy())), 'json_equivalent')
+
+    def baseline_objects(self):
+        objects = [obj for obj in self.objects if not hasattr(obj, 'next')]
+        objects += [
+            dict(a=set([1]), b=frozenset([2]), c=[1, 2, 3]),
+            Request('id', 'method', (1, set([2])), None),
+            Request(1, 'method', (), dict(a=testobj(), b=hooked())),
+            Response(1, result=[testobj(), nested()]),
+            Response(None, error=MethodNotFound()),
+            RPCError(),
+            {'z': nested(), 'y': [hooked(), unknown()], 1: 2, 'x': 3},
+            hooked(),
+            collections.namedtuple('pair', 'a b')(1, testobj()),
+            decimal.Decimal('1.5'),
+        ]
+        return objects
+
+    def test_baseline(self):
+        codec = jsonutil.get_codec('json')
+        for obj in self.baseline_objects():
+            expected = json.dumps(obj, default=baseline_encode)
+            self.assertEqual(codec.encode(obj), expected)
+            self.assertEqual(json.dumps(jsonutil.encode_(obj)),
+                             json.dumps(baseline_encode(obj)))
+
+    @unittest.skipUnless(simplejson, 'simplejson is not installed')
+    def test_simplejson(self):
+        codec = jsonutil.get_codec('simplejson')
+        for obj in self.baseline_objects():
+            self.assertEqual(codec.encode(obj),
+                             json.dumps(obj, default=baseline_encode))
+
+    def test_bounded(self):
+        for n in range(jsonutil.MAX_CLASSES + 10):
+            jsonutil.encode(type('Dynamic', (unknown,), {})())
+        self.assertLessEqual(len(jsonutil._deep), jsonutil.MAX_CLASSES)
+
+
+class TestIterdecode(unittest.TestCase):
+    def decode(self, data, chunk_size=3):
+        result = jsonutil.iterdecode(StringIO(data), chunk_size)
+        if isinstance(result, jsonutil.ArrayStream):
+            result = list(result)
+        return result
+
+    def test_array(self):
+        data = [{"a": [1, 2]}, 12345, u'\xe9\xe9', [], {}, None, 1.5e10]
+        encoded = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        for chunk_size in [1, 2, 3, 7, 64]:
+            self.assertEqual(self.decode(encoded, chunk_size), data)
+
+    def test_whitespace(self):
+        self.assertEqual(self.decode(' \n[ 1 ,\n2 ] \n'), [1, 2])
+        self.assertEqual(self.decode('[]'), [])
+
+    def test_object(self):
+        self.assertEqual(self.decode(' {"a": [1, 2]}'), {"a": [1, 2]})
+
+    def test_lazy(self):
+        stream = jsonutil.iterdecode(StringIO('[1, 2, oops'), 1)
+        self.assertEqual(next(stream), 1)
+        self.assertEqual(next(stream), 2)
+        self.assertRaises(ValueError, next, stream)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.decode, '[1 2]')
+        self.assertRaises(ValueError, self.decode, '[1, 2')
+        self.assertRaises(ValueError, self.decode, '')
+        self.assertRaises(ValueError, self.decode, '[1,, 2]')
+        self.assertRaises(ValueError, self.decode, '[1, 2,]')
+        self.assertRaises(ValueError, self.decode, '[1}, 2]')
+
+    def test_strings(self):
+        data = ['a,b]', '{"}', 'back\\slash', 'quote"', '\\', u'\u20ac']
+        encoded = json.dumps(data)
+        for chunk_size in [1, 2, 3, 64]:
+            self.assertEqual(self.decode(encoded, chunk_size), data)
+
+    def test_codec(self):
+        decoded = []
+
+        def loads(data):
+            decoded.append(data)
+            return json.loads(data)
+        codec = jsonutil.Codec('recording', json.dumps, loads)
+        stream = jsonutil.iterdecode(StringIO('[1, {"a": [2]}]'), 4, codec)
+        self.assertEqual(list(stream), [1, {'a': [2]}])
+        self.assertEqual([d.strip() for d in decoded], ['1', '{"a": [2]}'])
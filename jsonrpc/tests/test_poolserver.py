@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+
+import socket
+import threading
+import time
+import unittest
+import urllib2
+
+import jsonrpc.common
+import jsonrpc.jsonutil
+import jsonrpc.proxy
+from jsonrpc.poolserver import PoolHTTPServer
+from jsonrpc.server import JSON_RPC
+from jsonrpc.tests.test_server import SleepServer
+
+
+class TestPoolHTTPServer(unittest.TestCase):
+    def start(self, keepalive=False, **kwargs):
+        class Handler(JSON_RPC):
+            pass
+        Handler.keepalive = keepalive
+        httpd = PoolHTTPServer(('localhost', 0), Handler.customize(SleepServer),
+                               **kwargs)
+        thread = threading.Thread(target=httpd.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        self.url = 'http://localhost:%d/jsonrpc' % httpd.server_address[1]
+        return httpd
+
+    def proxy(self):
+        return jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+
+    def call_later(self, delay, results):
+        thread = threading.Thread(
+            target=lambda: results.append(self.proxy().sleep(delay, delay)))
+        thread.start()
+        self.addCleanup(thread.join)
+        return thread
+
+    def wait_for(self, httpd, **expected):
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            stats = httpd.stats()
+            if all(stats[k] == v for k, v in expected.items()):
+                return stats
+            time.sleep(0.01)
+        self.fail('stats {0} never matched {1}'.format(httpd.stats(), expected))
+
+    def test_call(self):
+        httpd = self.start(workers=2, queue_size=2)
+        proxy = self.proxy()
+        self.assertEqual(proxy.sleep(0, 'value'), 'value')
+        self.assertRaises(jsonrpc.common.RPCError, proxy.fail)
+        stats = self.wait_for(httpd, served=2)
+        self.assertEqual(stats['accepted'], 2)
+        self.assertEqual(stats['rejected'], 0)
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['queue_size'], 2)
+
+    def test_reject(self):
+        httpd = self.start(workers=1, queue_size=1)
+        results = []
+        threads = [self.call_later(0.5, results)]
+        self.wait_for(httpd, busy=1)
+        threads.append(self.call_later(0, results))
+        self.wait_for(httpd, queued=1)
+
+        start = time.time()
+        with self.assertRaises(urllib2.HTTPError) as raised:
+            self.proxy().sleep(0, 'value')
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(raised.exception.code, 503)
+        self.assertEqual(raised.exception.info().getheader('retry-after'), '1')
+        error = jsonrpc.jsonutil.decode(raised.exception.read())['error']
+        self.assertEqual(error['code'], jsonrpc.common.ServerBusy.code)
+
+        stats = self.wait_for(httpd, served=2)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [0, 0.5])
+        self.assertEqual(stats['accepted'], 2)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertGreater(stats['wait_max'], 0.3)
+        self.assertGreater(stats['wait_mean'], 0.15)
+
+    def test_busy_status(self):
+        httpd = self.start(workers=1, queue_size=1)
+        httpd.busy_status = 200
+        results = []
+        self.call_later(0.5, results)
+        self.wait_for(httpd, busy=1)
+        self.call_later(0, results)
+        self.wait_for(httpd, queued=1)
+        self.assertRaises(jsonrpc.common.ServerBusy, self.proxy().sleep, 0, 1)
+
+    def test_keepalive(self):
+        httpd = self.start(keepalive=True, workers=1, queue_size=1)
+        proxy = self.proxy()
+        # frees the worker
+        self.addCleanup(proxy._opener.clear)
+        self.assertEqual([proxy.sleep(0, n) for n in range(5)], range(5))
+        # one connection, served by one worker
+        self.assertEqual(httpd.stats()['accepted'], 1)
+
+    def test_close_queued(self):
+        httpd = self.start(workers=1, queue_size=1)
+        results = []
+        self.call_later(0.3, results)
+        self.wait_for(httpd, busy=1)
+        waiting = socket.create_connection(httpd.server_address)
+        self.addCleanup(waiting.close)
+        self.wait_for(httpd, queued=1)
+        httpd.shutdown()
+        httpd.server_close()
+        # the waiting connection is closed, the call in progress completes
+        self.assertEqual(waiting.recv(1), '')
+        self.wait_for(httpd, served=1)
+        self.assertEqual(results, [0.3])
+
+    def test_close_busy(self):
+        # more workers than queue slots, all of them held by idle
+        # keep-alive connections
+        httpd = self.start(keepalive=True, workers=2, queue_size=1)
+        for busy in (1, 2):
+            proxy = self.proxy()
+            self.addCleanup(proxy._opener.clear)
+            self.assertEqual(proxy.sleep(0, 1), 1)
+            self.wait_for(httpd, busy=busy)
+        httpd.shutdown()
+        start = time.time()
+        httpd.server_close()
+        self.assertLess(time.time() - start, 2)
+
+    def test_sizes(self):
+        self.assertRaises(ValueError, PoolHTTPServer, ('localhost', 0),
+                          JSON_RPC, queue_size=0)
+        self.assertRaises(ValueError, PoolHTTPServer, ('localhost', 0),
+                          JSON_RPC, workers=0)
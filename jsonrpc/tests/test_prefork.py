@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+
+import os
+import signal
+import socket
+import threading
+import time
+import unittest
+
+import jsonrpc.proxy
+from jsonrpc.prefork import PreforkServer
+from jsonrpc.server import JSON_RPC
+from jsonrpc.tests.test_server import SleepServer
+
+
+class PidServer(SleepServer):
+    def findmethod(self, method, args=None, kwargs=None):
+        if method == 'pid':
+            return os.getpid
+        return SleepServer.findmethod(self, method, args, kwargs)
+
+
+class Handler(JSON_RPC):
+    pass
+
+Handler.customize(PidServer)
+
+
+class TestPreforkServer(unittest.TestCase):
+    def start(self, workers=2, **kwargs):
+        server = PreforkServer(('localhost', kwargs.pop('port', 0)), Handler,
+                               workers, **kwargs)
+        server.poll_interval = 0.05
+        server.drain_timeout = 2
+        server.restart_delay = 0.2
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        server.server_close()
+        self.addCleanup(self.stop)
+        self.url = 'http://localhost:%d/jsonrpc' % server.server_address[1]
+        return jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+
+    def stop(self):
+        if self.pid is not None:
+            os.kill(self.pid, signal.SIGTERM)
+            self.wait_master()
+
+    def wait_master(self, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.pid = None
+                return status
+            time.sleep(0.05)
+        self.fail('the supervisor did not stop')
+
+    def worker_pids(self, proxy, calls=40):
+        return set(proxy.pid() for _ in range(calls))
+
+    def test_call(self):
+        proxy = self.start()
+        self.assertEqual(proxy.sleep(0, 'value'), 'value')
+        self.assertNotEqual(proxy.pid(), os.getpid())
+        self.assertNotEqual(proxy.pid(), self.pid)
+
+    def test_restart(self):
+        proxy = self.start(workers=1)
+        first = proxy.pid()
+        os.kill(first, signal.SIGKILL)
+        time.sleep(0.3)
+        second = proxy.pid()
+        self.assertNotEqual(first, second)
+        self.assertEqual(proxy.sleep(0, 1), 1)
+
+    def test_reload(self):
+        proxy = self.start(workers=1)
+        first = proxy.pid()
+        os.kill(self.pid, signal.SIGHUP)
+        deadline = time.time() + 5
+        while proxy.pid() == first and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertNotEqual(proxy.pid(), first)
+
+    def test_reload_busy(self):
+        proxy = self.start(workers=1)
+        first = proxy.pid()
+        result = []
+        call = threading.Thread(target=lambda: result.append(proxy.sleep(1, 'done')))
+        call.start()
+        time.sleep(0.2)
+        os.kill(self.pid, signal.SIGHUP)
+        time.sleep(0.2)
+        # the replacement serves while the old worker finishes its call
+        start = time.time()
+        self.assertNotEqual(proxy.pid(), first)
+        self.assertLess(time.time() - start, 0.4)
+        call.join()
+        self.assertEqual(result, ['done'])
+
+    def test_drain(self):
+        proxy = self.start()
+        proxy.pid()
+        result = []
+        call = threading.Thread(target=lambda: result.append(proxy.sleep(0.5, 'done')))
+        call.start()
+        time.sleep(0.2)
+        os.kill(self.pid, signal.SIGTERM)
+        call.join()
+        self.assertEqual(result, ['done'])
+        self.assertEqual(self.wait_master(), 0)
+        self.assertRaises(socket.error, proxy.sleep, 0, 1)
+
+    def test_keepalive_drain(self):
+        Handler.keepalive = True
+        try:
+            proxy = self.start(workers=1)
+            self.assertEqual(proxy.sleep(0, 1), 1)
+            start = time.time()
+            os.kill(self.pid, signal.SIGTERM)
+            # the idle keep-alive connection does not hold up the worker
+            self.assertEqual(self.wait_master(), 0)
+            self.assertLess(time.time() - start, 1.5)
+        finally:
+            Handler.keepalive = False
+
+    @unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'), 'needs SO_REUSEPORT')
+    def test_reuse_port(self):
+        probe = socket.socket()
+        probe.bind(('localhost', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+        proxy = self.start(port=port, reuse_port=True)
+        # the workers bind their sockets after they have been started
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            try:
+                socket.create_connection(('localhost', port)).close()
+                break
+            except socket.error:
+                time.sleep(0.05)
+        self.assertEqual(proxy.sleep(0, 1), 1)
+        self.assertTrue(1 <= len(self.worker_pids(proxy)) <= 2)
+
+    def test_supervisor_killed(self):
+        proxy = self.start(workers=1)
+        worker = proxy.pid()
+        os.kill(self.pid, signal.SIGKILL)
+        self.wait_master()
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            try:
+                os.kill(worker, 0)
+            except OSError:
+                break
+            time.sleep(0.05)
+        else:
+            self.fail('the worker outlived its supervisor')
+
+    def test_reuse_port_needs_port(self):
+        self.assertRaises(ValueError, PreforkServer, ('localhost', 0), Handler,
+                          reuse_port=True)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+
+import multiprocessing
+import os
+import time
+import unittest
+
+import jsonrpc.common
+import jsonrpc.proxy
+from jsonrpc.prefork import PreforkServer
+from jsonrpc.procpool import ProcessPool, default_pool
+from jsonrpc.registry import MethodRegistry
+from jsonrpc.server import ServerEvents, JSON_RPC
+from jsonrpc.tests.test_registry import call
+from jsonrpc.tests.test_server import start_server
+
+
+registry = MethodRegistry()
+pool = ProcessPool(processes=1, timeout=2)
+
+@registry.method(process=True)
+def pid():
+    return os.getpid()
+
+@registry.method('inline.pid')
+def inline_pid():
+    return os.getpid()
+
+@registry.method(process=pool)
+def power(base, exponent=2):
+    return base ** exponent
+
+@registry.method(process=pool, postprocess=lambda result, args, kwargs: -result)
+def negpower(base, exponent=2):
+    return base ** exponent
+
+@registry.method(process=pool)
+def invalid():
+    raise jsonrpc.common.InvalidParams
+
+@registry.method(process=pool)
+def fail(message):
+    raise ValueError(message)
+
+@registry.method(process=pool)
+def sleep(delay):
+    time.sleep(delay)
+
+@registry.method(process=pool, cache=True)
+def cached_pid(key):
+    return os.getpid(), key
+
+
+class ProcessServer(ServerEvents):
+    methods = registry
+
+
+class TestProcessPool(unittest.TestCase):
+    def setUp(self):
+        self.events = ProcessServer(None)
+
+    def tearDown(self):
+        pool.close()
+        default_pool().close()
+
+    def test_call(self):
+        self.assertNotEqual(call(self.events, 'pid'), os.getpid())
+        self.assertEqual(call(self.events, 'inline.pid'), os.getpid())
+        self.assertEqual(call(self.events, 'power', 3), 9)
+        self.assertEqual(call(self.events, 'power', 2, exponent=10), 1024)
+        self.assertEqual(call(self.events, 'negpower', 3), -9)
+
+    def test_options(self):
+        self.assertIs(registry['pid'].process, default_pool())
+        self.assertIs(registry['power'].process, pool)
+        self.assertIsNone(registry['inline.pid'].process)
+
+    def test_invalid_params(self):
+        # checked before the call is sent to a worker
+        self.assertRaises(jsonrpc.common.InvalidParams,
+                          call, self.events, 'power', 1, 2, 3)
+
+    def test_errors(self):
+        self.assertRaises(jsonrpc.common.InvalidParams,
+                          call, self.events, 'invalid')
+        with self.assertRaises(ValueError) as raised:
+            call(self.events, 'fail', 'message')
+        self.assertEqual(str(raised.exception), 'message')
+
+    def test_timeout(self):
+        self.assertRaises(multiprocessing.TimeoutError,
+                          call, self.events, 'sleep', 3)
+
+    def test_cache(self):
+        first = call(self.events, 'cached_pid', 'a')
+        self.assertNotEqual(first[0], os.getpid())
+        self.assertEqual(call(self.events, 'cached_pid', 'a'), first)
+        self.assertEqual(registry.cache_stats()['cached_pid']['hits'], 1)
+
+    def test_close(self):
+        first = call(self.events, 'power', 2)
+        pool.close()
+        self.assertEqual(call(self.events, 'power', 2), first)
+
+    def test_start(self):
+        registry.start_pools()
+        for started in (pool, default_pool()):
+            self.assertEqual(started._pid, os.getpid())
+            processes = started._pool._pool
+            started.start()
+            self.assertIs(started._pool._pool, processes)
+
+    def test_worker_started(self):
+        class Handler(JSON_RPC):
+            pass
+        server = PreforkServer(('localhost', 0), Handler.customize(ProcessServer), 1)
+        self.addCleanup(server.server_close)
+        server.worker_started(server.server)
+        self.assertEqual(pool._pid, os.getpid())
+
+    def test_forked(self):
+        worker = call(self.events, 'pid')
+        read, write = os.pipe()
+        child = os.fork()
+        if child == 0:
+            try:
+                # the child starts a pool of its own
+                pid = call(self.events, 'pid')
+                os.write(write, str(int(pid not in (worker, os.getpid()))))
+                default_pool().close()
+            finally:
+                os._exit(0)
+        os.waitpid(child, 0)
+        self.assertEqual(os.read(read, 1), '1')
+        os.close(read)
+        os.close(write)
+
+    def test_server(self):
+        class Handler(JSON_RPC):
+            pass
+        httpd, url = start_server(Handler.customize(ProcessServer))
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(url)
+        self.assertEqual(proxy.power(5), 25)
+        self.assertNotEqual(proxy.pid(), os.getpid())
+        self.assertRaises(jsonrpc.common.InvalidParams, proxy.invalid)
+        with self.assertRaises(jsonrpc.common.RPCError) as raised:
+            proxy.fail('message')
+        self.assertEqual(raised.exception.msg, 'message')
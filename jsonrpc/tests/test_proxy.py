@@ -1,10 +1,28 @@
 # -*- coding: utf-8 -*-
 
 
+import collections
+import cookielib
+import httplib
+import json
+import socket
+import struct
+import threading
+import time
 import unittest
+import urllib
+import urllib2
+from cStringIO import StringIO
 
 import jsonrpc.common
 import jsonrpc.proxy
+from jsonrpc.asyncserver import AsyncHTTPServer, AsyncJSON_RPC
+from jsonrpc.cache import MethodCaches, ResultCache
+from jsonrpc.connection import HTTPConnectionPool
+from jsonrpc.jsonutil import Codec
+from jsonrpc.server import JSON_RPC
+from jsonrpc.tests.test_server import (RecordingHandler, ServerTestCase,
+                                       SleepServer, run_threads, start_server)
 
 
 class TestJSONRPCProxy(unittest.TestCase):
@@ -61,3 +79,629 @@ class TestJSONRPCProxy(unittest.TestCase):
         ]
         self.assertEqual(self.proxy.batch_call(batch), [(3, None), (1, None), (4, None)])
 
+
+class TestIDGen(unittest.TestCase):
+    def check_unique(self, idgen):
+        class Events(object):
+            IDGen = idgen
+        events = Events()
+        ids = []
+
+        def generate():
+            ids.extend([events.IDGen for _ in range(1000)])
+
+        threads = [threading.Thread(target=generate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(ids)), 8000)
+
+    def test_counter(self):
+        self.check_unique(jsonrpc.proxy.IDGen())
+
+    def test_hash(self):
+        self.check_unique(jsonrpc.proxy.HashIDGen())
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        class Handler(AsyncJSON_RPC):
+            pass
+
+        class Server(AsyncHTTPServer):
+            idle_timeout = 0.3
+
+        self.httpd = Server(('localhost', 0), Handler.customize(SleepServer))
+        thread = threading.Thread(target=self.httpd.serve_forever, args=(0.1,))
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://localhost:%d/jsonrpc' % self.httpd.server_address[1]
+        self.proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_reuse(self):
+        for n in range(5):
+            self.assertEqual(self.proxy.sleep(0, n), n)
+        self.assertEqual(len(self.httpd.channels()), 1)
+
+    def test_shared(self):
+        child = self.proxy.sleep
+        self.assertIs(child._opener, self.proxy._opener)
+        self.assertEqual(self.proxy.call('sleep', 0, 1), 1)
+        self.assertEqual(self.proxy.batch_call([('sleep', [(0, 2), {}])]),
+                         [(2, None)])
+        self.assertEqual(len(self.httpd.channels()), 1)
+
+    def test_reconnect(self):
+        self.assertEqual(self.proxy.sleep(0, 1), 1)
+        time.sleep(0.6)
+        self.assertEqual(len(self.httpd.channels()), 0)
+        self.assertEqual(self.proxy.sleep(0, 2), 2)
+
+    def test_idle_eviction(self):
+        self.proxy._opener.idle_timeout = 0
+        self.proxy.sleep(0, 1)
+        conn = self.proxy._opener._idle.values()[0][0][0]
+        self.proxy.sleep(0, 2)
+        self.assertIsNone(conn.sock)
+
+    def test_maxsize(self):
+        self.proxy._opener.maxsize = 2
+        results = []
+        threads = [threading.Thread(target=lambda n: results.append(
+                       (self.proxy.sleep(0.2, n), len(self.httpd.channels()))),
+                       args=(n,))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(n for n, _ in results), range(4))
+        self.assertLessEqual(max(count for _, count in results), 2)
+        self.assertEqual(len(self.proxy._opener._idle.values()[0]), 2)
+
+    def test_no_free_connection(self):
+        pool = HTTPConnectionPool(maxsize=1, timeout=0.2)
+        self.addCleanup(pool.clear)
+        data = json.dumps(dict(jsonrpc='2.0', id=1, method='sleep',
+                               params=[0, 1]))
+        stream = pool.open_stream(self.url, data)
+        self.assertRaises(urllib2.URLError, pool.open, self.url, data)
+        self.assertEqual(json.loads(stream.read())['result'], 1)
+        self.assertEqual(json.loads(pool.open(self.url, data).read())['result'], 1)
+
+    def test_cookies(self):
+        self.assertIsInstance(self.proxy._opener.cookiejar, cookielib.CookieJar)
+
+
+class ScriptedServer(object):
+    '''Answer the requests of each keep-alive connection as `actions` says:
+    ``'ok'`` responds, ``'drop'`` closes without responding, ``'reset'``
+    resets the connection and ``'partial'`` closes in the middle of the
+    response'''
+
+    response = ('HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                'Set-Cookie: session=%d\r\nContent-Length: %d\r\n\r\n%s')
+
+    def __init__(self, *actions):
+        self.actions = list(actions)
+        self.received = 0
+        #: the Cookie header of each request
+        self.cookies = []
+        self.sock = socket.socket()
+        self.sock.bind(('localhost', 0))
+        self.sock.listen(5)
+        self.url = 'http://localhost:%d/jsonrpc' % self.sock.getsockname()[1]
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while self.actions:
+            conn, _ = self.sock.accept()
+            fp = conn.makefile('rb')
+            while self.actions:
+                if not fp.readline():
+                    break
+                headers = httplib.HTTPMessage(fp)
+                body = fp.read(int(headers['content-length']))
+                self.received += 1
+                self.cookies.append(headers.get('cookie'))
+                action = self.actions.pop(0)
+                if action == 'ok':
+                    conn.sendall(self.response % (self.received, len(body),
+                                                  body))
+                    continue
+                if action == 'reset':
+                    conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                    struct.pack('ii', 1, 0))
+                elif action == 'partial':
+                    conn.sendall('HTTP/1.1 2')
+                break
+            fp.close()
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class TestRetry(unittest.TestCase):
+    def open(self, *actions):
+        server = ScriptedServer(*actions)
+        self.addCleanup(server.close)
+        pool = HTTPConnectionPool()
+        self.addCleanup(pool.clear)
+        self.assertEqual(pool.open(server.url, '1').read(), '1')
+        return server, pool
+
+    def test_dropped(self):
+        # the server closed the idle connection, the request is sent again
+        server, pool = self.open('ok', 'drop', 'ok')
+        self.assertEqual(pool.open(server.url, '2').read(), '2')
+        self.assertEqual(server.received, 3)
+
+    def test_reset(self):
+        server, pool = self.open('ok', 'reset', 'ok')
+        self.assertRaises(socket.error, pool.open, server.url, '2')
+        self.assertEqual(server.received, 2)
+
+    def test_partial(self):
+        server, pool = self.open('ok', 'partial', 'ok')
+        self.assertRaises(httplib.BadStatusLine, pool.open, server.url, '2')
+        self.assertEqual(server.received, 2)
+
+    def test_cookies(self):
+        server = ScriptedServer('ok', 'ok', 'ok')
+        self.addCleanup(server.close)
+        pool = HTTPConnectionPool(cookiejar=cookielib.CookieJar())
+        self.addCleanup(pool.clear)
+        for data in '123':
+            self.assertEqual(pool.open(server.url, data).read(), data)
+        self.assertEqual(server.cookies, [None, 'session=1', 'session=2'])
+
+    def test_new_connection(self):
+        # requests on a new connection are never sent again
+        server = ScriptedServer('drop', 'ok')
+        self.addCleanup(server.close)
+        pool = HTTPConnectionPool()
+        self.assertRaises(httplib.BadStatusLine, pool.open, server.url, '1')
+        self.assertEqual(server.received, 1)
+
+
+class CountingCodec(Codec):
+    def __init__(self, name):
+        Codec.__init__(self, name, json.dumps, json.loads)
+        self.count = 0
+        encode = self.encode
+
+        def counting_encode(obj, **kw):
+            self.count += 1
+            return encode(obj, **kw)
+        self.encode = counting_encode
+
+
+class TestCodec(unittest.TestCase):
+    def test_override(self):
+        server_codec = CountingCodec('server')
+        proxy_codec = CountingCodec('proxy')
+
+        class Handler(JSON_RPC):
+            codec = server_codec
+
+        httpd, url = start_server(Handler.customize(SleepServer))
+        try:
+            proxy = jsonrpc.proxy.JSONRPCProxy.from_url(url, codec=proxy_codec)
+            self.assertEqual(proxy.sleep(0, 1), 1)
+            self.assertEqual(proxy.batch_call([('sleep', [(0, 2), {}])]),
+                             [(2, None)])
+            self.assertEqual(proxy.call('sleep', 0, 3), 3)
+            self.assertEqual(server_codec.count, 3)
+            self.assertEqual(proxy_codec.count, 3)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+class TestBatchCallIter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class StreamHandler(JSON_RPC):
+            stream_responses = True
+            batch_workers = 4
+            keepalive = True
+        cls.httpd, url = start_server(StreamHandler.customize(SleepServer))
+        cls.proxy = jsonrpc.proxy.JSONRPCProxy.from_url(url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    calls = [('sleep', [(0.3, 'slow'), {}]),
+             ('fail', [(), {}]),
+             ('sleep', [(0, 'fast'), {}])]
+
+    def test_ordered(self):
+        result = list(self.proxy.batch_call_iter(self.calls))
+        self.assertEqual(result[0], ('slow', None))
+        self.assertEqual(result[1][0], None)
+        self.assertEqual(result[1][1]['message'], 'failed')
+        self.assertEqual(result[2], ('fast', None))
+
+    def test_unordered(self):
+        start = time.time()
+        result = self.proxy.batch_call_iter(self.calls, ordered=False)
+        self.assertNotEqual(next(result)[0], 0)
+        self.assertNotEqual(next(result)[0], 0)
+        self.assertLess(time.time() - start, 0.25)
+        self.assertEqual(next(result), (0, ('slow', None)))
+        self.assertEqual(list(result), [])
+
+    def test_missing(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy('http://localhost:1')
+
+        def post_stream(url, data):
+            # the server forgets to answer the second call
+            requests = json.loads(data)
+            body = json.dumps([dict(jsonrpc='2.0', id=request['id'],
+                                    result=request['params'][1])
+                               for request in requests[::2]])
+            headers = httplib.HTTPMessage(
+                StringIO('Content-Type: application/json\r\n\r\n'))
+            return urllib.addinfourl(StringIO(body), headers, url)
+        proxy._post_stream = post_stream
+        calls = [('sleep', [(0, n), {}]) for n in range(3)]
+        missing = (None, dict(code=0, message='no response to the request'))
+        self.assertEqual(list(proxy.batch_call_iter(calls)),
+                         [(0, None), missing, (2, None)])
+        self.assertEqual(list(proxy.batch_call_iter(calls, ordered=False)),
+                         [(0, (0, None)), (2, (2, None)), (1, missing)])
+
+    def test_not_streamed(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy('http://localhost:8007', path='aaa')
+        batch = [('add', [(1, 2), {}]), ('subtract', [(2, 1), {}])]
+        self.assertEqual(list(proxy.batch_call_iter(batch)), [(3, None), (1, None)])
+
+        proxy._set_opener(jsonrpc.proxy.urllib2.build_opener())
+        self.assertEqual(list(proxy.batch_call_iter(batch)), [(3, None), (1, None)])
+
+
+class TestCompression(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class CompressHandler(JSON_RPC):
+            compress_min_size = 100
+
+            def read_data(self):
+                TestCompression.request_encoding = self.headers.getheader('content-encoding')
+                return JSON_RPC.read_data(self)
+
+        cls.httpd, cls.url = start_server(CompressHandler.customize(SleepServer))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def test_request(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url, compress_min_size=100,
+                                                    compress_level=1)
+        self.assertEqual(proxy.sleep(0, 'x' * 200), 'x' * 200)
+        self.assertEqual(self.request_encoding, 'gzip')
+        self.assertEqual(proxy.sleep(0, 'x'), 'x')
+        self.assertEqual(self.request_encoding, None)
+
+    def test_response(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        self.assertEqual(proxy.sleep(0, 'x' * 200), 'x' * 200)
+        self.assertEqual(self.request_encoding, None)
+
+    def test_urllib2(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        proxy._set_opener(jsonrpc.proxy.urllib2.build_opener(
+            jsonrpc.proxy.JSONRPCProcessor()))
+        self.assertEqual(proxy.sleep(0, 'x' * 200), 'x' * 200)
+
+
+class TestBinaryCodec(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class CountingHandler(JSON_RPC):
+            def read_data(self):
+                cls.content_types.append(self.headers.getheader('content-type'))
+                return JSON_RPC.read_data(self)
+
+        class JSONHandler(CountingHandler):
+            codecs = ()
+
+        cls.httpd, cls.url = start_server(CountingHandler.customize(SleepServer))
+        cls.json_httpd, cls.json_url = start_server(JSONHandler.customize(SleepServer))
+
+    @classmethod
+    def tearDownClass(cls):
+        for httpd in (cls.httpd, cls.json_httpd):
+            httpd.shutdown()
+            httpd.server_close()
+
+    def setUp(self):
+        self.content_types[:] = []
+
+    content_types = []
+
+    def test_cbor(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url, codec='cbor')
+        self.assertEqual(proxy.sleep(0, [1.5] * 10), [1.5] * 10)
+        self.assertEqual(proxy.batch_call([('sleep', [(0, 1), {}]), ('fail', [(), {}])])[0],
+                         (1, None))
+        self.assertRaises(jsonrpc.common.MethodNotFound, proxy.missing)
+        self.assertEqual(self.content_types, ['application/cbor'] * 3)
+
+    def test_fallback(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.json_url, codec='cbor')
+        self.assertEqual(proxy.sleep(0, 1), 1)
+        self.assertEqual(proxy.call('sleep', 0, 2), 2)
+        self.assertEqual(self.content_types,
+                         ['application/cbor', 'application/json', 'application/json'])
+
+    def test_batch_call_iter(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url, codec='cbor')
+        self.assertEqual(list(proxy.batch_call_iter([('sleep', [(0, 1), {}])])),
+                         [(1, None)])
+
+
+class TestProxyCache(ServerTestCase):
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.now = 1000.0
+        self.caches = MethodCaches({
+            'sleep': ResultCache(maxsize=10, ttl=10, clock=lambda: self.now),
+            'fail': {},
+        })
+        self.proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url, cache=self.caches)
+
+    def test_call(self):
+        self.assertEqual(self.proxy.sleep(0, [1]), [1])
+        self.assertEqual(self.proxy.sleep(0, [1]), [1])
+        self.assertEqual(self.proxy.call('sleep', 0, [1]), [1])
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.proxy.sleep(0, [2]), [2])
+        self.assertEqual(self.proxy.sleep(delay=0, value=[1]), [1])
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.caches.stats()['sleep']['hits'], 2)
+
+    def test_expiry(self):
+        self.proxy.sleep(0, 1)
+        self.now += 10
+        self.proxy.sleep(0, 1)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_invalidate(self):
+        self.proxy.sleep(0, 1)
+        self.caches.invalidate('sleep', 0, 1)
+        self.proxy.sleep(0, 1)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_errors(self):
+        self.assertRaises(jsonrpc.common.RPCError, self.proxy.fail)
+        self.assertRaises(jsonrpc.common.RPCError, self.proxy.fail)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_not_cached(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        proxy.sleep(0, 1)
+        proxy.sleep(0, 1)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_batch(self):
+        self.proxy.sleep(0, 1)
+        calls = [('sleep', [(0, 1), {}]), ('fail', [(), {}]), ('sleep', [(0, 2), {}])]
+        result = self.proxy.batch_call(calls)
+        self.assertEqual(result[0], (1, None))
+        self.assertEqual(result[1][1]['message'], 'failed')
+        self.assertEqual(result[2], (2, None))
+        self.assertEqual([r['params'] for r in self.requests[1]], [[], [0, 2]])
+
+        self.assertEqual(self.proxy.batch_call(calls[2:]), [(2, None)])
+        self.assertEqual(self.proxy.batch_call(calls[:1]), [(1, None)])
+        self.assertEqual(len(self.requests), 2)
+
+    def test_threads(self):
+        def run(n):
+            return [self.proxy.sleep(0, value % 5) for value in range(20)]
+        results = run_threads(8, run)
+        self.assertEqual(results, [[n % 5 for n in range(20)]] * 8)
+        self.assertTrue(len(self.requests) < 160)
+        self.assertEqual(self.caches.stats()['sleep']['size'], 5)
+
+
+class TestAutoBatch(ServerTestCase):
+    def proxy(self, url=None, **kwargs):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(url or self.url, **kwargs)
+        # stops the batching thread
+        self.addCleanup(proxy.close)
+        return proxy
+
+    def call_threads(self, proxy, count):
+        return run_threads(count, lambda n: proxy.sleep(0, n),
+                           jsonrpc.common.RPCError)
+
+    def test_threads(self):
+        proxy = self.proxy(batch_window=0.1)
+        self.assertEqual(self.call_threads(proxy, 20), range(20))
+        self.assertTrue(len(self.requests) < 20)
+        self.assertTrue(all(isinstance(r, list) for r in self.requests))
+        self.assertEqual(proxy._batcher.calls, 20)
+
+    def test_batch_size(self):
+        proxy = self.proxy(batch_window=0.1, batch_size=3)
+        self.assertEqual(self.call_threads(proxy, 10), range(10))
+        self.assertTrue(all(len(r) <= 3 for r in self.requests))
+        self.assertTrue(len(self.requests) >= 4)
+
+    def test_errors(self):
+        proxy = self.proxy(batch_window=0.05)
+        future1 = proxy.call_async('fail')
+        future2 = proxy.call_async('sleep', 0, 'ok')
+        self.assertEqual(future2.result(), 'ok')
+        self.assertRaises(jsonrpc.common.RPCError, future1.result)
+        self.assertEqual(len(self.requests), 1)
+        self.assertRaises(jsonrpc.common.RPCError, proxy.fail)
+
+    def test_unreachable(self):
+        proxy = self.proxy('http://localhost:1', batch_window=0.01)
+        future = proxy.call_async('sleep', 0, 1)
+        self.assertRaises(Exception, future.result)
+
+    def test_call_async(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        future = proxy.call_async('sleep', 0, 'x')
+        self.assertTrue(future.done())
+        self.assertEqual(future.result(), 'x')
+        self.assertRaises(jsonrpc.common.RPCError, proxy.call_async('fail').result)
+        self.assertEqual(len(self.requests), 2)
+
+    def test_cache(self):
+        caches = MethodCaches({'sleep': {}})
+        proxy = self.proxy(cache=caches, batch_window=0.05)
+        futures = [proxy.call_async('sleep', 0, n) for n in range(3)]
+        self.assertEqual([f.result() for f in futures], [0, 1, 2])
+        self.assertEqual(proxy.sleep(0, 1), 1)
+        self.assertEqual(proxy.call_async('sleep', 0, 2).result(), 2)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(len(self.requests[0]), 3)
+
+    def test_same_id(self):
+        class ConstantId(object):
+            def __get__(self, instance, owner):
+                return 1
+
+        class Events(jsonrpc.proxy.ProxyEvents):
+            IDGen = ConstantId()
+
+        proxy = self.proxy(batch_window=0.05)
+        proxy.customize(Events)
+        futures = [proxy.call_async('sleep', 0, n) for n in range(3)]
+        self.assertEqual(sorted(f.result(5) for f in futures), [0, 1, 2])
+
+    def test_senders(self):
+        active = []
+        most = [0]
+        lock = threading.Lock()
+
+        def send(items):
+            with lock:
+                active.append(1)
+                most[0] = max(most[0], len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+            for request, future in items:
+                future.set_result(request)
+        batcher = jsonrpc.proxy.AutoBatcher(send, window=0, max_size=1,
+                                            senders=2)
+        futures = [batcher.submit(n) for n in range(8)]
+        batcher.close()
+        self.assertEqual([f.result(0) for f in futures], range(8))
+        self.assertEqual(most[0], 2)
+
+    def test_close(self):
+        proxy = self.proxy(batch_window=0.05)
+        future = proxy.call_async('sleep', 0, 'x')
+        proxy.close()
+        # the pending call was sent before the thread stopped
+        self.assertEqual(future.result(0), 'x')
+        self.assertFalse(proxy._batcher._thread.is_alive())
+        self.assertRaises(RuntimeError, proxy.call_async, 'sleep', 0, 'y')
+
+
+class ReversingHandler(RecordingHandler):
+    '''answers the calls of a batch in reverse order'''
+    def write_data(self, code, result):
+        data = json.loads(result)
+        if isinstance(data, list):
+            result = json.dumps(data[::-1])
+        RecordingHandler.write_data(self, code, result)
+
+
+class TestBatchChunks(ServerTestCase):
+    handler_class = ReversingHandler
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.calls = [('sleep', [(0, n), {}]) for n in range(10)]
+
+    def test_order(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        self.assertEqual(proxy.batch_call(self.calls), [(n, None) for n in range(10)])
+        self.assertEqual(len(self.requests), 1)
+
+    def test_chunks(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url, chunk_size=3)
+        self.assertEqual(proxy.batch_call(self.calls), [(n, None) for n in range(10)])
+        self.assertEqual(sorted(len(r) for r in self.requests), [1, 3, 3, 3])
+
+    def test_concurrent(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url, chunk_size=2,
+                                                    chunk_workers=4)
+        calls = [('sleep', [(0.2, n), {}]) for n in range(8)]
+        start = time.time()
+        self.assertEqual(proxy.batch_call(calls), [(n, None) for n in range(8)])
+        self.assertLess(time.time() - start, 1.2)
+
+    def test_errors(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url, chunk_size=2)
+        result = proxy.batch_call(self.calls[:3] + [('fail', [(), {}])])
+        self.assertEqual(result[:3], [(0, None), (1, None), (2, None)])
+        self.assertEqual(result[3][1]['message'], 'failed')
+
+    def failing_proxy(self, **kwargs):
+        '''A proxy whose chunk with the call of 0 can't be sent, and whose
+        chunk with the call of 2 is rejected'''
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url, **kwargs)
+        send = proxy._send
+
+        def failing_send(obj):
+            values = [request.args[1] for request in obj]
+            if 0 in values:
+                raise IOError('unreachable')
+            if 2 in values:
+                return dict(jsonrpc='2.0', id=None,
+                            error=dict(code=-32700, message='Parse error.'))
+            return send(obj)
+        proxy._send = failing_send
+        return proxy
+
+    def test_failed_chunks(self):
+        proxy = self.failing_proxy(chunk_size=2)
+        result = proxy.batch_call(self.calls[:6])
+        self.assertEqual(result[4:], [(4, None), (5, None)])
+        for value, error in result[:2]:
+            self.assertIsNone(value)
+            self.assertIn('unreachable', error['message'])
+        self.assertEqual(result[2:4], [(None, dict(code=-32700, message='Parse error.'))] * 2)
+
+    def test_rejected(self):
+        proxy = self.failing_proxy()
+        result = proxy.batch_call(self.calls[1:4])
+        self.assertEqual(result, [(None, dict(code=-32700, message='Parse error.'))] * 3)
+
+    def test_unreachable(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url('http://localhost:1', chunk_size=2)
+        self.assertRaises(IOError, proxy.batch_call, self.calls)
+
+    def test_dict(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url, chunk_size=1)
+        calls = collections.OrderedDict([('sleep', [(0, 'x'), {}]),
+                                         ('fail', [(), {}])])
+        result = proxy.batch_call(calls)
+        self.assertEqual(result[0], ('x', None))
+        self.assertEqual(result[1][1]['message'], 'failed')
+        calls = collections.OrderedDict(reversed(calls.items()))
+        self.assertEqual(proxy.batch_call(calls)[1], ('x', None))
+        pairs = list(proxy.batch_call_iter(calls))
+        self.assertEqual(pairs[0][1]['message'], 'failed')
+        self.assertEqual(pairs[1], ('x', None))
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+import jsonrpc.common
+import jsonrpc.proxy
+from jsonrpc.common import Request
+from jsonrpc.registry import BindingPlan, MethodRegistry
+from jsonrpc.server import ServerEvents, JSON_RPC
+from jsonrpc.tests.test_server import start_server
+
+
+registry = MethodRegistry()
+
+@registry.method('math.add')
+def add(a, b):
+    return a + b
+
+@registry.method()
+def double(v):
+    return v * 2
+
+@registry.method('math.sum', postprocess=lambda result, args, kwargs: -result)
+def negsum(*args):
+    return sum(args)
+
+
+class Calculator(object):
+    def mul(self, a, b):
+        return a * b
+
+    def _private(self):
+        pass
+
+registry.add_object(Calculator(), namespace='calc')
+
+calls = []
+
+@registry.method()
+def record(a, b=2, *args, **kwargs):
+    calls.append((a, b, args, kwargs))
+
+@registry.method()
+def strict(a, b=2):
+    calls.append((a, b))
+
+
+class RegistryServer(ServerEvents):
+    methods = registry
+
+
+def call(events, method, *args, **kwargs):
+    return events.callmethod(Request(1, method, args, kwargs))
+
+
+class TestMethodRegistry(unittest.TestCase):
+    def setUp(self):
+        self.events = RegistryServer(None)
+
+    def test_names(self):
+        self.assertEqual(sorted(registry),
+                         ['calc.mul', 'double', 'math.add', 'math.sum',
+                          'record', 'strict'])
+        self.assertFalse('calc._private' in registry)
+
+    def test_call(self):
+        self.assertEqual(call(self.events, 'math.add', 1, 2), 3)
+        self.assertEqual(call(self.events, 'double', v=2), 4)
+        self.assertEqual(call(self.events, 'calc.mul', 2, 3), 6)
+
+    def test_postprocess(self):
+        self.assertEqual(call(self.events, 'math.sum', 1, 2, 3), -6)
+
+    def test_missing(self):
+        self.assertRaises(jsonrpc.common.MethodNotFound,
+                          call, self.events, 'math.missing')
+
+    def test_not_callable(self):
+        self.assertRaises(TypeError, registry.register, 'x', None)
+
+    def test_findmethod_tuple(self):
+        class Methods(object):
+            def get(self, name):
+                return (lambda v: v, True)
+
+            def postprocess(self, name, result, args, kwargs):
+                return (name, result)
+
+        class TupleServer(ServerEvents):
+            methods = Methods()
+
+        self.assertEqual(call(TupleServer(None), 'echo', 1), ('echo', 1))
+
+
+class TestInvalidParams(unittest.TestCase):
+    def setUp(self):
+        self.events = RegistryServer(None)
+        calls[:] = []
+
+    def assertInvalid(self, method, *args, **kwargs):
+        self.assertRaises(jsonrpc.common.InvalidParams,
+                          call, self.events, method, *args, **kwargs)
+
+    def test_valid(self):
+        call(self.events, 'strict', 1)
+        call(self.events, 'strict', 1, 3)
+        call(self.events, 'strict', a=1, b=3)
+        call(self.events, 'strict', 1, b=3)
+        call(self.events, 'record', 1, 2, 3, c=4)
+        self.assertEqual(len(calls), 5)
+
+    def test_invalid(self):
+        self.assertInvalid('strict')
+        self.assertInvalid('strict', 1, 2, 3)
+        self.assertInvalid('strict', 1, c=3)
+        self.assertInvalid('strict', 1, a=1)
+        self.assertInvalid('strict', b=1)
+        self.assertInvalid('record', b=1)
+        self.assertInvalid('calc.mul', 1)
+        self.assertEqual(calls, [])
+
+    def test_findmethod(self):
+        class Methods(object):
+            def mul(self, a, b):
+                return a * b
+
+        class AttrServer(ServerEvents):
+            def findmethod(self, method, args=None, kwargs=None):
+                return getattr(Methods(), method, None)
+
+        events = AttrServer(None)
+        self.assertEqual(call(events, 'mul', 2, 3), 6)
+        self.assertRaises(jsonrpc.common.InvalidParams,
+                          call, events, 'mul', 2, 3, 4)
+
+    def test_bind(self):
+        plan = registry['record'].plan
+        self.assertEqual(plan.bind((1,), {}), ((1, 2), {}))
+        self.assertEqual(plan.bind((), dict(a=1, b=3, c=4)), ((1, 3), dict(c=4)))
+        self.assertEqual(plan.bind((1, 3, 5), {}), ((1, 3, 5), {}))
+        plan = registry['calc.mul'].plan
+        self.assertEqual(plan.bind((2,), dict(b=3)), ((2, 3), {}))
+
+    def test_callables(self):
+        class Point(object):
+            def __init__(self, x, y=0):
+                pass
+
+            def __call__(self, a, b, c):
+                pass
+
+        class Classic:
+            def __init__(self, x):
+                pass
+
+            def __call__(self, a, b=1):
+                pass
+
+        def plan(func):
+            plan = BindingPlan.from_callable(func)
+            return plan.names, plan.required
+
+        self.assertEqual(plan(Point), (('x', 'y'), 1))
+        self.assertEqual(plan(Point(1)), (('a', 'b', 'c'), 3))
+        self.assertEqual(plan(Classic), (('x',), 1))
+        self.assertEqual(plan(Classic(1)), (('a', 'b'), 1))
+        point = Point(1)
+        # not what calling the object runs
+        point.__call__ = lambda: None
+        self.assertEqual(plan(point), (('a', 'b', 'c'), 3))
+        self.assertIsNone(BindingPlan.from_callable(object))
+
+        class Events(ServerEvents):
+            methods = dict(point=Point)
+        self.assertIsInstance(call(Events(None), 'point', 1, y=2), Point)
+        self.assertRaises(jsonrpc.common.InvalidParams,
+                          call, Events(None), 'point', 1, 2, 3)
+
+    def test_uninspectable(self):
+        class Events(ServerEvents):
+            methods = dict(length=len)
+        self.assertEqual(call(Events(None), 'length', 'abc'), 3)
+        self.assertRaises(TypeError, call, Events(None), 'length')
+
+
+class TestDottedNames(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Handler(JSON_RPC):
+            pass
+        cls.httpd, url = start_server(Handler.customize(RegistryServer))
+        cls.proxy = jsonrpc.proxy.JSONRPCProxy.from_url(url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def test_proxy(self):
+        self.assertEqual(self.proxy.math.add(1, 2), 3)
+        self.assertEqual(self.proxy.calc.mul(2, 3), 6)
+        self.assertEqual(self.proxy.double(4), 8)
+
+    def test_invalid_params(self):
+        self.assertRaises(jsonrpc.common.InvalidParams,
+                          self.proxy.math.add, 1, 2, 3)
@@ -1,10 +1,21 @@
 # -*- coding: utf-8 -*-
 
 
+import httplib
+import json
+import socket
+import threading
+import time
 import urllib2
 import unittest
 
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+
 import jsonrpc.jsonutil
+from jsonrpc.compression import compress, decompress
+from jsonrpc.connection import HTTPConnectionPool
+from jsonrpc.server import ServerEvents, JSON_RPC
 
 
 PORT = 8007
@@ -17,6 +28,91 @@ def send_json(url, data):
     return result
 
 
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class SleepServer(ServerEvents):
+    def findmethod(self, method, args=None, kwargs=None):
+        return dict(sleep=self.sleep, fail=self.fail).get(method)
+
+    def sleep(self, delay, value):
+        time.sleep(delay)
+        return value
+
+    def fail(self):
+        raise ValueError('failed')
+
+
+def start_server(handler):
+    '''Serve `handler` from a background thread, return the server url'''
+    httpd = ThreadedHTTPServer(('localhost', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return httpd, 'http://localhost:%d/jsonrpc' % httpd.server_address[1]
+
+
+def run_threads(count, func, errors=()):
+    '''Call ``func(n)`` for each n in ``range(count)``, each in a thread of its
+    own, return the results in order.  Exceptions of the classes `errors` are
+    returned in place of a result.'''
+    results = [None] * count
+
+    def run(n):
+        try:
+            results[n] = func(n)
+        except errors, exc:
+            results[n] = exc
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class RecordingHandler(JSON_RPC):
+    '''Appends every decoded request to the list `requests`'''
+    requests = None
+
+    def read_data(self):
+        data = JSON_RPC.read_data(self)
+        self.requests.append(json.loads(data))
+        return data
+
+
+class ServerTestCase(unittest.TestCase):
+    '''Serves `handler_class` customized with `events` to the tests of the
+    class at `url`, the requests received by the current test are in
+    `requests`'''
+
+    handler_class = RecordingHandler
+    events = SleepServer
+
+    @classmethod
+    def setUpClass(cls):
+        class Handler(cls.handler_class):
+            requests = cls.requests = []
+        cls.httpd, cls.url = start_server(Handler.customize(cls.events))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def setUp(self):
+        del self.requests[:]
+
+
+def batch(*calls):
+    return jsonrpc.jsonutil.encode([
+        dict(jsonrpc='2.0', id=n, method=method, params=params)
+        for n, (method, params) in enumerate(calls)
+    ])
+
+
 class TestJSONRPCServer(unittest.TestCase):
     def setUp(self):
         self.id_ = 'an_id'
@@ -152,3 +248,420 @@ class TestJSONRPCServer(unittest.TestCase):
         result = send_json(URL, data)
         self.assertEqual(result, {"jsonrpc": "2.0", "error": {"code": -32600, "message": "Invalid Request."}, "id": None})
 
+
+
+class TestBatchWorkers(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class BatchHandler(JSON_RPC):
+            batch_workers = 4
+        cls.httpd, cls.url = start_server(BatchHandler.customize(SleepServer))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def test_concurrent(self):
+        data = batch(*[('sleep', [0.2, n]) for n in range(4)])
+        start = time.time()
+        result = send_json(self.url, data)
+        self.assertLess(time.time() - start, 0.6)
+        self.assertEqual([x['result'] for x in result], range(4))
+
+    def test_order(self):
+        data = batch(('sleep', [0.2, 'slow']), ('fail', []), ('sleep', [0, 'fast']))
+        result = send_json(self.url, data)
+        self.assertEqual([x['id'] for x in result], [0, 1, 2])
+        self.assertEqual(result[0]['result'], 'slow')
+        self.assertEqual(result[1]['error']['message'], 'failed')
+        self.assertEqual(result[2]['result'], 'fast')
+
+    def test_parallelism(self):
+        class LimitedHandler(JSON_RPC):
+            batch_workers = 4
+            batch_parallelism = 2
+        httpd, url = start_server(LimitedHandler.customize(SleepServer))
+        try:
+            data = batch(*[('sleep', [0.2, n]) for n in range(4)])
+            start = time.time()
+            result = send_json(url, data)
+            self.assertGreaterEqual(time.time() - start, 0.4)
+            self.assertEqual([x['result'] for x in result], range(4))
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+class TestKeepAlive(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class KeepAliveHandler(JSON_RPC):
+            keepalive = True
+            idle_timeout = 0.5
+            max_requests = 3
+        cls.httpd, cls.url = start_server(KeepAliveHandler.customize(SleepServer))
+        cls.port = cls.httpd.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def post(self, conn, body, headers={}):
+        conn.request('POST', '/jsonrpc', body, headers)
+        resp = conn.getresponse()
+        return jsonrpc.jsonutil.decode(resp.read())
+
+    def test_reuse(self):
+        conn = httplib.HTTPConnection('localhost', self.port)
+        self.assertEqual(self.post(conn, batch(('sleep', [0, 1])))[0]['result'], 1)
+        sock = conn.sock
+        self.assertEqual(self.post(conn, batch(('sleep', [0, 2])))[0]['result'], 2)
+        self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_max_requests(self):
+        conn = httplib.HTTPConnection('localhost', self.port)
+        for n in range(3):
+            self.post(conn, batch(('sleep', [0, n])))
+        # the response to the third request closed the connection
+        self.assertIsNone(conn.sock)
+        conn.close()
+
+    def test_pipelining(self):
+        sock = socket.create_connection(('localhost', self.port))
+        data = ''
+        for delay in [0.2, 0]:
+            body = batch(('sleep', [delay, delay]))
+            data += ('POST /jsonrpc HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s'
+                     % (len(body), body))
+        sock.sendall(data)
+        fp = sock.makefile('rb')
+        for delay in [0.2, 0]:
+            self.assertTrue(fp.readline().startswith('HTTP/1.1 200'))
+            headers = httplib.HTTPMessage(fp)
+            body = fp.read(int(headers['content-length']))
+            self.assertEqual(jsonrpc.jsonutil.decode(body)[0]['result'], delay)
+        fp.close()
+        sock.close()
+
+    def test_chunked(self):
+        body = batch(('sleep', [0, 'chunked']))
+        conn = httplib.HTTPConnection('localhost', self.port)
+        conn.putrequest('POST', '/jsonrpc')
+        conn.putheader('Transfer-Encoding', 'chunked')
+        conn.endheaders()
+        for chunk in (body[:10], body[10:]):
+            conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+        conn.send('0\r\n\r\n')
+        result = jsonrpc.jsonutil.decode(conn.getresponse().read())
+        self.assertEqual(result[0]['result'], 'chunked')
+        conn.close()
+
+    def test_idle_timeout(self):
+        conn = httplib.HTTPConnection('localhost', self.port)
+        self.post(conn, batch(('sleep', [0, 1])))
+        conn.sock.settimeout(5)
+        self.assertEqual(conn.sock.recv(1), '')
+        conn.close()
+
+
+class TestStreamBatches(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class StreamHandler(JSON_RPC):
+            stream_batches = True
+            keepalive = True
+        cls.httpd, cls.url = start_server(StreamHandler.customize(SleepServer))
+        cls.port = cls.httpd.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def test_batch(self):
+        result = send_json(self.url, batch(*[('sleep', [0, n]) for n in range(1000)]))
+        self.assertEqual([x['result'] for x in result], range(1000))
+
+    def test_single(self):
+        data = '{"jsonrpc": "2.0", "params": [0, 1], "method": "sleep", "id": 1}'
+        self.assertEqual(send_json(self.url, data)['result'], 1)
+
+    def test_invalid_entries(self):
+        data = ('[{"jsonrpc": "2.0", "params": [0, 1], "method": "sleep", "id": 1},'
+                ' 1, {"jsonrpc": "2.1", "method": "sleep", "id": 3}]')
+        result = send_json(self.url, data)
+        self.assertEqual(result[0]['result'], 1)
+        self.assertEqual(result[1]['error']['code'], -32600)
+        self.assertEqual(result[2]['error']['code'], -32600)
+        self.assertEqual(result[2]['id'], 3)
+        self.assertEqual(len(result), 3)
+
+    def test_parse_error(self):
+        # the call which ran before the error keeps its response
+        data = '[{"jsonrpc": "2.0", "params": [0, 1], "method": "sleep", "id": 1}, {'
+        result = send_json(self.url, data)
+        self.assertEqual(result[0]['result'], 1)
+        self.assertEqual(result[1]['error']['code'], -32700)
+        self.assertEqual(result[1]['id'], None)
+        self.assertEqual(len(result), 2)
+        # nothing ran
+        self.assertEqual(send_json(self.url, '[{oops')['error']['code'], -32700)
+
+    def test_codec(self):
+        decoded = []
+
+        def loads(data):
+            decoded.append(data)
+            return json.loads(data)
+
+        class CodecHandler(JSON_RPC):
+            stream_batches = True
+            codec = jsonrpc.jsonutil.Codec('recording', json.dumps, loads)
+        httpd, url = start_server(CodecHandler.customize(SleepServer))
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        result = send_json(url, batch(('sleep', [0, 1]), ('sleep', [0, 2])))
+        self.assertEqual([x['result'] for x in result], [1, 2])
+        self.assertEqual(len(decoded), 2)
+
+    def test_empty(self):
+        self.assertEqual(send_json(self.url, ' [ ] ')['error']['code'], -32600)
+
+    def test_keepalive(self):
+        conn = httplib.HTTPConnection('localhost', self.port)
+        for data in ['[1, 2] trailing', batch(('sleep', [0, 'next']))]:
+            conn.request('POST', '/jsonrpc', data)
+            result = jsonrpc.jsonutil.decode(conn.getresponse().read())
+        self.assertEqual(result[0]['result'], 'next')
+        conn.close()
+
+
+class TestStreamResponses(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class StreamHandler(JSON_RPC):
+            stream_responses = True
+            batch_workers = 4
+            keepalive = True
+        cls.httpd, cls.url = start_server(StreamHandler.customize(SleepServer))
+        cls.pool = HTTPConnectionPool()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.clear()
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def stream(self, url, data):
+        resp = self.pool.open_stream(url, data, {'Accept': 'application/x-ndjson'})
+        start = time.time()
+        for line in resp:
+            yield time.time() - start, jsonrpc.jsonutil.decode(line)
+
+    def test_arrival(self):
+        data = batch(('sleep', [0.5, 'slow']), ('fail', []), ('sleep', [0, 'fast']))
+        result = list(self.stream(self.url, data))
+        self.assertEqual(sorted(x['id'] for _, x in result), [0, 1, 2])
+        self.assertEqual(result[-1][1]['result'], 'slow')
+        self.assertLess(result[0][0], 0.4)
+        errors = [x for _, x in result if 'error' in x]
+        self.assertEqual(errors[0]['error']['message'], 'failed')
+
+    def test_reuse(self):
+        for n in range(3):
+            result = list(self.stream(self.url, batch(('sleep', [0, n]))))
+            self.assertEqual(result[0][1]['result'], n)
+        self.assertEqual(len(self.pool._idle.values()[0]), 1)
+
+    def test_not_negotiated(self):
+        result = send_json(self.url, batch(('sleep', [0, 1]), ('sleep', [0, 2])))
+        self.assertEqual([x['result'] for x in result], [1, 2])
+
+    def test_single(self):
+        data = '{"jsonrpc": "2.0", "params": [0, 1], "method": "sleep", "id": 1}'
+        resp = self.pool.open(self.url, data, {'Accept': 'application/x-ndjson'})
+        self.assertEqual(resp.info().getheader('content-type'), 'application/json')
+        self.assertEqual(jsonrpc.jsonutil.decode(resp.read())['result'], 1)
+
+    def test_without_chunks(self):
+        class StreamHandler(JSON_RPC):
+            stream_responses = True
+        httpd, url = start_server(StreamHandler.customize(SleepServer))
+        try:
+            data = batch(*[('sleep', [0, n]) for n in range(10)])
+            result = [x['result'] for _, x in self.stream(url, data)]
+            self.assertEqual(result, range(10))
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def test_log(self):
+        logged = []
+
+        class LoggingServer(SleepServer):
+            def log(self, response, txrequest, error=False):
+                logged.append((response, error))
+
+        class StreamHandler(JSON_RPC):
+            stream_responses = True
+        httpd, url = start_server(StreamHandler.customize(LoggingServer))
+        try:
+            data = batch(('sleep', [0, 1]), ('fail', []), ('sleep', [0, 2]))
+            self.assertEqual(len(list(self.stream(url, data))), 3)
+            deadline = time.time() + 5
+            while not logged and time.time() < deadline:
+                time.sleep(0.01)
+            # once per request, with every response
+            self.assertEqual(len(logged), 1)
+            responses, error = logged[0]
+            self.assertEqual(sorted(r.id for r in responses), [0, 1, 2])
+            self.assertTrue(error)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def test_parse_error(self):
+        class StreamHandler(JSON_RPC):
+            stream_responses = True
+            stream_batches = True
+        httpd, url = start_server(StreamHandler.customize(SleepServer))
+        try:
+            data = '[{"jsonrpc": "2.0", "params": [0, 1], "method": "sleep", "id": 1}, {'
+            result = [x for _, x in self.stream(url, data)]
+            self.assertEqual(result[0]['result'], 1)
+            self.assertEqual(result[1]['error']['code'], -32700)
+            self.assertEqual(result[1]['id'], None)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+class TestCompression(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class CompressHandler(JSON_RPC):
+            compress_min_size = 200
+            max_decoded_size = 5000
+            stream_responses = True
+        cls.httpd, cls.url = start_server(CompressHandler.customize(SleepServer))
+        cls.port = cls.httpd.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def post(self, body, headers):
+        conn = httplib.HTTPConnection('localhost', self.port)
+        conn.request('POST', '/jsonrpc', body, headers)
+        resp = conn.getresponse()
+        data = resp.read()
+        conn.close()
+        return resp.getheader('content-encoding'), data
+
+    def test_large(self):
+        data = batch(*[('sleep', [0, n]) for n in range(20)])
+        for encoding in ('gzip', 'deflate'):
+            used, body = self.post(data, {'Accept-Encoding': encoding})
+            self.assertEqual(used, encoding)
+            result = jsonrpc.jsonutil.decode(decompress(body, encoding))
+            self.assertEqual([x['result'] for x in result], range(20))
+
+    def test_small(self):
+        used, body = self.post(batch(('sleep', [0, 1])), {'Accept-Encoding': 'gzip'})
+        self.assertEqual(used, None)
+        self.assertEqual(jsonrpc.jsonutil.decode(body)[0]['result'], 1)
+
+    def test_not_accepted(self):
+        data = batch(*[('sleep', [0, n]) for n in range(20)])
+        for accept in (None, 'gzip;q=0', 'br'):
+            used, body = self.post(data, {'Accept-Encoding': accept} if accept else {})
+            self.assertEqual(used, None)
+            self.assertEqual(len(jsonrpc.jsonutil.decode(body)), 20)
+
+    def test_request(self):
+        data = compress(batch(('sleep', [0, 1])), 'deflate')
+        used, body = self.post(data, {'Content-Encoding': 'deflate'})
+        self.assertEqual(jsonrpc.jsonutil.decode(body)[0]['result'], 1)
+
+    def test_bad_request(self):
+        used, body = self.post('not gzip', {'Content-Encoding': 'gzip'})
+        self.assertEqual(jsonrpc.jsonutil.decode(body)['error']['code'], -32700)
+
+    def test_decoded_size(self):
+        # a small request which decodes to more than max_decoded_size
+        data = compress(' ' * 10000 + batch(('sleep', [0, 1])), 'gzip', 9)
+        self.assertLess(len(data), 1000)
+        used, body = self.post(data, {'Content-Encoding': 'gzip'})
+        self.assertEqual(jsonrpc.jsonutil.decode(body)['error']['code'], -32700)
+
+    def test_stream(self):
+        pool = HTTPConnectionPool()
+        data = batch(*[('sleep', [0, n]) for n in range(20)])
+        resp = pool.open_stream(self.url, data, {'Accept': 'application/x-ndjson'})
+        self.assertEqual(resp.info().getheader('content-encoding'), 'gzip')
+        result = [jsonrpc.jsonutil.decode(line)['result'] for line in resp]
+        self.assertEqual(result, range(20))
+
+
+class TestCodecNegotiation(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.httpd, cls.url = start_server(JSON_RPC.customize(SleepServer))
+        cls.port = cls.httpd.server_address[1]
+        cls.cbor = jsonrpc.jsonutil.get_codec('cbor')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def post(self, body, headers):
+        conn = httplib.HTTPConnection('localhost', self.port)
+        conn.request('POST', '/jsonrpc', body, headers)
+        resp = conn.getresponse()
+        data = resp.read()
+        conn.close()
+        return resp.getheader('content-type'), data
+
+    def test_binary_request(self):
+        data = self.cbor.to_bytes([{'jsonrpc': '2.0', 'method': 'sleep',
+                                    'params': [0, [0.5] * 10], 'id': 1}])
+        ctype, body = self.post(data, {'Content-Type': 'application/cbor'})
+        self.assertEqual(ctype, 'application/cbor')
+        self.assertEqual(self.cbor.decode(body)[0]['result'], [0.5] * 10)
+
+    def test_accept(self):
+        data = batch(('sleep', [0, 1]))
+        ctype, body = self.post(data, {'Accept': 'application/cbor, application/json'})
+        self.assertEqual(ctype, 'application/cbor')
+        self.assertEqual(self.cbor.decode(body)[0]['result'], 1)
+
+        ctype, body = self.post(data, {'Accept': '*/*'})
+        self.assertEqual(ctype, 'application/json')
+        self.assertEqual(jsonrpc.jsonutil.decode(body)[0]['result'], 1)
+
+    def test_parse_error(self):
+        ctype, body = self.post('\xff', {'Content-Type': 'application/cbor'})
+        self.assertEqual(ctype, 'application/cbor')
+        self.assertEqual(self.cbor.decode(body)['error']['code'], -32700)
+
+    def test_disabled(self):
+        class JSONHandler(JSON_RPC):
+            codecs = ()
+        httpd, url = start_server(JSONHandler.customize(SleepServer))
+        try:
+            data = self.cbor.to_bytes({'jsonrpc': '2.0', 'method': 'sleep',
+                                       'params': [0, 1], 'id': 1})
+            req = urllib2.Request(url, data, {'Content-Type': 'application/cbor',
+                                              'Accept': 'application/cbor'})
+            resp = urllib2.urlopen(req)
+            self.assertEqual(resp.info().getheader('content-type'), 'application/json')
+            result = jsonrpc.jsonutil.decode(resp.read())
+            self.assertEqual(result['error']['code'], -32700)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import jsonrpc.common
+from jsonrpc.shm import RingBuffer, ShmJSON_RPC, ShmJSONRPCProxy, \
+                        ShmJSONRPCServer
+from jsonrpc.tests.test_asyncproxy import CountingEvents
+from jsonrpc.tests.test_server import SleepServer
+from jsonrpc.utilities import TimeoutError
+
+
+class LargeServer(SleepServer):
+    def findmethod(self, method, args=None, kwargs=None):
+        if method == 'large':
+            return lambda size: 'x' * size
+        return SleepServer.findmethod(self, method, args, kwargs)
+
+
+class TestRingBuffer(unittest.TestCase):
+    def setUp(self):
+        self.mm = mmap.mmap(-1, RingBuffer.size(64))
+        self.read_bell, self.write_bell = os.pipe()
+        self.ring = RingBuffer(self.mm, 0, 64, self.read_bell)
+
+    def tearDown(self):
+        self.mm.close()
+        os.close(self.read_bell)
+        os.close(self.write_bell)
+
+    def test_frames(self):
+        for n in range(100):
+            # the frames wrap around the end of the ring
+            self.ring.put('x' * (n % 30))
+            self.ring.put('')
+            self.assertEqual(self.ring.get(), 'x' * (n % 30))
+            self.assertEqual(self.ring.get(), '')
+
+    def test_too_large(self):
+        self.assertRaises(ValueError, self.ring.put, 'x' * 61)
+        self.ring.put('x' * 60)
+        self.assertEqual(self.ring.get(), 'x' * 60)
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertRaises(TimeoutError, self.ring.get, 0.1)
+        self.assertTrue(0.1 <= time.time() - start < 0.5)
+
+    def test_full(self):
+        self.ring.put('a' * 40)
+
+        def consume():
+            time.sleep(0.1)
+            self.ring.get()
+        thread = threading.Thread(target=consume)
+        thread.start()
+        # blocks until the consumer made room
+        self.ring.put('b' * 40)
+        thread.join()
+        self.assertEqual(self.ring.get(), 'b' * 40)
+
+    def test_wake_up(self):
+        ring = RingBuffer(self.mm, 0, 64, self.write_bell)
+        ring.park_interval = 10
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.ring.get(5)))
+        thread.start()
+        time.sleep(0.1)
+        start = time.time()
+        ring.put('ring')
+        thread.join()
+        self.assertEqual(result, ['ring'])
+        self.assertLess(time.time() - start, 1)
+
+
+class TestShmTransport(unittest.TestCase):
+    def setUp(self):
+        class Handler(ShmJSON_RPC):
+            pass
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'segment')
+        self.server = ShmJSONRPCServer(self.path, Handler.customize(LargeServer),
+                                       capacity=4096)
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.1,))
+        thread.daemon = True
+        thread.start()
+        self.proxy = ShmJSONRPCProxy.from_url('shm://' + self.path, timeout=5)
+
+    def tearDown(self):
+        self.proxy.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def test_call(self):
+        self.assertEqual(self.proxy.sleep(0, 'value'), 'value')
+        self.assertEqual(self.proxy.sleep(delay=0, value=[1]), [1])
+        self.assertRaises(jsonrpc.common.RPCError, self.proxy.fail)
+        self.assertRaises(jsonrpc.common.MethodNotFound, self.proxy.missing)
+
+    def test_batch(self):
+        result = self.proxy.batch_call([('sleep', [(0, 1), {}]), ('fail', [(), {}])])
+        self.assertEqual(result[0], (1, None))
+        self.assertEqual(result[1][1]['message'], 'failed')
+        self.assertEqual(list(self.proxy.batch_call_iter([('sleep', [(0, 2), {}])])),
+                         [(2, None)])
+
+    def test_threads(self):
+        results = {}
+
+        def run(n):
+            results[n] = [self.proxy.sleep(0, [n, m]) for m in range(20)]
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, dict((n, [[n, m] for m in range(20)])
+                                       for n in range(4)))
+
+    def test_events(self):
+        proxy = ShmJSONRPCProxy.from_url('shm://' + self.path).customize(CountingEvents)
+        proxy._set_opener(self.proxy._opener)
+        CountingEvents.responses[:] = []
+        proxy.sleep(0, 1)
+        self.assertEqual(len(CountingEvents.responses), 1)
+
+    def test_large_response(self):
+        self.assertEqual(self.proxy.large(4000), 'x' * 4000)
+        self.assertRaises(jsonrpc.common.RPCError, self.proxy.large, 5000)
+        self.assertRaises(ValueError, self.proxy.sleep, 0, 'x' * 5000)
+        self.assertEqual(self.proxy.sleep(0, 1), 1)
+
+    def test_timeout(self):
+        proxy = ShmJSONRPCProxy.from_url('shm://' + self.path, timeout=0.1)
+        proxy._set_opener(self.proxy._opener)
+        self.proxy._opener.timeout = 0.1
+        self.assertRaises(TimeoutError, proxy.sleep, 0.3, 1)
+        self.proxy._opener.timeout = 5
+        # the late response is skipped
+        self.assertEqual(proxy.sleep(0, 2), 2)
+
+    def test_stale_response(self):
+        stale = ShmJSONRPCProxy.from_url('shm://' + self.path, timeout=0.1)
+        self.assertRaises(TimeoutError, stale.sleep, 0.3, 'stale')
+        stale.close()
+        # a response with another id is skipped, even once the new client
+        # attached
+        self.assertEqual(self.proxy.sleep(0, 'fresh'), 'fresh')
+        self.assertEqual(self.proxy.sleep(0, 'next'), 'next')
+
+    def test_attach_clears(self):
+        self.server.channel.responses.put('{"jsonrpc": "2.0", "id": 1, "result": 0}')
+        proxy = ShmJSONRPCProxy.from_url('shm://' + self.path, timeout=5)
+        self.addCleanup(proxy.close)
+        self.assertEqual(proxy.sleep(0, 'fresh'), 'fresh')
+
+    def test_other_process(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                proxy = ShmJSONRPCProxy.from_url('shm://' + self.path, timeout=5)
+                ok = [proxy.sleep(0, n) for n in range(100)] == range(100)
+            finally:
+                os._exit(0 if ok else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def test_not_a_segment(self):
+        path = os.path.join(self.dir, 'other')
+        open(path, 'w').close()
+        self.assertRaises(IOError, ShmJSONRPCProxy.from_url, 'shm://' + path)
+        self.assertRaises(ValueError, ShmJSONRPCProxy.from_url, 'http://localhost')
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+
+import socket
+import threading
+import time
+import unittest
+
+import jsonrpc.common
+from jsonrpc.tcpproxy import TCPClient, TCPJSONRPCProxy
+from jsonrpc.tcpserver import StreamJSON_RPC
+from jsonrpc.tests.test_asyncproxy import CountingEvents
+from jsonrpc.tests.test_server import SleepServer
+from jsonrpc.tests.test_tcpserver import start_tcp_server
+from jsonrpc.utilities import Future, TimeoutError
+
+
+class TestTCPJSONRPCProxy(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Handler(StreamJSON_RPC):
+            pass
+        cls.server, cls.url = start_tcp_server(Handler.customize(SleepServer))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.proxy = TCPJSONRPCProxy.from_url(self.url)
+
+    def tearDown(self):
+        self.proxy.close()
+
+    def test_call(self):
+        self.assertEqual(self.proxy.sleep(0, 'value'), 'value')
+        self.assertEqual(self.proxy.sleep(delay=0, value=[1]), [1])
+
+    def test_error(self):
+        self.assertRaises(jsonrpc.common.RPCError, self.proxy.fail)
+        self.assertRaises(jsonrpc.common.MethodNotFound, self.proxy.missing)
+
+    def test_threads(self):
+        results = {}
+
+        def run(n):
+            results[n] = self.proxy.sleep(0.2, n)
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(10)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, dict((n, n) for n in range(10)))
+        self.assertLess(time.time() - start, 1)
+
+    def test_batch(self):
+        result = self.proxy.batch_call([('sleep', [(0, 1), {}]), ('fail', [(), {}])])
+        self.assertEqual(result[0], (1, None))
+        self.assertEqual(result[1][1]['message'], 'failed')
+
+    def test_batch_call_iter(self):
+        calls = [('sleep', [(0.3, 'slow'), {}]), ('sleep', [(0, 'fast'), {}])]
+        self.assertEqual(list(self.proxy.batch_call_iter(calls)),
+                         [('slow', None), ('fast', None)])
+        self.assertEqual(list(self.proxy.batch_call_iter(calls, ordered=False)),
+                         [(1, ('fast', None)), (0, ('slow', None))])
+
+    def test_connection_lost(self):
+        calls = [('sleep', [(0, 'fast'), {}]), ('sleep', [(0.5, 'slow'), {}])]
+        missing = (None, dict(code=0, message='no response to the request'))
+        for ordered, expected in [(True, [('fast', None), missing]),
+                                  (False, [(0, ('fast', None)), (1, missing)])]:
+            result = self.proxy.batch_call_iter(calls, ordered)
+            first = next(result)
+            self.proxy._opener.close()
+            self.assertEqual([first] + list(result), expected)
+
+    def test_events(self):
+        proxy = TCPJSONRPCProxy.from_url(self.url).customize(CountingEvents)
+        try:
+            CountingEvents.responses[:] = []
+            proxy.sleep(0, 1)
+            self.assertEqual(len(CountingEvents.responses), 1)
+        finally:
+            proxy.close()
+
+    def test_timeout(self):
+        proxy = TCPJSONRPCProxy.from_url(self.url, timeout=0.1)
+        try:
+            self.assertRaises(TimeoutError, proxy.sleep, 0.3, 1)
+            # the late response is not taken for the one of another call
+            self.assertRaises(TimeoutError, proxy.sleep, 0.3, 2)
+            self.assertEqual(proxy.sleep(0, 3), 3)
+        finally:
+            proxy.close()
+
+    def test_reconnect(self):
+        self.assertEqual(self.proxy.sleep(0, 1), 1)
+        self.proxy._opener.close()
+        self.assertEqual(self.proxy.sleep(0, 2), 2)
+
+    def test_refused(self):
+        proxy = TCPJSONRPCProxy.from_url('tcp://localhost:1')
+        self.assertRaises(IOError, proxy.sleep, 0, 1)
+
+    def test_response_without_id(self):
+        error = ('{"jsonrpc": "2.0", "id": null, '
+                 '"error": {"code": -32700, "message": "Parse error."}}')
+        client = TCPClient(('localhost', 1))
+        sock, other = socket.socketpair()
+        self.addCleanup(other.close)
+        client._sock = sock
+        first, second = Future(), Future()
+        client._pending[1] = first
+        client._received(sock, error)
+        # the only request in flight
+        self.assertEqual(first.result(0)['error']['code'], -32700)
+
+        client._pending[2] = first = Future()
+        client._pending[3] = second
+        client._received(sock, error)
+        # can't be matched to either request
+        self.assertRaises(IOError, first.result, 0)
+        self.assertRaises(IOError, second.result, 0)
+        self.assertIsNone(client._sock)
+
+    def test_url(self):
+        self.assertRaises(ValueError, TCPJSONRPCProxy.from_url, 'http://localhost:1')
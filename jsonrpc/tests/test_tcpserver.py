@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import socket
+import threading
+import time
+import unittest
+
+from jsonrpc.tcpserver import StreamJSON_RPC, TCPJSONRPCServer
+from jsonrpc.tests.test_asyncserver import request
+from jsonrpc.tests.test_server import SleepServer, batch
+
+
+def start_tcp_server(handler, server_class=TCPJSONRPCServer):
+    '''Serve `handler` from a background thread, return the server url'''
+    server = server_class(('localhost', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'tcp://localhost:%d' % server.server_address[1]
+
+
+class TestTCPJSONRPCServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        class Handler(StreamJSON_RPC):
+            pass
+        cls.server, _ = start_tcp_server(Handler.customize(SleepServer))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.sock = socket.create_connection(self.server.server_address)
+        self.rfile = self.sock.makefile('rb')
+
+    def tearDown(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def send(self, *messages):
+        self.sock.sendall(''.join(m + '\n' for m in messages))
+
+    def receive(self):
+        return json.loads(self.rfile.readline())
+
+    def receive_all(self, count):
+        '''Receive `count` responses, which arrive in the order their calls
+        complete, by id'''
+        return dict((r['id'], r) for r in (self.receive() for _ in range(count)))
+
+    def test_call(self):
+        self.send(request('sleep', [0, 'value'], id=7))
+        self.assertEqual(self.receive(), dict(jsonrpc='2.0', id=7, result='value'))
+
+    def test_error(self):
+        self.send(request('fail', []), request('missing', [], id=2))
+        responses = self.receive_all(2)
+        self.assertEqual(responses[1]['error']['message'], 'failed')
+        self.assertEqual(responses[2]['error']['code'], -32601)
+
+    def test_parse_error(self):
+        self.send('{"jsonrpc": ', request('sleep', [0, 1]))
+        responses = self.receive_all(2)
+        self.assertEqual(responses[None]['error']['code'], -32700)
+        self.assertEqual(responses[1]['result'], 1)
+
+    def test_batch(self):
+        self.send(batch(('sleep', [0, 'a']), ('sleep', [0, 'b'])))
+        self.assertEqual([r['result'] for r in self.receive()], ['a', 'b'])
+
+    def test_notification(self):
+        self.send(json.dumps(dict(jsonrpc='2.0', method='sleep', params=[0, 1])),
+                  request('sleep', [0, 2]))
+        self.assertEqual(self.receive()['result'], 2)
+
+    def test_out_of_order(self):
+        start = time.time()
+        self.send(request('sleep', [0.3, 'slow'], id=1),
+                  request('sleep', [0, 'fast'], id=2))
+        self.assertEqual(self.receive()['id'], 2)
+        self.assertEqual(self.receive()['id'], 1)
+        self.assertLess(time.time() - start, 0.6)
+
+    def test_concurrent(self):
+        start = time.time()
+        self.send(*[request('sleep', [0.2, n], id=n) for n in range(10)])
+        results = sorted(self.receive()['result'] for _ in range(10))
+        self.assertEqual(results, range(10))
+        self.assertLess(time.time() - start, 1)
+
+    def test_close_while_running(self):
+        self.send(request('sleep', [0.1, 1]))
+        self.sock.shutdown(socket.SHUT_WR)
+        self.assertEqual(self.receive()['result'], 1)
+        self.assertEqual(self.rfile.readline(), '')
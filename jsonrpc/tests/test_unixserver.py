@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import unittest
+
+import jsonrpc.common
+import jsonrpc.proxy
+from jsonrpc.server import JSON_RPC
+from jsonrpc.tests.test_asyncproxy import CountingEvents
+from jsonrpc.tests.test_server import SleepServer
+from jsonrpc.unixserver import UnixHTTPServer
+
+
+class TestUnixHTTPServer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'rpc.sock')
+        self.url = 'unix://' + self.path
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def start(self, keepalive=False, server_class=UnixHTTPServer):
+        class Handler(JSON_RPC):
+            pass
+        Handler.keepalive = keepalive
+        httpd = server_class(self.path, Handler.customize(SleepServer))
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        return httpd
+
+    def test_call(self):
+        self.start()
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        self.assertEqual(proxy._get_url(), self.url)
+        self.assertEqual(proxy.sleep(0, 'value'), 'value')
+        self.assertRaises(jsonrpc.common.RPCError, proxy.fail)
+        result = proxy.batch_call([('sleep', [(0, 1), {}]), ('sleep', [(0, 2), {}])])
+        self.assertEqual(result, [(1, None), (2, None)])
+
+    def test_keepalive(self):
+        self.start(keepalive=True)
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        self.assertEqual([proxy.sleep(0, n) for n in range(5)], range(5))
+        self.assertEqual(len(proxy._opener._idle[('unix', self.path)]), 1)
+
+    def test_events(self):
+        self.start()
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url).customize(CountingEvents)
+        CountingEvents.responses[:] = []
+        proxy.sleep(0, 1)
+        self.assertEqual(len(CountingEvents.responses), 1)
+
+    def test_socket_file(self):
+        class Server(UnixHTTPServer):
+            mode = 0600
+        httpd = self.start(server_class=Server)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0600)
+        self.assertRaises(socket.error, UnixHTTPServer, self.path, JSON_RPC)
+        # the failed server leaves the socket of the running one alone
+        self.assertTrue(os.path.exists(self.path))
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        self.assertEqual(proxy.sleep(0, 1), 1)
+        httpd.shutdown()
+        httpd.server_close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_mode_ignores_umask(self):
+        class Server(UnixHTTPServer):
+            mode = 0660
+        umask = os.umask(0077)
+        try:
+            self.start(server_class=Server)
+        finally:
+            os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0660)
+
+    def test_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self.start()
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        self.assertEqual(proxy.sleep(0, 1), 1)
+
+    def test_not_listening(self):
+        proxy = jsonrpc.proxy.JSONRPCProxy.from_url(self.url)
+        self.assertRaises(socket.error, proxy.sleep, 0, 1)
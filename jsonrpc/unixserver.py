@@ -0,0 +1,123 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+
+"""
+Serve :py:class:`jsonrpc.server.JSON_RPC` on a unix domain socket.
+
+Callers on the same host skip the TCP/IP stack of the loopback interface,
+access to the service is controlled by the permissions of the socket file:
+
+    handler = JSON_RPC.customize(MyServerEvents)
+    httpd = UnixHTTPServer('/var/run/myservice.sock', handler)
+    httpd.serve_forever()
+
+The proxy connects with ``JSONRPCProxy.from_url('unix:///var/run/myservice.sock')``.
+"""
+
+import errno
+import os
+import socket
+import stat
+from SocketServer import ThreadingMixIn, UnixStreamServer
+
+from jsonrpc.utilities import public
+
+
+@public
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    '''An HTTP server listening on the unix socket `path`, which serves each
+    connection from a thread of its own.
+
+    A socket file left behind by a server which is gone is replaced, the
+    socket file is removed by :py:meth:`server_close`.
+
+    :param str path: the file name of the socket
+    :param handler_class: a customized subclass of
+                          :py:class:`jsonrpc.server.JSON_RPC`
+    '''
+
+    daemon_threads = True
+
+    #: Size of the listen() backlog
+    request_queue_size = 1024
+
+    #: Permissions of the socket file, e.g. ``0660``, ``None`` leaves them
+    #: to the umask
+    mode = None
+
+    #: Set once this server bound its socket file, only then does
+    #: :py:meth:`server_close` remove it
+    bound = False
+
+    def server_bind(self):
+        self._remove_stale()
+        if self.mode is None:
+            UnixStreamServer.server_bind(self)
+        else:
+            # the socket file is created with the right permissions, there
+            # is no moment where the umask applies
+            umask = os.umask(0777 & ~self.mode)
+            try:
+                UnixStreamServer.server_bind(self)
+            finally:
+                os.umask(umask)
+        self.bound = True
+
+    def _remove_stale(self):
+        try:
+            if not stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+                return
+        except OSError:
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.server_address)
+        except socket.error, exc:
+            if exc.errno == errno.ECONNREFUSED:
+                os.unlink(self.server_address)
+            return
+        finally:
+            probe.close()
+        raise socket.error(errno.EADDRINUSE, 'a server is listening on {0}'
+                                             .format(self.server_address))
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if not self.bound:
+            # the file may be the socket of another server
+            return
+        self.bound = False
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
@@ -1,4 +1,6 @@
+import logging
 import sys
+import threading
 
 
 def public(f):
@@ -16,3 +18,68 @@ def public(f):
     return f
 
 public(public)  # Emulate decorating ourself
+
+
+@public
+class TimeoutError(Exception):
+    '''Raised when waiting on a :py:class:`Future` times out'''
+
+
+@public
+class Future(object):
+    '''The result of a call which is completed by another thread'''
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def _complete(self, result, exception):
+        with self._lock:
+            if self._event.is_set():
+                raise RuntimeError('future already completed')
+            self._result, self._exception = result, exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def _run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            logging.getLogger(__name__).exception(
+                'exception calling callback for %r', self)
+
+    def set_result(self, result):
+        self._complete(result, None)
+
+    def set_exception(self, exception):
+        self._complete(None, exception)
+
+    def add_done_callback(self, callback):
+        '''call `callback(future)` once the future is completed, this happens
+        in the thread which completes it, or right away if it already is
+        '''
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def exception(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise TimeoutError
+        return self._exception
+
+    def result(self, timeout=None):
+        '''wait for the result, raise the exception the call failed with'''
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result